@@ -0,0 +1,343 @@
+import csv
+import glob
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+NEW_SESSION = "New chat session"
+HISTORY_TYPES = ("include", "exclude", "cancel", "apply", "chat", "recommendation")
+OPERATION_TYPES = ("include", "exclude")
+CSV_HEADER = ["type", "content", "time"]
+# main_new 的会话记录 <user_id>_task<N>.csv，不是用户操作历史
+_TASK_FILE = re.compile(r"_task\d+\.csv$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    time TEXT NOT NULL,
+    prev_op INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_history_user_session
+    ON history (user_id, session, type, time);
+CREATE INDEX IF NOT EXISTS idx_history_user_type ON history (user_id, type);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    session INTEGER NOT NULL,
+    live_op INTEGER
+);
+CREATE TABLE IF NOT EXISTS tombstones (
+    target_id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    time TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS migrated_files (
+    name TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    migrated_at TEXT NOT NULL
+);
+"""
+
+
+# 被撤销（有墓碑）的记录对所有查询不可见
+LIVE = "NOT EXISTS (SELECT 1 FROM tombstones WHERE target_id = history.id)"
+
+
+def _record(row) -> dict:
+    return {"type": row[0], "content": row[1], "time": row[2]}
+
+
+class HistoryStore:
+    """
+    用户操作历史（原 history/<user_id>.csv），存放在一个 WAL 模式的 SQLite 数据库里。
+
+    每条记录带 session：该用户到这条记录为止 "New chat session" 的条数，
+    users 表保存每个用户当前的 session，因此会话计数、本会话记录、
+    最近一条某类型记录都走索引，不随历史长度增长。
+    每个线程一个连接；写入在 BEGIN IMMEDIATE 事务里完成，多个进程同时写也安全。
+
+    撤销：history 只追加不修改。include/exclude 记录的 prev_op 指向写入时
+    仍有效的上一条 include/exclude，users.live_op 指向最近一条有效的，
+    二者构成一个栈；撤销就是为栈顶写一条墓碑并把 live_op 退回 prev_op，
+    常数时间，且在写事务里完成，并发撤销互不覆盖。
+    带墓碑的记录由后台压缩（compact）真正删除。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._compactor = None
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, history_dir: str = "history") -> "HistoryStore":
+        return cls(os.getenv("HISTORY_DB", os.path.join(history_dir, "history.sqlite3")))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- 写入 ----------
+    def _insert(self, conn, user_id: str, record_type: str, content: str, time: str):
+        """在调用方的写事务里追加一条记录并维护 users 的 session 与 live_op。"""
+        row = conn.execute(
+            "SELECT session, live_op FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        session, live_op = row if row else (0, None)
+        if record_type == "chat" and content == NEW_SESSION:
+            session += 1
+        is_operation = record_type in OPERATION_TYPES
+        cursor = conn.execute(
+            "INSERT INTO history (user_id, session, type, content, time, prev_op) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, session, record_type, content, time, live_op if is_operation else None),
+        )
+        if is_operation:
+            live_op = cursor.lastrowid
+        conn.execute(
+            "INSERT INTO users (user_id, session, live_op) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "session = excluded.session, live_op = excluded.live_op",
+            (user_id, session, live_op),
+        )
+
+    def ensure_user(self, user_id: str):
+        """
+        新用户先写入一条 "New chat session"，与原先创建 CSV 文件时写入的首行相同。
+        """
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute(
+                "SELECT 1 FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone():
+                self._insert(conn, user_id, "chat", NEW_SESSION, datetime.now().isoformat())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append(self, user_id: str, record_type: str, content: str, time: str):
+        self.ensure_user(user_id)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert(conn, user_id, record_type, content, time)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def undo_last_operation(self, user_id: str) -> bool:
+        """撤销最近一条有效的 include/exclude，没有时返回 False。"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT live_op FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None or row[0] is None:
+                conn.execute("COMMIT")
+                return False
+            target = row[0]
+            prev_op = conn.execute(
+                "SELECT prev_op FROM history WHERE id = ?", (target,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO tombstones (target_id, user_id, time) VALUES (?, ?, ?)",
+                (target, user_id, datetime.now().isoformat()),
+            )
+            conn.execute(
+                "UPDATE users SET live_op = ? WHERE user_id = ?", (prev_op, user_id)
+            )
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def compact(self) -> int:
+        """
+        删除带墓碑的记录及其墓碑，返回删除的记录数。
+        被撤销的记录已不在任何用户的撤销栈里，删除后栈指针仍然有效。
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute(
+                "DELETE FROM history WHERE id IN (SELECT target_id FROM tombstones)"
+            ).rowcount
+            conn.execute("DELETE FROM tombstones")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if removed:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return removed
+
+    def start_compaction(self, interval: float = 300.0):
+        """启动后台线程，每 interval 秒压缩一次。"""
+        if self._compactor is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    removed = self.compact()
+                except sqlite3.Error as e:
+                    print(f"[History] 压缩失败: {e}")
+                    continue
+                if removed:
+                    print(f"[History] 已压缩 {removed} 条撤销的记录")
+
+        self._compactor = threading.Thread(target=run, daemon=True)
+        self._compactor.start()
+
+    # ---------- 查询 ----------
+    def records(self, user_id: str) -> list:
+        """该用户的全部记录，按写入顺序。"""
+        rows = self._connect().execute(
+            f"SELECT type, content, time FROM history WHERE user_id = ? AND {LIVE} ORDER BY id",
+            (user_id,),
+        )
+        return [_record(row) for row in rows]
+
+    def session_count(self, user_id: str) -> int:
+        row = self._connect().execute(
+            "SELECT session FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def last_record(self, user_id: str, record_type: str = None):
+        """最近一条记录（可限定类型），没有时返回 None。"""
+        if record_type is None:
+            sql = (
+                f"SELECT type, content, time FROM history WHERE user_id = ? AND {LIVE} "
+                "ORDER BY id DESC LIMIT 1"
+            )
+            args = (user_id,)
+        else:
+            sql = (
+                "SELECT type, content, time FROM history WHERE user_id = ? AND type = ? "
+                f"AND {LIVE} ORDER BY id DESC LIMIT 1"
+            )
+            args = (user_id, record_type)
+        row = self._connect().execute(sql, args).fetchone()
+        return _record(row) if row else None
+
+    def current_session(self, user_id: str) -> list:
+        """最近一次 "New chat session" 之后的记录（不含该标记），按写入顺序。"""
+        rows = self._connect().execute(
+            "SELECT type, content, time FROM history "
+            "WHERE user_id = ? AND session = (SELECT session FROM users WHERE user_id = ?) "
+            f"AND NOT (type = 'chat' AND content = ?) AND {LIVE} ORDER BY id",
+            (user_id, user_id, NEW_SESSION),
+        )
+        return [_record(row) for row in rows]
+
+    def pending_operations(self, user_id: str) -> list:
+        """
+        最近一条 apply 之后的 include/exclude 记录，按写入顺序；
+        与原实现一样不看最后一条记录（通常是刚写入的 apply）。
+        """
+        conn = self._connect()
+        last = conn.execute(
+            f"SELECT id FROM history WHERE user_id = ? AND {LIVE} ORDER BY id DESC LIMIT 1",
+            (user_id,),
+        ).fetchone()
+        if last is None:
+            return []
+        last_apply = conn.execute(
+            "SELECT MAX(id) FROM history WHERE user_id = ? AND type = 'apply' AND id < ?",
+            (user_id, last[0]),
+        ).fetchone()[0]
+        rows = conn.execute(
+            "SELECT type, content, time FROM history WHERE user_id = ? "
+            f"AND type IN ('include', 'exclude') AND id > ? AND id < ? AND {LIVE} ORDER BY id",
+            (user_id, last_apply or 0, last[0]),
+        )
+        return [_record(row) for row in rows]
+
+    # ---------- 迁移 ----------
+    def migrate_csv_dir(self, history_dir: str) -> int:
+        """
+        把 history_dir 下的 <user_id>.csv 导入数据库，已导入过的文件跳过，返回导入的行数。
+        与原读取逻辑一致：首行一律视为表头丢弃，列数不为 3 的行忽略。
+        _task 会话记录按文件名跳过；其余文件只读首行，首行既不是表头也不是
+        已知历史类型的（意图日志等）不是用户历史，不导入。
+        是否已导入在写事务里再确认一次，多个 worker 同时启动时每个文件只导入一次。
+        """
+        conn = self._connect()
+        total = 0
+        for path in sorted(glob.glob(os.path.join(history_dir, "*.csv"))):
+            name = os.path.basename(path)
+            if _TASK_FILE.search(name) or self._is_migrated(conn, name):
+                continue
+            user_id = name[: -len(".csv")]
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if not header or header[0] not in ("type",) + HISTORY_TYPES:
+                    continue
+                records = [row for row in reader if len(row) == 3]
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._is_migrated(conn, name):
+                    conn.execute("COMMIT")
+                    continue
+                for record_type, content, timestamp in records:
+                    self._insert(conn, user_id, record_type, content, timestamp)
+                conn.execute(
+                    "INSERT INTO migrated_files (name, user_id, rows, migrated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (name, user_id, len(records), datetime.now().isoformat()),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"[History] 已导入 {name}: {len(records)} 条")
+            total += len(records)
+        return total
+
+    @staticmethod
+    def _is_migrated(conn, name: str) -> bool:
+        return (
+            conn.execute("SELECT 1 FROM migrated_files WHERE name = ?", (name,)).fetchone()
+            is not None
+        )
+
+
+def main():
+    """用法: python history_store.py migrate [history 目录]"""
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print(main.__doc__)
+        sys.exit(1)
+    history_dir = sys.argv[2] if len(sys.argv) > 2 else "history"
+    store = HistoryStore.from_env(history_dir)
+    count = store.migrate_csv_dir(history_dir)
+    print(f"[History] 共导入 {count} 条记录到 {store.path}")
+
+
+if __name__ == "__main__":
+    main()
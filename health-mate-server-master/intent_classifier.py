@@ -0,0 +1,254 @@
+import csv
+import glob
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+
+from text_normalize import normalize_text
+
+# 规则命中即直接判为要推荐菜谱（置信度 1.0），所以只收录几乎只在要菜谱时才出现的说法。
+# make / prepare / cook 这类动词单独出现时很常见（"how do I make my sleep better"、
+# "prepare for exams"），只在后面跟着菜、汤、餐等对象或以 how to cook 提问时才算；
+# “怎么做”“吃什么药”同理不算。其余情况交给模型与 LLM。
+# 英文词两侧用 (?<![a-z]) / (?![a-z]) 而不是 \b，中英混写（"给我一个recipe"）时也能匹配
+RECIPE_PATTERN = re.compile(
+    r"食谱|菜谱|做法|怎么煮|怎么烧|怎么炖|吃什么(?!药)|推荐.{0,8}(菜|汤|粥|吃|餐)|汤匙|茶匙|"
+    r"(?<![a-z])(recipes?|ingredients?|step[- ]by[- ]step|tablespoons?|teaspoons?|"
+    r"(dinner|lunch|breakfast|meal) ideas?|"
+    r"how (to|do i|can i|should i|do you) (cook|bake|stew|braise|roast|steam|stir[- ]fry)|"
+    r"(cook|bake|make|prepare) (a |an |some |the )?"
+    r"(dish|dishes|meal|meals|soup|salad|porridge|congee|stew|dinner|lunch|breakfast)"
+    r")(?![a-z])",
+    re.IGNORECASE,
+)
+# 指回上一轮推荐的说法（这道菜、第二个食谱、换成…、为什么…）：即使带"食谱""做法"等词，
+# 也多半是对已推荐菜的追问（替换食材、原理、适用人群），规则不直接判 yes，
+# 模型判 yes 时也交给 LLM 确认
+FOLLOW_UP_PATTERN = re.compile(
+    r"这(个|道|些|几|份|款|碗)|那(个|道|些|几|份|款|碗)|上面|刚才|前面|第[一二三四五\d](个|道|份|款)?|"
+    r"代替|替换|换成|为什么|为啥|"
+    r"(?<![a-z])(this|that|these|those|it|the (first|second|third|last|above|previous)|"
+    r"instead of|substitut\w*|swap|replace|why)(?![a-z])",
+    re.IGNORECASE,
+)
+LABELS = ("yes", "no")
+
+
+def question_features(question: str) -> Counter:
+    """归一化问句的字符 2-gram 与 3-gram 计数（英文去掉空格后同样切分）。"""
+    text = normalize_text(question)
+    features = Counter()
+    for n in (2, 3):
+        if len(text) >= n:
+            features.update(text[i : i + n] for i in range(len(text) - n + 1))
+    if not features and text:
+        features[text] = 1
+    return features
+
+
+class IntentDecision:
+    def __init__(self, label, confidence: float, source: str, follow_up: bool = False):
+        self.label = label  # "yes" / "no"，无法判断时为 None
+        self.confidence = confidence
+        self.source = source  # "rules" / "model" / "none"
+        self.follow_up = follow_up  # 问句含 FOLLOW_UP_PATTERN 的追问说法
+
+
+class IntentClassifier:
+    """
+    clarify_query_intend 之前的本地意图判断：先用规则，再用字符 n-gram 的多项式朴素贝叶斯。
+    置信度不低于 threshold 时直接采用，否则交给 LLM，LLM 的判断再作为新样本学习。
+    朴素贝叶斯的后验偏于极端，因此阈值取得较高，并且问句里至少有 min_known 个
+    训练中见过的 n-gram 才采用模型（短问句只靠先验时不算）；带追问说法的问句，
+    规则不判，模型判 yes 也交给 LLM，只有判为追问（no）时才直接采用。
+
+    训练样本只取 LLM 给出的判断，追加写入 log_path（question,label,time），
+    重启后从中重新训练；日志不存在时从各会话的 _task CSV 推断一次作为初始样本
+    （该轮有 keyword 记录即判为 yes）。本地判断不写入样本，避免自我强化。
+
+    对比：低置信度回退时记录本地预测与 LLM 是否一致；置信的本地判断按 audit_rate
+    抽样在后台再问一次 LLM，用于估计直接采用时的一致率，据此调整阈值。
+    """
+
+    def __init__(
+        self,
+        log_path: str = None,
+        threshold: float = 0.97,
+        min_samples: int = 30,
+        audit_rate: float = 0.05,
+        min_known: int = 3,
+    ):
+        self.log_path = log_path
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.min_known = min_known
+        self.audit_rate = audit_rate
+        self._counts = {label: Counter() for label in LABELS}
+        self._totals = {label: 0 for label in LABELS}
+        self._docs = {label: 0 for label in LABELS}
+        self._vocabulary = set()
+        self._lock = threading.Lock()
+        self.decisions = Counter()  # 按来源统计：rules / model / llm
+        self.compared = Counter()  # 按来源统计与 LLM 对比的次数
+        self.agreed = Counter()
+        if log_path:
+            self.load()
+
+    @classmethod
+    def from_env(cls, history_dir: str = "history") -> "IntentClassifier":
+        if os.getenv("INTENT_LOCAL", "1") != "1":
+            return cls(threshold=math.inf)
+        return cls(
+            log_path=os.getenv(
+                "INTENT_LOG_PATH", os.path.join(history_dir, "intent_decisions.csv")
+            ),
+            threshold=float(os.getenv("INTENT_CONFIDENCE", "0.97")),
+            min_samples=int(os.getenv("INTENT_MIN_SAMPLES", "30")),
+            audit_rate=float(os.getenv("INTENT_AUDIT_RATE", "0.05")),
+            min_known=int(os.getenv("INTENT_MIN_KNOWN", "3")),
+        )
+
+    # ---------- 训练 ----------
+    def _fit_one(self, question: str, label: str):
+        features = question_features(question)
+        self._counts[label].update(features)
+        self._totals[label] += sum(features.values())
+        self._docs[label] += 1
+        self._vocabulary.update(features)
+
+    def load(self):
+        if not os.path.exists(self.log_path):
+            pairs = self.pairs_from_task_history(os.path.dirname(self.log_path) or ".")
+            for question, label in pairs:
+                self._append_log(question, label)
+        else:
+            with open(self.log_path, newline="", encoding="utf-8") as f:
+                pairs = [
+                    (row["question"], row["label"])
+                    for row in csv.DictReader(f)
+                    if row.get("label") in LABELS
+                ]
+        with self._lock:
+            for question, label in pairs:
+                self._fit_one(question, label)
+        print(f"[Intent] 本地意图模型已载入 {len(pairs)} 条样本")
+
+    @staticmethod
+    def pairs_from_task_history(history_dir: str) -> list:
+        """
+        从 <user>_task<N>.csv 推断 (问题, 判断)：每个会话第 1 轮不经意图判断，跳过；
+        之后各轮有 keyword 记录的为 yes（新一轮推荐），否则为 no（追问）；
+        包含/排除食材的轮次（问题为 JSON）跳过。
+        """
+        pairs = []
+        for path in sorted(glob.glob(os.path.join(history_dir, "*_task*.csv"))):
+            try:
+                df = pd.read_csv(path, encoding="utf-8-sig", dtype={"content": str})
+            except (OSError, ValueError):
+                continue
+            for round_id, rows in df.groupby("round"):
+                questions = rows.loc[rows["type"] == "question", "content"].dropna()
+                if round_id <= 1 or questions.empty:
+                    continue
+                question = questions.iloc[0]
+                if question.lstrip().startswith("{"):
+                    continue
+                label = "yes" if (rows["type"] == "keyword").any() else "no"
+                pairs.append((question, label))
+        return pairs
+
+    def _append_log(self, question: str, label: str):
+        if not self.log_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        is_new = not os.path.exists(self.log_path)
+        with open(self.log_path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(["question", "label", "time"])
+            writer.writerow([question, label, datetime.now().isoformat()])
+
+    def learn(self, question: str, label: str):
+        """加入一条 LLM 给出的判断。"""
+        with self._lock:
+            self._fit_one(question, label)
+            self._append_log(question, label)
+
+    # ---------- 预测 ----------
+    def _model_posterior(self, features: Counter):
+        docs = sum(self._docs.values())
+        if docs < self.min_samples or min(self._docs.values()) == 0:
+            return None
+        vocabulary = len(self._vocabulary) + 1
+        scores = {}
+        for label in LABELS:
+            counts, total = self._counts[label], self._totals[label]
+            score = math.log(self._docs[label] / docs)
+            for feature, n in features.items():
+                score += n * math.log((counts[feature] + 1) / (total + vocabulary))
+            scores[label] = score
+        top = max(scores.values())
+        norm = sum(math.exp(s - top) for s in scores.values())
+        return {label: math.exp(s - top) / norm for label, s in scores.items()}
+
+    def predict(self, question: str) -> IntentDecision:
+        follow_up = FOLLOW_UP_PATTERN.search(question) is not None
+        if not follow_up and RECIPE_PATTERN.search(question):
+            return IntentDecision("yes", 1.0, "rules")
+        features = question_features(question)
+        with self._lock:
+            posterior = self._model_posterior(features) if features else None
+            known = sum(1 for feature in features if feature in self._vocabulary)
+        if posterior is None:
+            return IntentDecision(None, 0.0, "none", follow_up)
+        label = max(posterior, key=posterior.get)
+        confidence = posterior[label] if known >= self.min_known else 0.0
+        return IntentDecision(label, confidence, "model", follow_up)
+
+    def is_confident(self, decision: IntentDecision) -> bool:
+        if decision.label is None or decision.confidence < self.threshold:
+            return False
+        return not (decision.follow_up and decision.label == "yes")
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    # ---------- 统计 ----------
+    def record(self, decision: IntentDecision, used_local: bool):
+        with self._lock:
+            self.decisions[decision.source if used_local else "llm"] += 1
+
+    def compare(self, decision: IntentDecision, llm_label: str):
+        """记录本地预测与 LLM 判断是否一致（本地无法判断时不计）。"""
+        if decision.label is None:
+            return
+        key = decision.source if self.is_confident(decision) else "lowConfidence"
+        with self._lock:
+            self.compared[key] += 1
+            self.agreed[key] += int(decision.label == llm_label)
+
+    def stats(self) -> dict:
+        with self._lock:
+            compared = sum(self.compared.values())
+            agreed = sum(self.agreed.values())
+            confident = self.compared["rules"] + self.compared["model"]
+            confident_agreed = self.agreed["rules"] + self.agreed["model"]
+            total = sum(self.decisions.values())
+            return {
+                "threshold": self.threshold,
+                "auditRate": self.audit_rate,
+                "samples": dict(self._docs),
+                "decisions": dict(self.decisions),
+                "localRate": (total - self.decisions["llm"]) / total if total else 0.0,
+                "compared": dict(self.compared),
+                "agreementRate": agreed / compared if compared else None,
+                "confidentAgreementRate": (
+                    confident_agreed / confident if confident else None
+                ),
+            }
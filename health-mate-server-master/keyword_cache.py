@@ -0,0 +1,171 @@
+import atexit
+import json
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from text_index import char_ngrams
+from text_normalize import normalize_question
+
+
+def question_grams(key: str, n: int = 2) -> set:
+    """归一化问句的字符 n-gram；短于 n 的问句整体作为一个 gram。"""
+    if len(key) < n:
+        return {key} if key else set()
+    return char_ngrams(key, n)
+
+
+class KeywordCache:
+    """
+    extract_keywords 的语义缓存。
+    问句先经 normalize_question 归一化（全半角、繁简、标点与套话），
+    完全相同直接命中；否则用字符 n-gram 倒排索引找候选，
+    Dice 相似度不低于 threshold 的最相近问句视为命中。
+    条目按 LRU 淘汰，并以 JSON 落盘，进程重启后继续使用。
+    """
+
+    FORMAT = 1
+
+    def __init__(
+        self,
+        path: str = None,
+        threshold: float = 0.8,
+        max_entries: int = 5000,
+        n: int = 2,
+        save_every: int = 20,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.n = n
+        self.save_every = save_every
+        self._entries = OrderedDict()  # key -> {"question", "keywords", "grams"}
+        self._postings = {}  # gram -> set(key)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    @classmethod
+    def from_env(cls) -> "KeywordCache":
+        if os.getenv("KEYWORD_CACHE", "1") != "1":
+            return cls(path=None, max_entries=0)
+        return cls(
+            path=os.getenv("KEYWORD_CACHE_PATH", "./cache/keyword_cache.json"),
+            threshold=float(os.getenv("KEYWORD_CACHE_THRESHOLD", "0.8")),
+            max_entries=int(os.getenv("KEYWORD_CACHE_MAX_ENTRIES", "5000")),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _best_match(self, key: str):
+        grams = question_grams(key, self.n)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        best_key, best_score = None, 0.0
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self._entries[candidate]["grams"]))
+            if score > best_score:
+                best_key, best_score = candidate, score
+        return best_key, best_score
+
+    def lookup(self, question: str):
+        """返回缓存的关键词列表（副本），没有足够相似的问句时返回 None。"""
+        key = normalize_question(question)
+        with self._lock:
+            if not key or not self._entries:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self.hits += 1
+                match = key
+            else:
+                match, score = self._best_match(key)
+                if match is None or score < self.threshold:
+                    self.misses += 1
+                    return None
+                self.near_hits += 1
+            self._entries.move_to_end(match)
+            return list(self._entries[match]["keywords"])
+
+    def add(self, question: str, keywords: list):
+        key = normalize_question(question)
+        if not key or not keywords or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._insert(key, question, list(keywords))
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+        if should_save:
+            self.save()
+
+    def _insert(self, key: str, question: str, keywords: list):
+        if key in self._entries:
+            self._remove(key)
+        grams = question_grams(key, self.n)
+        self._entries[key] = {"question": question, "keywords": keywords, "grams": grams}
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        for gram in self._entries.pop(key)["grams"]:
+            keys = self._postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self._postings[gram]
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[KeywordCache] 读取 {self.path} 失败，忽略: {e}")
+            return
+        if data.get("format") != self.FORMAT:
+            return
+        with self._lock:
+            # 文件按最久未用到最近使用的顺序保存；归一化规则变化后重新计算键
+            for entry in data.get("entries", []):
+                key = normalize_question(entry["question"])
+                if key and entry.get("keywords"):
+                    self._insert(key, entry["question"], list(entry["keywords"]))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [
+                {"question": e["question"], "keywords": e["keywords"]}
+                for e in self._entries.values()
+            ]
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"format": self.FORMAT, "entries": entries}, f, ensure_ascii=False
+            )
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "nearHits": self.near_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.near_hits) / total if total else 0.0,
+            }
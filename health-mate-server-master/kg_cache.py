@@ -0,0 +1,166 @@
+import functools
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+_MISSING = object()
+
+
+def text_size(value) -> int:
+    """字符串按实际占用的字节数计。"""
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，同时按条目数和总字节数限额。
+    每个条目的大小由 sizeof(value) 计算，超出任一上限时从最久未用的一端淘汰。
+    单个条目超过 max_bytes 时不缓存。ttl（秒）不为 None 时条目到期后视为未命中。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        max_bytes: int = 32 << 20,
+        sizeof=text_size,
+        ttl: float = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self.bytes -= self._entries.pop(key)[1]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, expires)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """命中时直接返回，否则调用 compute() 并写入缓存。"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def discard_where(self, predicate):
+        """删除 key 满足 predicate 的条目，用于按版本失效。"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxEntries": self.max_entries,
+                "maxBytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": self.hits / total if total else 0.0,
+            }
+
+
+def result_size(value) -> int:
+    """查询结果的大致内存占用：DataFrame 按 memory_usage(deep=True) 计。"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def copy_result(value):
+    """
+    返回给调用方的防御性副本，调用方修改结果不会影响缓存。
+    DataFrame.copy() 不会复制单元格里的 Python 对象，因此被缓存的查询
+    结果中的容器值要用不可变类型（tuple、frozenset），不能用 list 或 dict。
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def versioned_query(method):
+    """
+    缓存 NutritionKG 查询方法的结果。
+    键为 (方法名, 数据集版本, 参数)，缓存放在实例的 query_cache 上；
+    版本变化后旧键不再命中。命中与未命中都返回副本。
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        store = self.store
+        key = (method.__name__, store.version, _freeze(args), _freeze(kwargs))
+        cached = self.query_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            return copy_result(cached)
+
+        result = method(self, *args, **kwargs)
+        # 计算期间发生热更新时结果可能来自新版本，不写入旧版本的键
+        if self.store is store:
+            self.query_cache.put(key, copy_result(result))
+        return result
+
+    return wrapper
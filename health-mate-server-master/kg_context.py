@@ -0,0 +1,185 @@
+import math
+import os
+import re
+import threading
+
+BENEFIT_RELATION = "食谱的功效"
+INGREDIENT_RELATION = "食谱的食材构成"
+SEPARATOR = "、"
+TRUNCATED_MARK = "等"
+
+# 一个 CJK 字、一串字母或数字、一个标点各为一段，分别估算 token 数
+_PIECE = re.compile(r"[㐀-鿿豈-﫿]|[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    本地估算 GPT-4o (o200k_base) 的 token 数，不依赖 tiktoken：
+    常用汉字约 1 token/字，英文单词约 4 字母 1 token，数字约 3 位 1 token，
+    标点各 1 token，空白并入后面的词。对中文为主的提示词误差在一成左右。
+    """
+    tokens = 0
+    for piece in _PIECE.findall(text):
+        if piece[0].isascii() and piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        elif piece[0].isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+def ingredient_rank(cat) -> tuple:
+    """
+    食材按 cat 排序：A1 < A2 < A3 < B1 < … < C < D（D 为调味料），
+    没有分类的排在最后。
+    """
+    if not isinstance(cat, str) or not cat:
+        return ("~",)
+    return (cat[0], cat[1:])
+
+
+def item_tier(relation: str, obj: str, cat, keywords: list) -> int:
+    """
+    条目的保留优先级，数字越小越先保留：
+    0 命中关键词的功效，1 主料（A/B 类），2 其余功效与其他关系，3 辅料（C 类），4 调味料（D 类）。
+    """
+    if relation == BENEFIT_RELATION:
+        if any(kw and (kw in obj or obj in kw) for kw in keywords):
+            return 0
+        return 2
+    if relation == INGREDIENT_RELATION:
+        if isinstance(cat, str) and cat[:1] in ("A", "B"):
+            return 1
+        if cat == "C":
+            return 3
+        return 4
+    return 2
+
+
+def render_block(display_name: str, groups: list) -> str:
+    """groups 为 [(关系, [对象…], 是否截断)]，每个关系一行，对象以顿号分隔。"""
+    lines = [f"【KG for {display_name}】"]
+    for relation, objects, truncated in groups:
+        if objects:
+            line = f"{relation}: " + SEPARATOR.join(objects)
+            lines.append(line + TRUNCATED_MARK if truncated else line)
+    return "\n".join(lines)
+
+
+def compact_blocks(recipes: list, keywords: list, budget: int) -> tuple:
+    """
+    recipes 为 [(显示名, relation_groups)]，relation_groups 来自 NutritionKG.relation_groups。
+    标题总是保留；其余条目按 item_tier 分层，每层在各食谱间轮流加入，
+    超出 budget（估算 token 数）的条目跳过，budget <= 0 表示不限。
+    某层有条目放不下后不再加入更低层的条目，避免一道菜的调味料挤占另一道菜的主料。
+    被截断的关系行以“等”结尾，保留下来的对象维持原有顺序。
+    返回 (文本块列表, 是否有条目被截掉)。
+    """
+    unlimited = budget <= 0
+    used = sum(estimate_tokens(f"【KG for {name}】") for name, _ in recipes)
+    used += 2 * max(len(recipes) - 1, 0)  # 块之间的空行
+
+    # 食谱内按 (层级, 食材分类, 原顺序) 排好，再给同层条目编号，
+    # 全局按 (层级, 编号, 食谱) 排序即得到各食谱轮流加入的顺序；
+    # 命中关键词的功效与主料同属第一轮，两者交替加入
+    ordered = []
+    for r_idx, (_, groups) in enumerate(recipes):
+        entries = sorted(
+            (
+                item_tier(relation, obj, cat, keywords),
+                ingredient_rank(cat) if relation == INGREDIENT_RELATION else (),
+                g_idx,
+                o_idx,
+                obj,
+            )
+            for g_idx, (relation, items) in enumerate(groups)
+            for o_idx, (obj, cat) in enumerate(items)
+        )
+        turns = {}
+        for tier, _, g_idx, o_idx, obj in entries:
+            turn = turns.get(tier, 0)
+            turns[tier] = turn + 1
+            ordered.append((max(tier, 1), turn, tier, r_idx, g_idx, o_idx, obj))
+    ordered.sort(key=lambda e: e[:4])
+
+    kept = set()
+    opened = set()
+    full_level = None
+    for level, _, _, r_idx, g_idx, o_idx, obj in ordered:
+        if full_level is not None and level > full_level:
+            break
+        cost = estimate_tokens(SEPARATOR + obj)
+        if (r_idx, g_idx) not in opened:
+            relation = recipes[r_idx][1][g_idx][0]
+            # 新起一行：换行、关系名、冒号，以及可能的截断标记
+            cost += estimate_tokens(f"\n{relation}: ") + 1
+        if not unlimited and used + cost > budget:
+            full_level = level
+            continue
+        used += cost
+        kept.add((r_idx, g_idx, o_idx))
+        opened.add((r_idx, g_idx))
+
+    blocks = []
+    for r_idx, (name, groups) in enumerate(recipes):
+        rendered = []
+        for g_idx, (relation, items) in enumerate(groups):
+            objects = [
+                obj for o_idx, (obj, _) in enumerate(items) if (r_idx, g_idx, o_idx) in kept
+            ]
+            rendered.append((relation, objects, len(objects) < len(items)))
+        blocks.append(render_block(name, rendered))
+    return blocks, len(kept) < len(ordered)
+
+
+def line_format_tokens(subject: str, display_name: str, groups) -> int:
+    """
+    原先逐行 "菜 -[关系]-> 对象" 格式（每道菜建 DiGraph 后按边拼接）的估算 token 数，
+    直接由 relation_groups 计算，不必渲染文本。原格式按对象去重，
+    同一对象出现在多个关系下时只计一行。用于统计压缩节省的 token。
+    """
+    line_tokens = estimate_tokens(subject) + estimate_tokens(" -[]-> ")
+    tokens = estimate_tokens(f"【KG for {display_name}】")
+    seen = set()
+    for relation, items in groups:
+        relation_tokens = line_tokens + estimate_tokens(relation)
+        for obj, _ in items:
+            if obj not in seen:
+                seen.add(obj)
+                tokens += relation_tokens + estimate_tokens(obj)
+    return tokens
+
+
+class ContextStats:
+    """累计每次请求压缩前后的估算 token 数。"""
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+
+    def record(self, before: int, after: int, truncated: bool):
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += before
+            self.tokens_after += after
+            self.truncated += int(truncated)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            saved = self.tokens_before - self.tokens_after
+            return {
+                "requests": self.requests,
+                "tokensBefore": self.tokens_before,
+                "tokensAfter": self.tokens_after,
+                "tokensSaved": saved,
+                "savedRatio": saved / self.tokens_before if self.tokens_before else 0.0,
+                "truncatedRequests": self.truncated,
+            }
+
+
+def budget_from_env() -> int:
+    return int(os.getenv("KG_CONTEXT_TOKEN_BUDGET", "600"))
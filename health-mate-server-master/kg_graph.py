@@ -0,0 +1,292 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+
+def _csr(keys: np.ndarray, n: int) -> tuple:
+    """按 keys 稳定排序，返回 (offsets, 排序后的原下标)。"""
+    order = np.argsort(keys, kind="stable")
+    offsets = np.searchsorted(keys[order], np.arange(n + 1))
+    return offsets.astype(np.int64), order.astype(np.int64)
+
+
+class CSRGraph:
+    """
+    紧凑的有向多重图。
+    节点是 0..n-1 的整数编号，names[i] 为节点名；关系名编码为整数，
+    出边、入边各存一份 CSR（offsets + 邻居 + 关系编号 + 原始边序号），
+    全部是 NumPy 数组，不为单个节点或边分配 Python 对象。
+    """
+
+    def __init__(
+        self,
+        names: np.ndarray,
+        relation_names: list,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        relations: np.ndarray,
+    ):
+        self.names = names
+        self.relation_names = list(relation_names)
+        self.sources = sources
+        self.targets = targets
+        self.relations = relations
+
+        n = len(names)
+        self.out_offsets, out_order = _csr(sources, n)
+        self.out_targets = targets[out_order]
+        self.out_relations = relations[out_order]
+        self.out_edges = out_order
+
+        self.in_offsets, in_order = _csr(targets, n)
+        self.in_sources = sources[in_order]
+        self.in_relations = relations[in_order]
+        self.in_edges = in_order
+
+        self._name_index = pd.Index(names)
+        self._relation_codes = {r: i for i, r in enumerate(self.relation_names)}
+
+    @classmethod
+    def from_triples(cls, subjects, relations, objects) -> "CSRGraph":
+        """
+        由三元组构建。节点按首次出现的顺序编号（同一行内 subject 先于 object）。
+        """
+        subjects = np.asarray(subjects, dtype=object)
+        objects = np.asarray(objects, dtype=object)
+        interleaved = np.column_stack([subjects, objects]).ravel()
+        node_codes, names = pd.factorize(interleaved, use_na_sentinel=False)
+        rel_codes, relation_names = pd.factorize(
+            np.asarray(relations, dtype=object), use_na_sentinel=False
+        )
+        return cls(
+            np.asarray(names, dtype=object),
+            list(relation_names),
+            node_codes[0::2].astype(np.int64),
+            node_codes[1::2].astype(np.int64),
+            rel_codes.astype(np.int32),
+        )
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame) -> "CSRGraph":
+        return cls.from_triples(df["subject"], df["relation"], df["object"])
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.sources)
+
+    def node_id(self, name) -> int:
+        """节点名 -> 编号，不存在时返回 -1。"""
+        return int(self._name_index.get_indexer([name])[0])
+
+    def node_ids(self, names) -> np.ndarray:
+        ids = self._name_index.get_indexer(list(names))
+        return ids[ids >= 0].astype(np.int64)
+
+    def relation_code(self, relation: str) -> int:
+        return self._relation_codes.get(relation, -1)
+
+    def _relation_mask(self, codes: np.ndarray, relations) -> np.ndarray:
+        if relations is None:
+            return np.ones(len(codes), dtype=bool)
+        if isinstance(relations, str):
+            relations = [relations]
+        wanted = [self.relation_code(r) for r in relations]
+        return np.isin(codes, wanted)
+
+    def out_edges_of(self, node: int, relations=None) -> tuple:
+        """返回 (目标节点, 关系编号)，可按关系名过滤。"""
+        start, end = self.out_offsets[node], self.out_offsets[node + 1]
+        targets, rels = self.out_targets[start:end], self.out_relations[start:end]
+        mask = self._relation_mask(rels, relations)
+        return targets[mask], rels[mask]
+
+    def in_edges_of(self, node: int, relations=None) -> tuple:
+        """返回 (来源节点, 关系编号)，可按关系名过滤。"""
+        start, end = self.in_offsets[node], self.in_offsets[node + 1]
+        sources, rels = self.in_sources[start:end], self.in_relations[start:end]
+        mask = self._relation_mask(rels, relations)
+        return sources[mask], rels[mask]
+
+    def neighbors(self, node: int, relations=None) -> np.ndarray:
+        """后继节点（去重，按编号升序）。"""
+        if node < 0:
+            return _EMPTY_IDS
+        return np.unique(self.out_edges_of(node, relations)[0])
+
+    def predecessors(self, node: int, relations=None) -> np.ndarray:
+        """前驱节点（去重，按编号升序）。"""
+        if node < 0:
+            return _EMPTY_IDS
+        return np.unique(self.in_edges_of(node, relations)[0])
+
+    def expand(self, frontier: np.ndarray, relations=None, direction: str = "out"):
+        """
+        一次性展开一批节点的全部邻边。
+        返回 (owner, neighbor, relation, edge)：owner 为边所属节点在 frontier 中的下标。
+        direction 取 "out" / "in" / "both"。
+        """
+        if direction == "both":
+            parts = [self.expand(frontier, relations, d) for d in ("out", "in")]
+            return tuple(np.concatenate(cols) for cols in zip(*parts))
+        if direction == "out":
+            offsets, nbrs, rels, edges = (
+                self.out_offsets,
+                self.out_targets,
+                self.out_relations,
+                self.out_edges,
+            )
+        else:
+            offsets, nbrs, rels, edges = (
+                self.in_offsets,
+                self.in_sources,
+                self.in_relations,
+                self.in_edges,
+            )
+
+        frontier = np.asarray(frontier, dtype=np.int64)
+        starts = offsets[frontier]
+        lengths = offsets[frontier + 1] - starts
+        owner = np.repeat(np.arange(len(frontier)), lengths)
+        # 每条边在 CSR 数组中的位置：所属节点的起点 + 在该节点内的序号
+        within = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        pos = starts[owner] + within
+        mask = self._relation_mask(rels[pos], relations)
+        pos = pos[mask]
+        return owner[mask], nbrs[pos], rels[pos], edges[pos]
+
+    def k_hop(self, seeds, k: int, relations=None, direction: str = "out") -> tuple:
+        """
+        从 seeds 出发做 BFS，最多走 k 跳。
+        返回 (节点编号, 跳数)，按 BFS 顺序排列，seeds 自身跳数为 0。
+        """
+        seeds = np.unique(np.asarray(seeds, dtype=np.int64))
+        seeds = seeds[seeds >= 0]
+        hops = np.full(len(self), -1, dtype=np.int64)
+        hops[seeds] = 0
+        order = [seeds]
+        frontier = seeds
+        for hop in range(1, k + 1):
+            if len(frontier) == 0:
+                break
+            _, nbrs, _, _ = self.expand(frontier, relations, direction)
+            nbrs = np.unique(nbrs)
+            frontier = nbrs[hops[nbrs] < 0]
+            hops[frontier] = hop
+            order.append(frontier)
+        nodes = np.concatenate(order)
+        return nodes, hops[nodes]
+
+    def typed_paths(
+        self, sources, relation_path: list, direction: str = "out", limit: int = 1000
+    ) -> tuple:
+        """
+        沿给定的关系序列逐跳扩展，例如 [食材关系, 营养关系, 限制关系]。
+        relation_path 的每一项可以是关系名、关系名列表或 None（不限关系）。
+        不走回头路（同一路径内节点不重复），最多返回 limit 条完整路径
+        （limit 只作用于走完全部关系的路径，中间各跳不截断）。
+        返回 (nodes, relations, edges)：形状分别为 (P, h+1)、(P, h)、(P, h)。
+        """
+        nodes = np.asarray(sources, dtype=np.int64).reshape(-1, 1)
+        nodes = nodes[nodes[:, 0] >= 0]
+        rels = np.empty((len(nodes), 0), dtype=np.int64)
+        edges = np.empty((len(nodes), 0), dtype=np.int64)
+        for hop_relations in relation_path:
+            if len(nodes) == 0:
+                break
+            owner, nbrs, hop_rels, hop_edges = self.expand(
+                nodes[:, -1], hop_relations, direction
+            )
+            fresh = ~(nodes[owner] == nbrs[:, None]).any(axis=1)
+            owner, nbrs = owner[fresh], nbrs[fresh]
+            hop_rels, hop_edges = hop_rels[fresh], hop_edges[fresh]
+            nodes = np.column_stack([nodes[owner], nbrs])
+            rels = np.column_stack([rels[owner], hop_rels])
+            edges = np.column_stack([edges[owner], hop_edges])
+        if nodes.shape[1] != len(relation_path) + 1:
+            nodes = nodes[:0, :1].repeat(len(relation_path) + 1, axis=1)
+            rels = rels[:0].reshape(0, len(relation_path))
+            edges = edges[:0].reshape(0, len(relation_path))
+        return nodes[:limit], rels[:limit], edges[:limit]
+
+    def shortest_path(
+        self,
+        source: int,
+        target: int,
+        max_hops: int,
+        relations=None,
+        direction: str = "out",
+    ) -> list:
+        """
+        BFS 求 source 到 target 的一条最短路径，返回边序号列表；
+        超过 max_hops 或不可达时返回 None。
+        """
+        if source < 0 or target < 0:
+            return None
+        if source == target:
+            return []
+        parent_edge = np.full(len(self), -1, dtype=np.int64)
+        parent_node = np.full(len(self), -1, dtype=np.int64)
+        seen = np.zeros(len(self), dtype=bool)
+        seen[source] = True
+        frontier = np.asarray([source], dtype=np.int64)
+        for _ in range(max_hops):
+            if len(frontier) == 0:
+                return None
+            owner, nbrs, _, hop_edges = self.expand(frontier, relations, direction)
+            nbrs, first = np.unique(nbrs, return_index=True)
+            new = ~seen[nbrs]
+            nbrs, first = nbrs[new], first[new]
+            seen[nbrs] = True
+            parent_node[nbrs] = frontier[owner[first]]
+            parent_edge[nbrs] = hop_edges[first]
+            if seen[target]:
+                path, node = [], target
+                while node != source:
+                    path.append(int(parent_edge[node]))
+                    node = parent_node[node]
+                return path[::-1]
+            frontier = nbrs
+        return None
+
+    def edge_subgraph(self, edge_ids: np.ndarray) -> "CSRGraph":
+        """只保留给定的边（按原始边序号），节点重新编号。"""
+        edge_ids = np.sort(np.asarray(edge_ids, dtype=np.int64))
+        return CSRGraph.from_triples(
+            self.names[self.sources[edge_ids]],
+            np.asarray(self.relation_names, dtype=object)[self.relations[edge_ids]],
+            self.names[self.targets[edge_ids]],
+        )
+
+    def subgraph(self, nodes) -> "CSRGraph":
+        """两端都在 nodes 中的边构成的导出子图。"""
+        keep = np.zeros(len(self), dtype=bool)
+        keep[np.asarray(nodes, dtype=np.int64)] = True
+        return self.edge_subgraph(
+            np.flatnonzero(keep[self.sources] & keep[self.targets])
+        )
+
+    def to_networkx(self, node_labels=None) -> nx.DiGraph:
+        """
+        导出为 networkx.DiGraph：节点带 name 属性，边带 relation 属性。
+        node_labels 可指定每个节点在导出图中的标签，默认用节点编号。
+        同一对节点有多条边时按原始顺序以最后一条为准，与逐行 add_edge 一致。
+        """
+        labels = (
+            np.arange(len(self)) if node_labels is None else np.asarray(node_labels)
+        ).tolist()
+        names = self.names.tolist()
+        relation_names = self.relation_names
+        graph = nx.DiGraph()
+        graph.add_nodes_from((labels[i], {"name": names[i]}) for i in range(len(self)))
+        graph.add_edges_from(
+            (labels[s], labels[t], {"relation": relation_names[r]})
+            for s, t, r in zip(
+                self.sources.tolist(), self.targets.tolist(), self.relations.tolist()
+            )
+        )
+        return graph
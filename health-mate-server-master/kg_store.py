@@ -0,0 +1,730 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from text_index import NgramIndex, StringTable, csr_offsets, is_literal
+
+TRIPLE_COLUMNS = ["subject", "relation", "object"]
+
+# 快照格式版本，数组布局或索引内容的构建规则变化时递增，旧快照会被视为过期
+SNAPSHOT_FORMAT = 5
+SNAPSHOT_SUFFIX = ".kg"
+
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+
+class ColumnIndex:
+    """
+    单列的 字符串编号 -> 行号 索引，CSR 形式：
+    rows 为按编号稳定排序后的行号，offsets[code]:offsets[code + 1] 即该编号的行。
+    """
+
+    def __init__(self, rows: np.ndarray, offsets: np.ndarray):
+        self.rows = rows
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, codes: np.ndarray, n_strings: int) -> "ColumnIndex":
+        order = np.argsort(codes, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(codes[order], np.arange(n_strings + 1))
+        return cls(order, offsets.astype(np.int64))
+
+    def arrays(self, prefix: str) -> dict:
+        return {f"{prefix}_rows": self.rows, f"{prefix}_offsets": self.offsets}
+
+    @classmethod
+    def load(cls, load, prefix: str) -> "ColumnIndex":
+        return cls(load(f"{prefix}_rows"), load(f"{prefix}_offsets"))
+
+    def rows_for(self, code: int) -> np.ndarray:
+        if code < 0:
+            return _EMPTY_IDS
+        return self.rows[self.offsets[code] : self.offsets[code + 1]]
+
+    def present_codes(self) -> np.ndarray:
+        return np.flatnonzero(np.diff(self.offsets))
+
+
+class TranslationMap:
+    """
+    单向译名表：keys 为排序后的原文字符串表，targets 为对应译文在全局
+    StringTable 中的编号。fold_case=True 时按小写匹配原文。
+    """
+
+    def __init__(
+        self,
+        keys: StringTable,
+        targets: np.ndarray,
+        strings: StringTable,
+        fold_case: bool = False,
+    ):
+        self.keys = keys
+        self.targets = targets
+        self.strings = strings
+        self.fold_case = fold_case
+
+    @classmethod
+    def build(cls, pairs, strings: StringTable, fold_case: bool = False):
+        """pairs 为 (原文, 译文编号) 序列，同一原文以第一次出现为准。"""
+        mapping = {}
+        for key, target in pairs:
+            mapping.setdefault(key.lower() if fold_case else key, target)
+        keys = StringTable.build(mapping)
+        targets = np.asarray([mapping[k] for k in keys.to_list()], dtype=np.int32)
+        return cls(keys, targets, strings, fold_case)
+
+    def arrays(self, prefix: str) -> dict:
+        return {
+            f"{prefix}_keys_data": self.keys.data,
+            f"{prefix}_keys_offsets": self.keys.offsets,
+            f"{prefix}_targets": self.targets,
+        }
+
+    @classmethod
+    def load(cls, load, prefix: str, strings: StringTable, fold_case: bool):
+        keys = StringTable(load(f"{prefix}_keys_data"), load(f"{prefix}_keys_offsets"))
+        return cls(keys, load(f"{prefix}_targets"), strings, fold_case)
+
+    def get(self, text: str, default=None):
+        if not isinstance(text, str):
+            return default
+        code = self.keys.code_of(text.lower() if self.fold_case else text)
+        if code < 0:
+            return default
+        return self.strings[self.targets[code]]
+
+
+class BilingualAlignment:
+    """
+    中英对齐表，在加载 KG 时一次建好。
+    CSV 中每条中文三元组的下一行就是它的英文版本，据此得到：
+    - partner：逐行的对应行号（没有对应行为 -1）；
+    - recipe / ingredient / benefit 三类名称的中->英、英->中译名表
+      （英->中按小写匹配，重名时以 CSV 中第一次出现为准）。
+    """
+
+    # 中文关系 -> 对应的英文关系
+    RELATION_PAIRS = {"食谱的功效": "Health Benefit", "食谱的食材构成": "Ingredient"}
+    KINDS = {"recipe": None, "ingredient": "食谱的食材构成", "benefit": "食谱的功效"}
+
+    def __init__(self, partner: np.ndarray, maps: dict):
+        self.partner = partner
+        self.maps = maps
+
+    @classmethod
+    def build(cls, codes: dict, strings: StringTable) -> "BilingualAlignment":
+        relation = codes["relation"]
+        partner = np.full(len(relation), -1, dtype=np.int32)
+        zh_codes = [strings.code_of(r) for r in cls.RELATION_PAIRS]
+        is_zh = np.isin(relation, zh_codes)
+        zh_rows = np.flatnonzero(is_zh[:-1] & ~is_zh[1:])
+        en_rows = zh_rows + 1
+        partner[zh_rows] = en_rows
+        partner[en_rows] = zh_rows
+
+        maps = {}
+        for kind, zh_relation in cls.KINDS.items():
+            if zh_relation is None:
+                column, pair_zh, pair_en = "subject", zh_rows, en_rows
+            else:
+                en_relation = strings.code_of(cls.RELATION_PAIRS[zh_relation])
+                keep = (relation[zh_rows] == strings.code_of(zh_relation)) & (
+                    relation[en_rows] == en_relation
+                )
+                column, pair_zh, pair_en = "object", zh_rows[keep], en_rows[keep]
+            zh_vals = codes[column][pair_zh]
+            en_vals = codes[column][pair_en]
+            ok = (zh_vals >= 0) & (en_vals >= 0)
+            zh_vals, en_vals = zh_vals[ok], en_vals[ok]
+            maps[f"{kind}_zh_en"] = TranslationMap.build(
+                zip(strings.decode_many(zh_vals), en_vals), strings
+            )
+            maps[f"{kind}_en_zh"] = TranslationMap.build(
+                zip(strings.decode_many(en_vals), zh_vals), strings, fold_case=True
+            )
+        return cls(partner, maps)
+
+    def arrays(self, prefix: str) -> dict:
+        arrays = {f"{prefix}_partner": self.partner}
+        for name, tmap in self.maps.items():
+            arrays.update(tmap.arrays(f"{prefix}_{name}"))
+        return arrays
+
+    def meta(self) -> dict:
+        return {name: tmap.fold_case for name, tmap in self.maps.items()}
+
+    @classmethod
+    def load(cls, load, prefix: str, strings: StringTable, meta: dict):
+        maps = {
+            name: TranslationMap.load(load, f"{prefix}_{name}", strings, fold_case)
+            for name, fold_case in meta.items()
+        }
+        return cls(load(f"{prefix}_partner"), maps)
+
+    def english_rows(self, row_ids: np.ndarray) -> np.ndarray:
+        """中文行换成对应的英文行；英文行和无对应行的保持不变。"""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        partner = self.partner[row_ids]
+        return np.where(partner > row_ids, partner, row_ids)
+
+    def to_english(self, kind: str, text: str, default=None):
+        return self.maps[f"{kind}_zh_en"].get(text, default)
+
+    def to_chinese(self, kind: str, text: str, default=None):
+        return self.maps[f"{kind}_en_zh"].get(text, default)
+
+
+class IngredientBitmapIndex:
+    """
+    食材 -> 食谱 的位图索引。
+    每个出现过的 subject 分配一个稠密的食谱编号，每种食材以 CSR 形式保存
+    含有它的食谱编号；查询时只为涉及的食材生成 packbits 位图，
+    包含/排除条件全部化为按位与/或/非。
+    """
+
+    # 与原先的 include/exclude 过滤一致，只看中文食材行；英文食材先经对齐表换成中文
+    RELATIONS = ("食谱的食材构成",)
+
+    def __init__(
+        self,
+        recipe_of_code: np.ndarray,
+        ingredient_of_code: np.ndarray,
+        offsets: np.ndarray,
+        recipe_ids: np.ndarray,
+    ):
+        self.recipe_of_code = recipe_of_code
+        self.ingredient_of_code = ingredient_of_code
+        self.offsets = offsets
+        self.recipe_ids = recipe_ids
+        self.n_recipes = int(recipe_of_code.max()) + 1 if len(recipe_of_code) else 0
+
+    @classmethod
+    def build(cls, codes: dict, strings: StringTable, subject_index: ColumnIndex):
+        recipe_of_code = np.full(len(strings), -1, dtype=np.int32)
+        subjects = subject_index.present_codes()
+        recipe_of_code[subjects] = np.arange(len(subjects), dtype=np.int32)
+
+        rel_codes = [strings.code_of(r) for r in cls.RELATIONS]
+        rows = np.flatnonzero(np.isin(codes["relation"], rel_codes))
+        rows = rows[(codes["object"][rows] >= 0) & (codes["subject"][rows] >= 0)]
+        pairs = np.unique(
+            np.stack(
+                [codes["object"][rows], recipe_of_code[codes["subject"][rows]]], axis=1
+            ),
+            axis=0,
+        ).reshape(-1, 2)
+        ingredients, starts = np.unique(pairs[:, 0], return_index=True)
+        ingredient_of_code = np.full(len(strings), -1, dtype=np.int32)
+        ingredient_of_code[ingredients] = np.arange(len(ingredients), dtype=np.int32)
+        offsets = np.append(starts, len(pairs)).astype(np.int64)
+        return cls(recipe_of_code, ingredient_of_code, offsets, pairs[:, 1].copy())
+
+    def arrays(self, prefix: str) -> dict:
+        return {
+            f"{prefix}_recipe_of_code": self.recipe_of_code,
+            f"{prefix}_ingredient_of_code": self.ingredient_of_code,
+            f"{prefix}_offsets": self.offsets,
+            f"{prefix}_recipe_ids": self.recipe_ids,
+        }
+
+    @classmethod
+    def load(cls, load, prefix: str) -> "IngredientBitmapIndex":
+        return cls(
+            load(f"{prefix}_recipe_of_code"),
+            load(f"{prefix}_ingredient_of_code"),
+            load(f"{prefix}_offsets"),
+            load(f"{prefix}_recipe_ids"),
+        )
+
+    def bitmap(self, recipe_ids: np.ndarray) -> np.ndarray:
+        bits = np.zeros(self.n_recipes, dtype=bool)
+        bits[recipe_ids] = True
+        return np.packbits(bits)
+
+    def ingredient_bitmaps(self, ingredient_codes: list) -> np.ndarray:
+        """每种食材一行位图；不在索引中的食材对应全 0 行。"""
+        codes = np.asarray(ingredient_codes, dtype=np.int64)
+        ings = np.where(codes >= 0, self.ingredient_of_code[codes], -1)
+        slices = [
+            self.recipe_ids[self.offsets[i] : self.offsets[i + 1]]
+            if i >= 0
+            else self.recipe_ids[:0]
+            for i in ings
+        ]
+        bits = np.zeros((len(ings), self.n_recipes), dtype=bool)
+        rows = np.repeat(np.arange(len(ings)), [len(r) for r in slices])
+        if len(rows):
+            bits[rows, np.concatenate(slices)] = True
+        return np.packbits(bits, axis=1)
+
+    def filter(
+        self, subject_codes: np.ndarray, include_codes: list, exclude_codes: list
+    ) -> np.ndarray:
+        """
+        返回与 subject_codes 等长的布尔数组：该 subject 是否同时含有全部
+        include 食材且不含任何 exclude 食材。
+        """
+        recipes = self.recipe_of_code[subject_codes]
+        known = recipes >= 0
+        keep = self.bitmap(recipes[known])
+        if include_codes:
+            keep &= np.bitwise_and.reduce(self.ingredient_bitmaps(include_codes))
+        if exclude_codes:
+            keep &= ~np.bitwise_or.reduce(self.ingredient_bitmaps(exclude_codes))
+
+        allowed = np.unpackbits(keep, count=self.n_recipes).astype(bool)
+        mask = np.zeros(len(subject_codes), dtype=bool)
+        mask[known] = allowed[recipes[known]]
+        return mask
+
+
+class BenefitMatrix:
+    """
+    稀疏的 食谱 x 功效 计数矩阵（COO 形式，按行排列）。
+    entry_count 为同一 (食谱, 功效) 在 CSV 中出现的行数，因此对关键词命中的
+    功效做一次稀疏矩阵-向量乘法，得到的就是每个食谱命中的功效行数。
+    食谱编号与 IngredientBitmapIndex 共用。
+    """
+
+    RELATION = "食谱的功效"
+
+    def __init__(
+        self,
+        recipe_codes: np.ndarray,
+        first_row: np.ndarray,
+        benefit_of_code: np.ndarray,
+        entry_recipe: np.ndarray,
+        entry_benefit: np.ndarray,
+        entry_count: np.ndarray,
+    ):
+        self.recipe_codes = recipe_codes
+        self.first_row = first_row
+        self.benefit_of_code = benefit_of_code
+        self.entry_recipe = entry_recipe
+        self.entry_benefit = entry_benefit
+        self.entry_count = entry_count
+        self.n_benefits = int(benefit_of_code.max()) + 1 if len(benefit_of_code) else 0
+
+    @classmethod
+    def build(cls, codes: dict, strings: StringTable, recipe_of_code: np.ndarray):
+        recipe_codes = np.flatnonzero(recipe_of_code >= 0)
+        subject_recipe = np.where(
+            codes["subject"] >= 0, recipe_of_code[codes["subject"]], -1
+        )
+        # 每个食谱在 CSV 中第一次出现的行号，用于同分时保持 CSV 顺序
+        first_row = np.full(len(recipe_codes), np.iinfo(np.int32).max, dtype=np.int32)
+        has_recipe = np.flatnonzero(subject_recipe >= 0)
+        np.minimum.at(first_row, subject_recipe[has_recipe], has_recipe)
+
+        rows = np.flatnonzero(
+            (codes["relation"] == strings.code_of(cls.RELATION))
+            & (codes["object"] >= 0)
+            & (subject_recipe >= 0)
+        )
+        benefits = np.unique(codes["object"][rows])
+        benefit_of_code = np.full(len(strings), -1, dtype=np.int32)
+        benefit_of_code[benefits] = np.arange(len(benefits), dtype=np.int32)
+
+        pairs, counts = np.unique(
+            np.stack(
+                [subject_recipe[rows], benefit_of_code[codes["object"][rows]]], axis=1
+            ),
+            axis=0,
+            return_counts=True,
+        )
+        pairs = pairs.reshape(-1, 2)
+        return cls(
+            recipe_codes.astype(np.int32),
+            first_row,
+            benefit_of_code,
+            pairs[:, 0].astype(np.int32),
+            pairs[:, 1].astype(np.int32),
+            counts.astype(np.int32),
+        )
+
+    def arrays(self, prefix: str) -> dict:
+        return {
+            f"{prefix}_recipe_codes": self.recipe_codes,
+            f"{prefix}_first_row": self.first_row,
+            f"{prefix}_benefit_of_code": self.benefit_of_code,
+            f"{prefix}_entry_recipe": self.entry_recipe,
+            f"{prefix}_entry_benefit": self.entry_benefit,
+            f"{prefix}_entry_count": self.entry_count,
+        }
+
+    @classmethod
+    def load(cls, load, prefix: str) -> "BenefitMatrix":
+        return cls(
+            load(f"{prefix}_recipe_codes"),
+            load(f"{prefix}_first_row"),
+            load(f"{prefix}_benefit_of_code"),
+            load(f"{prefix}_entry_recipe"),
+            load(f"{prefix}_entry_benefit"),
+            load(f"{prefix}_entry_count"),
+        )
+
+    def query_vector(self, benefit_codes: np.ndarray) -> np.ndarray:
+        """把命中的功效字符串编号化为 0/1 查询向量。"""
+        query = np.zeros(self.n_benefits, dtype=np.int32)
+        benefits = self.benefit_of_code[np.asarray(benefit_codes, dtype=np.int64)]
+        query[benefits[benefits >= 0]] = 1
+        return query
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        weights = self.entry_count * query[self.entry_benefit]
+        return np.bincount(
+            self.entry_recipe, weights=weights, minlength=len(self.recipe_codes)
+        ).astype(np.int64)
+
+    def top_k(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """
+        返回得分最高的 k 个食谱编号（只含得分 > 0 的），
+        先按得分降序、同分按 CSV 中首次出现的顺序。
+        """
+        if k <= 0:
+            return _EMPTY_IDS
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            cut = len(candidates) - k
+            kth = np.partition(scores[candidates], cut)[cut]
+            candidates = candidates[scores[candidates] >= kth]
+        order = np.lexsort((self.first_row[candidates], -scores[candidates]))
+        return candidates[order][:k]
+
+
+class TripleStore:
+    """
+    常驻内存的知识图谱三元组存储。
+    每列字符串按全局 StringTable 编码为 int32 编号（缺失值为 -1），
+    subject / relation / object 各有一个 ColumnIndex，object 另有 n-gram 索引，
+    alignment 为中英对齐表，ingredients 为食材 -> 食谱的位图索引，
+    benefits 为食谱 x 功效的打分矩阵。
+    这些数组既可以从 CSV 现场编译，也可以从 build 出来的快照目录 mmap 打开。
+    csv_idx 即该行在 CSV 中的行号（不含表头，从 0 开始）。
+    version 是数据集内容的指纹，CSV 内容不变则版本号不变。
+    """
+
+    def __init__(
+        self,
+        columns: list,
+        strings: StringTable,
+        codes: dict,
+        indexes: dict,
+        ngram_indexes: dict,
+        complete: np.ndarray,
+        alignment: BilingualAlignment,
+        ingredients: IngredientBitmapIndex,
+        benefits: BenefitMatrix,
+        version: str = None,
+    ):
+        self.columns = columns
+        self.strings = strings
+        self.codes = codes
+        self.indexes = indexes
+        self.ngram_indexes = ngram_indexes
+        # subject / relation / object 均非空的行，对应旧实现里的 dropna
+        self.complete = complete
+        self.alignment = alignment
+        self.ingredients = ingredients
+        self.benefits = benefits
+        self.version = version
+
+    @classmethod
+    def compile(cls, df: pd.DataFrame, version: str = None) -> "TripleStore":
+        columns = list(df.columns)
+        strings = StringTable.build(
+            v for col in columns for v in df[col].dropna().unique()
+        )
+        lookup = pd.Index(strings.to_list())
+        codes = {
+            col: lookup.get_indexer(df[col]).astype(np.int32) for col in columns
+        }
+        indexes = {
+            col: ColumnIndex.build(codes[col], len(strings)) for col in TRIPLE_COLUMNS
+        }
+        # object 列的 contains 查询走 n-gram 倒排索引，避免线性扫描
+        ngram_indexes = {
+            "object": NgramIndex.build(strings, indexes["object"].present_codes())
+        }
+        complete = np.logical_and.reduce([codes[c] >= 0 for c in TRIPLE_COLUMNS])
+        alignment = BilingualAlignment.build(codes, strings)
+        ingredients = IngredientBitmapIndex.build(codes, strings, indexes["subject"])
+        benefits = BenefitMatrix.build(codes, strings, ingredients.recipe_of_code)
+        return cls(
+            columns,
+            strings,
+            codes,
+            indexes,
+            ngram_indexes,
+            complete,
+            alignment,
+            ingredients,
+            benefits,
+            version=version,
+        )
+
+    @classmethod
+    def from_csv(cls, csv_path: str) -> "TripleStore":
+        with open(csv_path, "rb") as f:
+            raw = f.read()
+        return cls.compile(
+            pd.read_csv(io.BytesIO(raw), dtype=str), version=content_version(raw)
+        )
+
+    # --------------------- 快照读写 ---------------------
+    def save(self, snapshot_dir: str, source_csv: str = None):
+        """
+        写出快照目录。先写到临时目录再整体替换，读者不会看到写了一半的快照。
+        """
+        tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        arrays = {
+            "strings_data": self.strings.data,
+            "strings_offsets": self.strings.offsets,
+            "complete": self.complete,
+        }
+        for i, col in enumerate(self.columns):
+            arrays[f"col_{i}"] = self.codes[col]
+        for col, index in self.indexes.items():
+            arrays.update(index.arrays(f"index_{col}"))
+        arrays.update(self.alignment.arrays("align"))
+        arrays.update(self.ingredients.arrays("ingredients"))
+        arrays.update(self.benefits.arrays("benefits"))
+        for col, grams in self.ngram_indexes.items():
+            arrays[f"ngram_{col}_value_ids"] = grams.value_ids
+            arrays[f"ngram_{col}_grams_data"] = grams.grams.data
+            arrays[f"ngram_{col}_grams_offsets"] = grams.grams.offsets
+            arrays[f"ngram_{col}_offsets"] = grams.offsets
+            arrays[f"ngram_{col}_postings"] = grams.postings
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(array))
+
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "version": self.version,
+            "columns": self.columns,
+            "rows": len(self),
+            "ngram": {col: g.n for col, g in self.ngram_indexes.items()},
+            "alignment": self.alignment.meta(),
+            "source": _source_signature(source_csv) if source_csv else None,
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        old_dir = f"{snapshot_dir}.old-{os.getpid()}"
+        if os.path.exists(snapshot_dir):
+            os.rename(snapshot_dir, old_dir)
+        os.rename(tmp_dir, snapshot_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def open(cls, snapshot_dir: str) -> "TripleStore":
+        """以只读 mmap 打开快照，多个 worker 进程共享同一份物理页。"""
+        meta = read_snapshot_meta(snapshot_dir)
+
+        def load(name):
+            # np.asarray 去掉 memmap 子类的切片开销，底层仍是同一块映射内存
+            path = os.path.join(snapshot_dir, f"{name}.npy")
+            return np.asarray(np.load(path, mmap_mode="r"))
+
+        strings = StringTable(load("strings_data"), load("strings_offsets"))
+        columns = meta["columns"]
+        codes = {col: load(f"col_{i}") for i, col in enumerate(columns)}
+        indexes = {col: ColumnIndex.load(load, f"index_{col}") for col in TRIPLE_COLUMNS}
+        ngram_indexes = {
+            col: NgramIndex(
+                strings,
+                load(f"ngram_{col}_value_ids"),
+                StringTable(
+                    load(f"ngram_{col}_grams_data"), load(f"ngram_{col}_grams_offsets")
+                ),
+                load(f"ngram_{col}_offsets"),
+                load(f"ngram_{col}_postings"),
+                n=n,
+            )
+            for col, n in meta["ngram"].items()
+        }
+        alignment = BilingualAlignment.load(load, "align", strings, meta["alignment"])
+        ingredients = IngredientBitmapIndex.load(load, "ingredients")
+        benefits = BenefitMatrix.load(load, "benefits")
+        return cls(
+            columns,
+            strings,
+            codes,
+            indexes,
+            ngram_indexes,
+            load("complete"),
+            alignment,
+            ingredients,
+            benefits,
+            version=meta.get("version"),
+        )
+
+    # --------------------- 查询 ---------------------
+    def __len__(self):
+        return len(self.complete)
+
+    def lookup(self, column: str, value) -> np.ndarray:
+        """精确匹配：返回 column == value 的行号。"""
+        return self.indexes[column].rows_for(self.strings.code_of(value))
+
+    def matching_codes(self, column: str, pattern: str) -> np.ndarray:
+        """
+        返回该列中匹配 pattern 的去重取值编号，语义与
+        Series.str.contains(pattern, na=False) 一致。
+        普通子串优先查 n-gram 索引；正则或未建索引的列在去重后的取值上匹配。
+        """
+        grams = self.ngram_indexes.get(column)
+        if grams is not None and is_literal(pattern):
+            return grams.search(pattern)
+        value_codes = self.indexes[column].present_codes()
+        values = self.strings.decode_many(value_codes)
+        mask = pd.Series(values, dtype=object).str.contains(pattern, na=False)
+        return value_codes[mask.to_numpy(dtype=bool)]
+
+    def contains(self, column: str, pattern: str) -> np.ndarray:
+        """子串/正则匹配，返回行号；匹配规则见 matching_codes。"""
+        index = self.indexes[column]
+        return self._union(
+            [index.rows_for(c) for c in self.matching_codes(column, pattern)]
+        )
+
+    def contains_many(self, column: str, patterns: list, row_mask=None) -> tuple:
+        """
+        一次性匹配多个子串。返回 (行号数组, 命中关键词列表)：
+        行号升序且不重复，第 i 行命中的关键词为 tuple，按 patterns 中的顺序列出。
+        row_mask 为可选的布尔数组，只保留其中为 True 的行。
+        """
+        patterns = list(dict.fromkeys(p for p in patterns if p))
+        id_lists = [self.contains(column, p) for p in patterns]
+        if row_mask is not None:
+            id_lists = [ids[row_mask[ids]] for ids in id_lists]
+        if not any(len(ids) for ids in id_lists):
+            return _EMPTY_IDS, []
+
+        all_ids = np.concatenate(id_lists)
+        pattern_ids = np.repeat(
+            np.arange(len(patterns)), [len(ids) for ids in id_lists]
+        )
+        order = np.lexsort((pattern_ids, all_ids))
+        all_ids, pattern_ids = all_ids[order], pattern_ids[order]
+
+        row_ids, starts = np.unique(all_ids, return_index=True)
+        labels = np.asarray(patterns, dtype=object)
+        matched = [tuple(labels[k]) for k in np.split(pattern_ids, starts[1:])]
+        return row_ids, matched
+
+    def only_complete(self, row_ids: np.ndarray) -> np.ndarray:
+        return row_ids[self.complete[row_ids]]
+
+    def frame(self, row_ids: np.ndarray, columns: list) -> pd.DataFrame:
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        data = {}
+        for col in columns:
+            if col == "csv_idx":
+                data[col] = row_ids
+            else:
+                data[col] = self.strings.decode_many(self.codes[col][row_ids])
+        return pd.DataFrame(data, columns=columns)
+
+    @staticmethod
+    def _union(id_arrays: list) -> np.ndarray:
+        id_arrays = [ids for ids in id_arrays if len(ids)]
+        if not id_arrays:
+            return _EMPTY_IDS
+        if len(id_arrays) == 1:
+            return np.asarray(id_arrays[0], dtype=np.int64)
+        return np.unique(np.concatenate(id_arrays)).astype(np.int64)
+
+
+# --------------------- 快照定位与加载 ---------------------
+def content_version(raw: bytes) -> str:
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+def _source_signature(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {
+        "path": os.path.basename(csv_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def snapshot_path_for(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + SNAPSHOT_SUFFIX
+
+
+def read_snapshot_meta(snapshot_dir: str) -> dict:
+    with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def snapshot_is_fresh(snapshot_dir: str, csv_path: str) -> bool:
+    """快照存在、格式一致且与 CSV 的大小/修改时间吻合时才使用。"""
+    try:
+        meta = read_snapshot_meta(snapshot_dir)
+    except (OSError, ValueError):
+        return False
+    if meta.get("format") != SNAPSHOT_FORMAT:
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return meta.get("source") == _source_signature(csv_path)
+
+
+def source_state(csv_path: str) -> tuple:
+    """
+    CSV 与其快照的当前状态，用于热更新时判断数据是否有变化。
+    任一文件被替换（大小、修改时间变化）都会得到不同的结果。
+    """
+    csv_sig = _source_signature(csv_path) if os.path.exists(csv_path) else None
+    meta_path = os.path.join(snapshot_path_for(csv_path), "meta.json")
+    try:
+        snapshot_mtime = os.stat(meta_path).st_mtime_ns
+    except OSError:
+        snapshot_mtime = None
+    return (json.dumps(csv_sig, sort_keys=True), snapshot_mtime)
+
+
+def load_store(csv_path: str) -> TripleStore:
+    """优先打开与 CSV 对应的最新快照，否则直接解析 CSV。"""
+    snapshot_dir = snapshot_path_for(csv_path)
+    if snapshot_is_fresh(snapshot_dir, csv_path):
+        return TripleStore.open(snapshot_dir)
+    if os.path.isdir(snapshot_dir):
+        print(f"[KG] 快照 {snapshot_dir} 已过期，改为解析 CSV。")
+    return TripleStore.from_csv(csv_path)
+
+
+def build_snapshot(csv_path: str, snapshot_dir: str = None) -> str:
+    snapshot_dir = snapshot_dir or snapshot_path_for(csv_path)
+    TripleStore.from_csv(csv_path).save(snapshot_dir, source_csv=csv_path)
+    return snapshot_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipe KG snapshot tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="compile the recipe CSV into a snapshot")
+    build.add_argument("csv_path", nargs="?", default="./merged_cleaned_all_recipes.csv")
+    build.add_argument("-o", "--output", default=None, help="snapshot directory")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        out = build_snapshot(args.csv_path, args.output)
+        print(f"Snapshot written to {out} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 各阶段的总时限（秒，含重试），可用环境变量 LLM_TIMEOUT_<STAGE> 覆盖
+STAGE_TIMEOUTS = {
+    "intent": 10.0,
+    "keywords": 20.0,
+    "explanation": 60.0,
+    "translation": 45.0,
+    "chase": 45.0,
+    "recommend_query": 15.0,
+    "healthcheck": 10.0,
+}
+DEFAULT_TIMEOUT = 30.0
+
+
+class LLMError(Exception):
+    """LLM 调用最终失败（重试耗尽、超出时限或不可重试的错误）。"""
+
+
+class CircuitOpenError(LLMError):
+    """熔断器处于打开状态，请求未发出。"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """429、5xx、超时与连接错误可以重试；参数错误、鉴权失败等不重试。"""
+    if isinstance(
+        error,
+        (
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+            openai.error.TryAgain,
+        ),
+    ):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+def retry_after(error: Exception):
+    """服务端给出的 Retry-After 秒数，没有时返回 None。"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class PersistentSession(requests.Session):
+    """
+    所有线程共享的 keep-alive 连接池。
+    openai 0.x 每 180 秒会 close() 线程各自的会话，这里忽略该调用，连接池保持可用。
+    """
+
+    def close(self):
+        pass
+
+
+class CircuitBreaker:
+    """
+    连续 failure_threshold 次可重试类失败后打开，reset_timeout 秒内直接拒绝；
+    之后进入半开状态放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("LLM circuit opened after %d failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self):
+        """请求以不可重试的错误结束时调用：不计入失败，但释放半开状态的试探名额。"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutiveFailures": self.failures}
+
+
+class StageStats:
+    """单个阶段的调用次数、错误、重试与延迟统计。"""
+
+    def __init__(self, window: int = 256):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.recent = deque(maxlen=window)
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: Exception = None):
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.recent.append(latency)
+            if error is not None:
+                self.errors += 1
+                self.last_error = repr(error)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = sorted(self.recent)
+            p95 = recent[math.ceil(0.95 * len(recent)) - 1] if recent else 0.0
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "avgLatencyMs": 1000 * self.total_latency / self.calls if self.calls else 0.0,
+                "p95LatencyMs": 1000 * p95,
+                "maxLatencyMs": 1000 * self.max_latency,
+                "lastError": self.last_error,
+            }
+
+
+class LLMClient:
+    """
+    全部 ChatCompletion 调用共用的客户端：
+    - 共享 keep-alive 连接池；
+    - 按阶段设定总时限，每次尝试的超时取剩余时间；
+    - 429/5xx/超时按带抖动的指数退避重试，优先遵循 Retry-After；
+    - 熔断器在上游持续失败时快速失败，避免占满 Flask worker；
+    - 按阶段统计延迟与错误。
+    失败时抛出 LLMError，兜底文案由调用方决定。
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        deployment: str,
+        api_version: str,
+        pool_size: int = 16,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker: CircuitBreaker = None,
+    ):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.deployment = deployment
+        self.api_version = api_version
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+        self.session = PersistentSession()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        openai.requestssession = self.session
+
+    @classmethod
+    def from_env(cls) -> "LLMClient":
+        return cls(
+            endpoint=os.getenv(
+                "ENDPOINT_URL", "https://60649-m6q4t7cw-eastus2.openai.azure.com/"
+            ),
+            api_key=os.getenv(
+                "AZURE_OPENAI_API_KEY",
+                "3G6NJ6fwi6zmNoJyPoqrpZBE0IjzqCGlDEIKFQrsbUW2U86rmXW8JQQJ99BBACHYHv6XJ3w3AAAAACOGhgbr",
+            ),
+            deployment=os.getenv("DEPLOYMENT_NAME", "gpt-4o"),
+            api_version=os.getenv("OPENAI_API_VERSION", "2024-05-01-preview"),
+            pool_size=int(os.getenv("LLM_POOL_SIZE", "16")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+            ),
+        )
+
+    def stage_timeout(self, stage: str) -> float:
+        override = os.getenv(f"LLM_TIMEOUT_{stage.upper()}")
+        return float(override) if override else STAGE_TIMEOUTS.get(stage, DEFAULT_TIMEOUT)
+
+    def stage_stats(self, stage: str) -> StageStats:
+        with self._stats_lock:
+            if stage not in self._stats:
+                self._stats[stage] = StageStats()
+            return self._stats[stage]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stages = dict(self._stats)
+        return {
+            "breaker": self.breaker.snapshot(),
+            "stages": {stage: s.snapshot() for stage, s in stages.items()},
+        }
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        hinted = retry_after(error)
+        if hinted is not None:
+            return min(hinted, self.backoff_max)
+        # full jitter：在 [0, base * 2^attempt] 内均匀取值
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _request(
+        self, stage: str, messages: list, stream: bool, deadline: float = None, **params
+    ):
+        """发出请求并按需重试，返回 openai 的响应（stream=True 时为分块迭代器）。"""
+        stats = self.stage_stats(stage)
+        if deadline is None:
+            deadline = time.monotonic() + self.stage_timeout(stage)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMError(f"stage '{stage}' ran out of time after {attempt} attempts")
+            if not self.breaker.allow():
+                stats.record_rejected()
+                raise CircuitOpenError(f"LLM circuit open, stage '{stage}' rejected")
+            try:
+                response = openai.ChatCompletion.create(
+                    engine=self.deployment,
+                    messages=messages,
+                    stream=stream,
+                    api_type="azure",
+                    api_base=self.endpoint,
+                    api_key=self.api_key,
+                    api_version=self.api_version,
+                    request_timeout=remaining,
+                    **params,
+                )
+                return response
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.release()
+                    raise LLMError(f"stage '{stage}' failed: {e!r}") from e
+                self.breaker.record_failure()
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    raise LLMError(f"stage '{stage}' gave up after {attempt} attempts: {e!r}") from e
+                stats.record_retry()
+                logger.info("Retrying LLM stage %s in %.2fs after %r", stage, delay, e)
+                time.sleep(delay)
+
+    def chat(self, stage: str, messages: list, temperature: float, max_tokens: int) -> str:
+        """
+        一次完整的调用，返回去掉首尾空白的回答文本。
+        回答没有内容（例如被内容过滤拦下）或无法解析时同样抛出 LLMError；
+        这类情况上游已经正常响应，熔断器按成功处理。
+        """
+        stats = self.stage_stats(stage)
+        started = time.monotonic()
+        try:
+            response = self._request(
+                stage, messages, False, temperature=temperature, max_tokens=max_tokens
+            )
+        except Exception as e:
+            stats.record(time.monotonic() - started, e)
+            raise
+        self.breaker.record_success()
+        try:
+            choice = response.choices[0]
+            content = choice.message.content
+            if content is None:
+                raise LLMError(
+                    f"stage '{stage}' returned no content "
+                    f"(finish_reason={getattr(choice, 'finish_reason', None)!r})"
+                )
+            text = content.strip()
+        except Exception as e:
+            stats.record(time.monotonic() - started, e)
+            if isinstance(e, LLMError):
+                raise
+            raise LLMError(f"stage '{stage}' returned an unreadable response: {e!r}") from e
+        stats.record(time.monotonic() - started)
+        return text
+
+    def stream(
+        self, stage: str, messages: list, temperature: float, max_tokens: int, on_finish=None
+    ):
+        """
+        流式调用，逐块产出文本。只在收到第一块之前重试；
+        中途断流或超出阶段时限（request_timeout 只限制单次读取，这里按块检查）时抛出 LLMError，
+        已产出的内容不会撤回。
+        on_finish 不为 None 时，收到结束原因（"stop"、"length"、"content_filter" 等）后调用。
+        """
+        stats = self.stage_stats(stage)
+        started = time.monotonic()
+        deadline = started + self.stage_timeout(stage)
+        response = None
+        try:
+            response = self._request(
+                stage, messages, True, deadline, temperature=temperature, max_tokens=max_tokens
+            )
+            for chunk in response:
+                if time.monotonic() > deadline:
+                    raise openai.error.Timeout(f"stream exceeded the {stage} stage deadline")
+                # Azure 的首个分块可能只有内容过滤结果，没有 choices
+                if not chunk["choices"]:
+                    continue
+                choice = chunk["choices"][0]
+                text = choice["delta"].get("content")
+                if text:
+                    yield text
+                if on_finish is not None and choice.get("finish_reason"):
+                    on_finish(choice["finish_reason"])
+        except GeneratorExit:
+            # 调用方提前停止读取，请求本身没有失败
+            self.breaker.record_success()
+            stats.record(time.monotonic() - started)
+            raise
+        except Exception as e:
+            stats.record(time.monotonic() - started, e)
+            if response is None:
+                # _request 已经处理过熔断器
+                raise
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                # 与 _request 相同：不计入失败，但必须释放半开状态的试探名额
+                self.breaker.release()
+            raise LLMError(f"stage '{stage}' stream failed: {e!r}") from e
+        self.breaker.record_success()
+        stats.record(time.monotonic() - started)
+
+
+client = LLMClient.from_env()
@@ -1,14 +1,13 @@
-from flask import Flask, jsonify, request
-import openai
+from flask import Flask, Response, jsonify, request, stream_with_context
 import json
 import os
 import re
 import pandas as pd
 from flask_cors import CORS
-import csv
 import logging
 import traceback
 import re
+import uuid
 from pathlib import Path
 from main_new import (
     do_new_recommendation,
@@ -16,26 +15,21 @@ from main_new import (
     do_chase_question,
     init_history_file,
     do_include_exclude,
+    speculate_keywords,
 )
 
 
+import main_new
 from main_new import NutritionKG
+from llm_client import LLMError, client as llm
+from intent_classifier import IntentClassifier
+from history_store import HISTORY_TYPES, NEW_SESSION, HistoryStore
 from datetime import datetime
 
 nutrition_kg = NutritionKG()
+nutrition_kg.start_watching(float(os.getenv("KG_WATCH_INTERVAL", "30")))
 
-endpoint = os.getenv("ENDPOINT_URL", "https://60649-m6q4t7cw-eastus2.openai.azure.com/")
-deployment = os.getenv("DEPLOYMENT_NAME", "gpt-4o")
-subscription_key = os.getenv(
-    "AZURE_OPENAI_API_KEY",
-    "3G6NJ6fwi6zmNoJyPoqrpZBE0IjzqCGlDEIKFQrsbUW2U86rmXW8JQQJ99BBACHYHv6XJ3w3AAAAACOGhgbr",
-)
-
-
-openai.api_type = "azure"
-openai.api_base = endpoint
-openai.api_key = subscription_key
-openai.api_version = "2024-05-01-preview"
+# Endpoint, credentials, timeouts, retries and the circuit breaker live in llm_client
 
 KEYWORD_SYSTEM_PROMPT = """You are an assistant dedicated to extracting keywords related to nutrition or ingredients from the user's query. Please maintain the following instructions and ensure your responses adhere to them:
 - Focus on identifying keywords connected to nutrition, ingredient names, health benefits, or other relevant aspects of dietary information.
@@ -118,19 +112,27 @@ logger = logging.getLogger(__name__)
 HISTORY_DIR = "history"
 history_dir_path = Path(HISTORY_DIR)
 
+# Local yes/no recipe-intent model in front of the LLM classifier, trained on past LLM decisions
+intent_classifier = IntentClassifier.from_env(HISTORY_DIR)
+
+
+# Per-user operation history lives in SQLite; legacy CSV files are imported once at startup
+history_store = HistoryStore.from_env(HISTORY_DIR)
+history_store.migrate_csv_dir(HISTORY_DIR)
+history_store.start_compaction(float(os.getenv("HISTORY_COMPACT_INTERVAL", "300")))
+
+# Per-request archive of the top-recipe KG rows (KG1..KG3.csv); unset keeps them in memory only
+KG_RESULT_DIR = os.getenv("KG_RESULT_DIR")
 
-def get_user_history_path(user_id: str) -> Path:
-    """Get the path to a user's history file."""
-    # Ensure history directory exists
-    history_dir_path.mkdir(exist_ok=True)
-    if not os.path.exists(history_dir_path / f"{user_id}.csv"):
-        with open(
-            history_dir_path / f"{user_id}.csv", mode="w", newline="", encoding="utf-8"
-        ) as f:
-            writer = csv.writer(f)
-            writer.writerow(["type", "content", "time"])
-            writer.writerow(["chat", "New chat session", datetime.now().isoformat()])
-    return history_dir_path / f"{user_id}.csv"
+
+def request_context(user_id, session_count):
+    """History file of the user's current session plus a KG result dir unique to this request."""
+    session_name = user_id + "_task" + str(session_count)
+    kg_dir = None
+    if KG_RESULT_DIR:
+        request_name = datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+        kg_dir = os.path.join(KG_RESULT_DIR, session_name, request_name)
+    return init_history_file(os.path.join(HISTORY_DIR, session_name + ".csv"), kg_dir)
 
 
 def write_history(history):
@@ -141,95 +143,36 @@ def write_history(history):
         time = history["time"]
 
         # Accept include/exclude/cancel/apply/chat/recommendation operations
-        if type not in [
-            "include",
-            "exclude",
-            "cancel",
-            "apply",
-            "chat",
-            "recommendation",
-        ]:
+        if type not in HISTORY_TYPES:
             logger.info(f"Skipping unsupported history type: type={type}")
             return
 
         logger.info(
-            f"Writing operation to user history file: id={id}, type={type}, content={content}"
+            f"Writing operation to user history: id={id}, type={type}, content={content}"
         )
-
-        # Get user's history file path
-        user_history_path = get_user_history_path(id)
-
-        # Create file with headers if it doesn't exist
-        if not user_history_path.exists():
-            with open(user_history_path, mode="w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow(["type", "content", "time"])
-
-        # Append the new record
-        with open(user_history_path, mode="a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([type, content, time])
-
-        logger.info(f"Successfully wrote to {user_history_path}")
+        history_store.append(id, type, content, time)
+        logger.info(f"Successfully wrote history for user {id}")
     except Exception as e:
-        logger.error(f"Error writing to history file: {str(e)}")
+        logger.error(f"Error writing to history: {str(e)}")
         raise
 
 
 def read_history_with_cancellations(user_id: str) -> list:
-    """Read history and handle cancellations by removing cancelled include/exclude operations."""
+    """Read the user's full history in chronological order."""
     try:
-        user_history_path = get_user_history_path(user_id)
-
-        if not user_history_path.exists():
-            logger.info(f"No history file found for user {user_id}")
-            return []
-
-        # Read all records
-        with open(user_history_path, mode="r", newline="", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            rows = list(reader)
-
-        if not rows:
-            logger.info(f"History file for user {user_id} is empty.")
-            return []
-
-        # Skip header row
-        history_rows = rows[1:]
-        # print(history_rows)
-        # if not history_rows:
-        #     logger.info(f"No history records found for user {user_id}.")
-        #     return []
-
-        # Process rows in reverse to handle consecutive cancellations
-        result = []
-        skip_count = 0
-
-        for row in history_rows:
-            # print("row")
-            # print(row)
-            # if row[0] == "cancel":
-            #     # Increment skip count for each cancel record
-            #     skip_count += 1
-            #     continue
-            # elif row[0] in ["include", "exclude"]:
-            #     if skip_count > 0:
-            #         # Skip this record if we have pending cancellations
-            #         skip_count -= 1
-            #         continue
-            # Format the row as a history item object
-            if len(row) == 3:
-                result.append({"type": row[0], "content": row[1], "time": row[2]})
-            # else:
-            #     result.append({"type": row[0], "content": row[1]})
-
-        # Reverse the result to get chronological order
-        return result
+        history_store.ensure_user(user_id)
+        return history_store.records(user_id)
     except Exception as e:
-        logger.error(f"Error reading history file: {str(e)}")
+        logger.error(f"Error reading history: {str(e)}")
         return []
 
 
+def is_first_chat_of_session(user_id: str) -> bool:
+    """True when the user has no chat yet, or their latest chat record starts a new session."""
+    last_chat = history_store.last_record(user_id, "chat")
+    return last_chat is None or last_chat["content"] == NEW_SESSION
+
+
 @app.route("/", methods=["GET"])
 def index():
     return jsonify({"message": "成功了"})
@@ -253,26 +196,9 @@ def delete_last_history():
         if not user_id:
             return jsonify({"status": "error", "message": "No user ID provided"}), 400
 
-        user_history_path = get_user_history_path(user_id)
-        if not user_history_path.exists():
-            return jsonify({"status": "error", "message": "No history found"}), 404
-
-        # Read all records
-        with open(user_history_path, mode="r", newline="", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            rows = list(reader)
-
-        if len(rows) <= 1:  # Only header row
-            return jsonify({"status": "error", "message": "No history to delete"}), 404
-
-        # Find the last include/exclude record from the end
-        last_include_exclude_index = -1
-        for i in range(len(rows) - 1, 0, -1):  # Skip header row
-            if rows[i][0] in ["include", "exclude"]:  # Check type column
-                last_include_exclude_index = i
-                break
-
-        if last_include_exclude_index == -1:
+        # Undo the last live include/exclude: a constant-time tombstone append
+        history_store.ensure_user(user_id)
+        if not history_store.undo_last_operation(user_id):
             return (
                 jsonify(
                     {
@@ -283,14 +209,6 @@ def delete_last_history():
                 404,
             )
 
-        # Remove the last include/exclude record
-        rows.pop(last_include_exclude_index)
-
-        # Write back to file
-        with open(user_history_path, mode="w", newline="", encoding="utf-8") as file:
-            writer = csv.writer(file)
-            writer.writerows(rows)
-
         return jsonify({"status": "success"})
     except Exception as e:
         logger.error(f"Error in delete_last_history: {str(e)}")
@@ -311,6 +229,48 @@ def get_history():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route("/api/kg/version", methods=["GET"])
+def get_kg_version():
+    return jsonify(
+        {
+            "status": "success",
+            "version": nutrition_kg.version,
+            "caches": nutrition_kg.cache_stats(),
+        }
+    )
+
+
+@app.route("/api/llm/stats", methods=["GET"])
+def get_llm_stats():
+    return jsonify(
+        {
+            "status": "success",
+            **llm.stats(),
+            "keywordCache": main_new.KEYWORD_CACHE.stats(),
+            "translationMemory": main_new.TRANSLATION_MEMORY.stats(),
+            "kgContext": main_new.KG_CONTEXT_STATS.snapshot(),
+            "singleFlight": main_new.ROUND_FLIGHTS.stats(),
+            "speculation": main_new.SPECULATION_STATS.snapshot(),
+            "intent": intent_classifier.stats(),
+            "sessions": main_new.SESSIONS.stats(),
+        }
+    )
+
+
+@app.route("/api/kg/reload", methods=["POST"])
+def reload_kg():
+    """Rebuild the KG indexes in the background; in-flight requests keep the old version."""
+    admin_token = os.getenv("KG_ADMIN_TOKEN")
+    if admin_token and request.headers.get("Authorization") != f"Bearer {admin_token}":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    force = bool((request.get_json(silent=True) or {}).get("force", False))
+    nutrition_kg.reload_in_background(force=force)
+    return (
+        jsonify({"status": "accepted", "currentVersion": nutrition_kg.version}),
+        202,
+    )
+
+
 @app.route("/api/recommend", methods=["POST"])
 def recommend():
     data = request.get_json()
@@ -356,45 +316,140 @@ def recommend():
         },
     ]
     try:
-        response = openai.ChatCompletion.create(
-            engine=deployment, messages=messages, temperature=0.7, max_tokens=100
+        response = llm.chat(
+            "recommend_query", messages, temperature=0.7, max_tokens=100
         )
-        response = response.choices[0].message.content.strip()
-    except:
+    except LLMError as e:
+        logger.error(f"Recommendation query generation failed: {str(e)}")
         response = "Please recommend some healthy recipe."
     print(response)
     return jsonify({"recommendationQuery": response})
 
 
+def strip_markdown_fences(text: str) -> str:
+    if "```markdown" in text:
+        text = re.sub(r"```markdown", "", text)
+        text = re.sub(r"```", "", text)
+    return text
+
+
+class MarkdownFenceStripper:
+    """Incremental version of strip_markdown_fences for streamed answers.
+
+    Once "```markdown" has been seen, it and every later "```" are dropped.
+    Text is only released up to a point with no backtick nearby, so a fence is
+    never split between what was sent and what is still pending.
+    """
+
+    MARKER = "```markdown"
+    FENCE = "```"
+
+    def __init__(self):
+        self.pending = ""
+        self.active = False
+
+    def _safe_split(self) -> int:
+        reach = len(self.MARKER) - 1
+        for split in range(len(self.pending) - 1, -1, -1):
+            if "`" not in self.pending[max(0, split - reach) : split + 1]:
+                return split
+        return 0
+
+    def _emit(self, text: str) -> str:
+        if self.active:
+            text = text.replace(self.MARKER, "").replace(self.FENCE, "")
+        return text
+
+    def feed(self, chunk: str) -> str:
+        self.pending += chunk
+        if self.MARKER in self.pending:
+            self.active = True
+        split = self._safe_split()
+        text, self.pending = self.pending[:split], self.pending[split:]
+        return self._emit(text)
+
+    def flush(self) -> str:
+        text, self.pending = self.pending, ""
+        return self._emit(text)
+
+
+def wants_stream(data) -> bool:
+    """Clients opt into SSE with {"stream": true} or Accept: text/event-stream."""
+    if isinstance(data, dict) and data.get("stream"):
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"
+
+
+def sse_event(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def sse_answer_response(header: dict, chunks, on_done=None) -> Response:
+    """Send the KG payload first, then answer tokens, then the full stripped answer."""
+
+    def events():
+        yield sse_event("knowledgeGraph", header)
+        try:
+            stripper = MarkdownFenceStripper()
+            parts = []
+            for chunk in chunks:
+                parts.append(chunk)
+                text = stripper.feed(chunk)
+                if text:
+                    yield sse_event("token", {"text": text})
+            text = stripper.flush()
+            if text:
+                yield sse_event("token", {"text": text})
+
+            final_answer = strip_markdown_fences("".join(parts).strip())
+            if on_done is not None:
+                on_done(final_answer)
+            yield sse_event("done", {"finalAnswer": final_answer})
+        except Exception as e:
+            logger.error(f"Error while streaming answer: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield sse_event("error", {"error": f"Unexpected error: {str(e)}"})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/include_exclude", methods=["POST"])
 def include_exclude():
-    new_session_count = 0
     data = request.get_json()
     user_id = data.get("userId", "")
-    user_history = read_history_with_cancellations(user_id)
-    if user_history:
-        new_session_count = sum(
-            1
-            for h in user_history
-            if h["type"] == "chat" and h["content"] == "New chat session"
-        )
-    kg_llm_retrive_path = os.path.join(
-        HISTORY_DIR, user_id + "_task" + str(new_session_count) + ".csv"
-    )
-    init_history_file(kg_llm_retrive_path)
+    history_store.ensure_user(user_id)
+    new_session_count = history_store.session_count(user_id)
+    context = request_context(user_id, new_session_count)
     operation = read_operation_history(user_id)
-    kg_results, final_answer = do_include_exclude(operation, nutrition_kg)
-    if "```markdown" in final_answer:
-        final_answer = re.sub(r"```markdown", "", final_answer)
-        final_answer = re.sub(r"```", "", final_answer)
-
-    # Write the final answer to history
-    current_time = datetime.now().isoformat()
-    write_history(
-        {"id": user_id, "type": "chat", "content": final_answer, "time": current_time}
+    stream = wants_stream(data)
+    kg_results, final_answer = do_include_exclude(
+        context, operation, nutrition_kg.pinned(), stream=stream
     )
 
+    def record_answer(final_answer):
+        # Write the final answer to history
+        current_time = datetime.now().isoformat()
+        write_history(
+            {
+                "id": user_id,
+                "type": "chat",
+                "content": final_answer,
+                "time": current_time,
+            }
+        )
+
     knowledgeGraph = pandas_to_json(kg_results) if not kg_results.empty else None
+    if stream:
+        return sse_answer_response(
+            {"knowledgeGraph": knowledgeGraph}, final_answer, on_done=record_answer
+        )
+
+    final_answer = strip_markdown_fences(final_answer)
+    record_answer(final_answer)
     return jsonify({"finalAnswer": final_answer, "knowledgeGraph": knowledgeGraph})
 
 
@@ -409,73 +464,59 @@ def answer_question():
 
         question = data.get("question", "")
         user_id = data.get("userId", "")  # Get userId from request
-        user_history = read_history_with_cancellations(user_id)
+        history_store.ensure_user(user_id)
+        last_record = history_store.last_record(user_id)
         # 判断上一个是否为生成的query
-        if user_history[-1]["type"] == "recommendation":
+        if last_record["type"] == "recommendation":
             question = (
-                "assistant: " + user_history[-1]["content"] + " user: " + question
+                "assistant: " + last_record["content"] + " user: " + question
             )
         if not question:
             logger.error("Empty question received")
             return jsonify({"error": "Question is required"}), 400
 
         logger.info(f"Processing question from user {user_id}: {question}")
+        kg = nutrition_kg.pinned()
+        stream = wants_stream(data)
 
         # Calculate the number of new chat sessions
-        new_session_count = 0
-        if user_history:
-            new_session_count = sum(
-                1
-                for h in user_history
-                if h["type"] == "chat" and h["content"] == "New chat session"
-            )
-        kg_llm_retrive_path = os.path.join(
-            HISTORY_DIR, user_id + "_task" + str(new_session_count) + ".csv"
-        )
-        init_history_file(kg_llm_retrive_path)
-
-        # Check if this is the first chat message
-        is_first_chat = False
-        if not user_history:
-            # If no history exists, this is the first chat
-            is_first_chat = True
-        else:
-            # Check if this is the first chat type message
-            chat_messages = [h for h in user_history if h["type"] == "chat"]
-            if not chat_messages:
-                is_first_chat = True
-            else:
-                # Check if this is the first chat after a "New chat session" message
-                for i in range(len(user_history) - 1, -1, -1):
-                    if (
-                        user_history[i]["type"] == "chat"
-                        and user_history[i]["content"] == "New chat session"
-                    ):
-                        is_first_chat = True
-                        break
-                    elif user_history[i]["type"] == "chat":
-                        break
-        init_history_file(kg_llm_retrive_path)
+        new_session_count = history_store.session_count(user_id)
+        context = request_context(user_id, new_session_count)
+
+        # Check if this is the first chat message (of the user, or since "New chat session")
+        is_first_chat = is_first_chat_of_session(user_id)
         if is_first_chat:
             # print(is_first_chat)
-            kg_reulsts, final_answer = do_new_round(question, nutrition_kg)
+            kg_reulsts, final_answer = do_new_round(context, question, kg, stream=stream)
             knowledgeGraph = (
                 pandas_to_json(kg_reulsts) if not kg_reulsts.empty else None
             )
         if not is_first_chat:
+            # Extract keywords while the intent is being classified; drop them for follow-ups
+            keywords = speculate_keywords(question)
             recommend_or_answer = clarify_query_intend(question)
             if recommend_or_answer:
-                kg_reulsts, final_answer = do_new_round(question, nutrition_kg)
+                kg_reulsts, final_answer = do_new_round(
+                    context, question, kg, keywords, stream=stream
+                )
                 knowledgeGraph = (
                     pandas_to_json(kg_reulsts) if not kg_reulsts.empty else None
                 )
             else:
-                final_answer = do_chase_question(question)
+                keywords.cancel()
+                final_answer = do_chase_question(context, question, stream=stream)
                 knowledgeGraph = None
+        if stream:
+            return sse_answer_response(
+                {
+                    "knowledgeGraph": knowledgeGraph,
+                    "isFirstChat": is_first_chat,
+                    "newSessionCount": new_session_count,
+                },
+                final_answer,
+            )
         # print(final_answer)
-        if "```markdown" in final_answer:
-            final_answer = re.sub(r"```markdown", "", final_answer)
-            final_answer = re.sub(r"```", "", final_answer)
+        final_answer = strip_markdown_fences(final_answer)
         return jsonify(
             {
                 "finalAnswer": final_answer,
@@ -491,7 +532,8 @@ def answer_question():
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
 
-def clarify_query_intend(question):
+def llm_query_intend(question):
+    """Ask the LLM whether the question wants recipes: "yes", "no", or None on failure."""
     clarify_system_prompt = """
     You are an expert query classifier specializing in culinary intent recognition. For each input query, strictly follow these steps:
 
@@ -525,39 +567,68 @@ def clarify_query_intend(question):
         {"role": "system", "content": question},
     ]
     try:
-        response = openai.ChatCompletion.create(
-            engine=deployment, messages=messages, temperature=0.2, max_tokens=10
-        )
-
-    except Exception:
-        return False
-    response = response.choices[0].message.content.strip()
+        response = llm.chat("intent", messages, temperature=0.2, max_tokens=10)
+    except LLMError as e:
+        logger.error(f"Intent classification failed: {str(e)}")
+        return None
     if response == "yes" or response == "Yes":
-        return True
+        return "yes"
     else:
+        return "no"
+
+
+def audit_intent(question, decision):
+    llm_label = llm_query_intend(question)
+    if llm_label is not None:
+        intent_classifier.compare(decision, llm_label)
+        intent_classifier.learn(question, llm_label)
+
+
+def clarify_query_intend(question):
+    """
+    Decide locally when the classifier is confident, otherwise ask the LLM and learn
+    from its answer. A sample of confident local decisions is re-checked by the LLM
+    in the background to keep the agreement rate honest.
+    """
+    decision = intent_classifier.predict(question)
+    if intent_classifier.is_confident(decision):
+        intent_classifier.record(decision, used_local=True)
+        logger.info(
+            f"Intent decided locally ({decision.source}, {decision.confidence:.2f}): {decision.label}"
+        )
+        if intent_classifier.should_audit():
+            main_new.submit_llm(audit_intent, question, decision)
+        return decision.label == "yes"
+
+    intent_classifier.record(decision, used_local=False)
+    llm_label = llm_query_intend(question)
+    if llm_label is None:
         return False
+    intent_classifier.compare(decision, llm_label)
+    intent_classifier.learn(question, llm_label)
+    return llm_label == "yes"
 
 
 def test_azure_connection():
     try:
         logger.info("Testing Azure OpenAI API connection...")
-        logger.info(f"Using endpoint: {endpoint}")
-        logger.info(f"Using deployment: {deployment}")
-        logger.info(f"Using API version: {openai.api_version}")
+        logger.info(f"Using endpoint: {llm.endpoint}")
+        logger.info(f"Using deployment: {llm.deployment}")
+        logger.info(f"Using API version: {llm.api_version}")
 
         # Try a simple completion to test the connection
-        response = openai.ChatCompletion.create(
-            engine=deployment,
-            messages=[
+        response = llm.chat(
+            "healthcheck",
+            [
                 {"role": "system", "content": "You are a helpful assistant."},
                 {"role": "user", "content": "Hello, this is a test message."},
             ],
-            max_tokens=10,
             temperature=0.0,
+            max_tokens=10,
         )
 
         logger.info("Azure OpenAI API connection successful!")
-        logger.info(f"Response: {response['choices'][0]['message']['content']}")
+        logger.info(f"Response: {response}")
         return True
     except Exception as e:
         logger.error(f"Azure OpenAI API connection failed: {str(e)}")
@@ -598,41 +669,14 @@ def read_chat_session_history(user_id: str) -> list:
         list: A list of history records where the final chat content is "New chat session"
     """
     try:
-        user_history_path = get_user_history_path(user_id)
-
-        if not user_history_path.exists():
-            logger.info(f"No history file found for user {user_id}")
-            return []
-
-        # Read all records
-        with open(user_history_path, mode="r", newline="", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            rows = list(reader)
-
-        if not rows:
-            logger.info(f"History file for user {user_id} is empty.")
-            return []
-
-        # Skip header row
-        history_rows = rows[1:]
-
-        # Process rows in reverse to find the most recent "New chat session"
-        result = []
-        found_new_session = False
-        for row in reversed(history_rows):
-            if len(row) == 3:
-                type_, content, time = row
-                if type_ == "chat" and content == "New chat session":
-                    break
-                else:
-                    result.append({"type": type_, "content": content, "time": time})
-                    # Stop when we find the first "New chat session" and subsequent records
+        history_store.ensure_user(user_id)
+        result = history_store.current_session(user_id)
 
         # Return in chronological order
         result_json = {}
-        result_json["type"] = [r["type"] for r in reversed(result)]
-        result_json["content"] = [r["content"] for r in reversed(result)]
-        result_json["time"] = [r["time"] for r in reversed(result)]
+        result_json["type"] = [r["type"] for r in result]
+        result_json["content"] = [r["content"] for r in result]
+        result_json["time"] = [r["time"] for r in result]
         return result_json
     except Exception as e:
         logger.error(f"Error reading chat session history: {str(e)}")
@@ -641,55 +685,22 @@ def read_chat_session_history(user_id: str) -> list:
 
 def read_operation_history(user_id: str) -> list:
     """
-    Read the chat session history for a given user ID and return records
-    where the final chat content is "New chat session".
+    Read the include/exclude operations recorded since the user's last "apply".
 
     Args:
         user_id (str): The user ID to read history for
 
     Returns:
-        list: A list of history records where the final chat content is "New chat session"
+        dict: {"include": [...], "exclude": [...]} in chronological order
     """
     try:
-        user_history_path = get_user_history_path(user_id)
-
-        if not user_history_path.exists():
-            logger.info(f"No history file found for user {user_id}")
-            return []
-
-        # Read all records
-        with open(user_history_path, mode="r", newline="", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            rows = list(reader)
-
-        if not rows:
-            logger.info(f"History file for user {user_id} is empty.")
-            return []
-
-        # Skip header row
-        history_rows = rows[1:-1]
-
-        # Process rows in reverse to find the most recent "New chat session"
-        result = []
-
-        for row in reversed(history_rows):
-            if len(row) == 3:
-                type_, content, time = row
-                if type_ == "apply":
-                    break
-                else:
-                    if type_ == "include" or type_ == "exclude":
-                        result.append({"type": type_, "content": content, "time": time})
-                    # Stop when we find the first "New chat session" and subsequent records
+        history_store.ensure_user(user_id)
+        result = history_store.pending_operations(user_id)
 
         # Return in chronological order
         result_json = {}
-        result_json["include"] = [
-            r["content"] for r in reversed(result) if r["type"] == "include"
-        ]
-        result_json["exclude"] = [
-            r["content"] for r in reversed(result) if r["type"] == "exclude"
-        ]
+        result_json["include"] = [r["content"] for r in result if r["type"] == "include"]
+        result_json["exclude"] = [r["content"] for r in result if r["type"] == "exclude"]
         return result_json
     except Exception as e:
         logger.error(f"Error reading operation history: {str(e)}")
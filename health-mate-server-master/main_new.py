@@ -1,114 +1,251 @@
 import os
+import io
 import re
+import csv
 import json
 import random
 import time
-import openai
+import copy
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import networkx as nx
 from datetime import datetime
 
-# --------------------- 1. Azure OpenAI Configuration ---------------------
-endpoint = os.getenv("ENDPOINT_URL", "https://60649-m6q4t7cw-eastus2.openai.azure.com/")
-deployment = os.getenv("DEPLOYMENT_NAME", "gpt-4o")
-subscription_key = os.getenv(
-    "AZURE_OPENAI_API_KEY",
-    "3G6NJ6fwi6zmNoJyPoqrpZBE0IjzqCGlDEIKFQrsbUW2U86rmXW8JQQJ99BBACHYHv6XJ3w3AAAAACOGhgbr",
+from kg_cache import LRUCache, result_size, versioned_query
+from kg_context import (
+    ContextStats,
+    budget_from_env,
+    compact_blocks,
+    estimate_tokens,
+    line_format_tokens,
 )
+from kg_store import TRIPLE_COLUMNS, load_store, source_state
+from keyword_cache import KeywordCache
+from session_state import SessionCache
+from single_flight import Broadcast, SingleFlight
+from text_normalize import normalize_text
+from translation_memory import TranslationMemory, batch_prompt, parse_batch, split_segments
+from llm_client import LLMError, client as llm
+
+logger = logging.getLogger(__name__)
 
-openai.api_type = "azure"
-openai.api_base = endpoint
-openai.api_key = subscription_key
-openai.api_version = "2023-03-15-preview"
+# --------------------- 1. Azure OpenAI Configuration ---------------------
+# 端点、密钥、部署名与超时/重试/熔断都在 llm_client 中统一配置
 
 # --------------------- 2. Global CSV Path ---------------------
 CSV_PATH = "./merged_cleaned_all_recipes.csv"
 
 
-def init_history_file(user_id_file="user123.csv"):
+class RequestContext:
+    """
+    一次请求用到的路径：会话历史文件 history_csv，以及本次 KG 结果的落盘目录 kg_dir。
+    do_* 函数只从这里取路径，不再依赖模块级全局变量，同一进程内的并发请求互不干扰。
+    kg_dir 为 None 时 KG 结果只在内存中返回，不写文件。
+    """
+
+    def __init__(self, history_csv: str, kg_dir: str = None):
+        self.history_csv = history_csv
+        self.kg_dir = kg_dir
+
+
+def init_history_file(user_id_file="user123.csv", kg_dir=None) -> RequestContext:
     # timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    global HISTORY_CSV
-    HISTORY_CSV = user_id_file
-    if not os.path.exists(HISTORY_CSV):
+    if not os.path.exists(user_id_file):
         df = pd.DataFrame(columns=["round", "type", "content", "time"])
-        df.to_csv(HISTORY_CSV, index=False, encoding="utf-8-sig")
+        df.to_csv(user_id_file, index=False, encoding="utf-8-sig")
+    return RequestContext(user_id_file, kg_dir)
 
 
 # --------------------- 3. NutritionKG Class ---------------------
 class NutritionKG:
+    """
+    食谱知识图谱。构造时一次性加载进 TripleStore（有最新快照时直接 mmap 打开，
+    否则解析 CSV），之后的检索都走内存索引，不再逐块重新读取 CSV。
+    快照用 `python kg_store.py build` 生成。
+
+    热更新：reload() 在后台建好新的 TripleStore 后整体替换 self.store，
+    替换是一次属性赋值，对读者是原子的。一次请求应先取 pinned() 视图，
+    保证请求内所有查询都落在同一版本上；旧版本在没有引用后自然释放。
+
+    检索方法的结果按 (方法, 版本, 参数) 缓存在 query_cache 中（LRU + TTL + 内存上限），
+    调用方拿到的都是副本；版本变化后旧条目随之失效。
+    """
+
+    QUERY_CACHE_MAX_ENTRIES = 1024
+    QUERY_CACHE_MAX_BYTES = 128 << 20
+    QUERY_CACHE_TTL = 3600.0
+
     def __init__(self, csv_path: str = CSV_PATH):
         self.csv_path = csv_path
+        self.store = load_store(csv_path)
+        # 后台线程里检查更新时不受工作目录变化影响
+        self._source_path = os.path.abspath(csv_path)
+        self._source_state = source_state(self._source_path)
+        self._reload_lock = threading.Lock()
+        self._reload_listeners = []
+        self._watcher = None
+        self.query_cache = LRUCache(
+            self.QUERY_CACHE_MAX_ENTRIES,
+            self.QUERY_CACHE_MAX_BYTES,
+            sizeof=result_size,
+            ttl=self.QUERY_CACHE_TTL,
+        )
+        self.add_reload_listener(self._drop_cached_version)
+
+    @property
+    def version(self) -> str:
+        return self.store.version
+
+    def pinned(self) -> "NutritionKG":
+        """返回绑定当前版本索引的视图，之后的热更新不会影响它。"""
+        view = copy.copy(self)
+        view._watcher = None
+        return view
+
+    def add_reload_listener(self, callback):
+        """注册 callback(old_version, new_version)，版本变化后调用，供上层缓存失效。"""
+        self._reload_listeners.append(callback)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        重新加载数据集并替换索引。CSV 和快照都没有变化且 force=False 时不做任何事。
+        加载失败时保留旧索引并抛出异常。返回是否发生了替换。
+        """
+        with self._reload_lock:
+            state = source_state(self._source_path)
+            if not force and state == self._source_state:
+                return False
+            new_store = load_store(self._source_path)
+            old_version = self.store.version
+            self.store = new_store
+            self._source_state = state
+
+        print(f"[KG] 已加载数据集版本 {new_store.version}（原版本 {old_version}）")
+        if new_store.version != old_version:
+            for callback in list(self._reload_listeners):
+                callback(old_version, new_store.version)
+        return True
+
+    def reload_in_background(self, force: bool = False) -> threading.Thread:
+        thread = threading.Thread(
+            target=self._reload_quietly, kwargs={"force": force}, daemon=True
+        )
+        thread.start()
+        return thread
+
+    def start_watching(self, interval: float = 30.0):
+        """启动后台线程，每 interval 秒检查一次 CSV/快照是否更新。"""
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                self._reload_quietly()
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def _drop_cached_version(self, old_version: str, new_version: str):
+        self.query_cache.discard_where(lambda key: key[1] == old_version)
+
+    def cache_stats(self) -> dict:
+        return {
+            "query": self.query_cache.stats(),
+        }
+
+    def _reload_quietly(self, force: bool = False):
+        try:
+            self.reload(force=force)
+        except Exception as e:
+            print(f"[KG] 热更新失败，继续使用版本 {self.version}: {e}")
 
+    @versioned_query
     def advanced_search(
         self,
         relation_filter: str,
         object_filter: str = None,
         exact_relation: bool = True,
     ) -> pd.DataFrame:
-        usecols = ["subject", "relation", "object"]
-        chunksize = 100_000
-        matched_df_list = []
-
-        offset = 0
-        chunks = pd.read_csv(self.csv_path, chunksize=chunksize, dtype=str)
-        for chunk in chunks:
-            chunk.reset_index(drop=False, inplace=True)
-            chunk["csv_idx"] = chunk["index"] + offset
-            sub_chunk = chunk[usecols + ["csv_idx"]].copy()
-
-            sub_chunk.dropna(subset=["subject", "relation", "object"], inplace=True)
-
-            if exact_relation:
-                temp_df = sub_chunk[sub_chunk["relation"] == relation_filter]
-            else:
-                temp_df = sub_chunk[
-                    sub_chunk["relation"].str.contains(relation_filter, na=False)
-                ]
-
-            if object_filter:
-                temp_df = temp_df[
-                    temp_df["object"].str.contains(object_filter, na=False)
-                ]
+        store = self.store
+        if exact_relation:
+            row_ids = store.lookup("relation", relation_filter)
+        else:
+            row_ids = store.contains("relation", relation_filter)
 
-            if not temp_df.empty:
-                matched_df_list.append(temp_df)
+        if object_filter:
+            row_ids = np.intersect1d(
+                row_ids, store.contains("object", object_filter), assume_unique=True
+            )
 
-            offset += len(chunk)
+        row_ids = store.only_complete(row_ids)
+        return store.frame(row_ids, TRIPLE_COLUMNS + ["csv_idx"])
 
-        if matched_df_list:
-            final_df = pd.concat(matched_df_list, ignore_index=True).drop_duplicates()
+    @versioned_query
+    def search_many(
+        self, relation_filter: str, keywords: list, exact_relation: bool = True
+    ) -> pd.DataFrame:
+        """
+        一次匹配全部关键词，代替逐个 advanced_search 后再 concat/去重。
+        每行只出现一次，matched_keywords 记录该行命中的关键词（tuple，
+        结果会被缓存，单元格须不可变），match_count 为命中数。空关键词被忽略。
+        """
+        store = self.store
+        if exact_relation:
+            rel_ids = store.lookup("relation", relation_filter)
         else:
-            final_df = pd.DataFrame(
-                columns=["subject", "relation", "object", "csv_idx"]
-            )
-
+            rel_ids = store.contains("relation", relation_filter)
+        in_relation = np.zeros(len(store), dtype=bool)
+        in_relation[store.only_complete(rel_ids)] = True
+
+        row_ids, matched = store.contains_many("object", keywords, in_relation)
+        final_df = store.frame(row_ids, TRIPLE_COLUMNS + ["csv_idx"])
+        final_df["matched_keywords"] = pd.Series(matched, dtype=object)
+        final_df["match_count"] = np.fromiter(map(len, matched), dtype=np.int64)
         return final_df
 
-    def get_all_triples_for_subject(self, subject_str: str) -> pd.DataFrame:
-        chunksize = 100_000
-        matched_df_list = []
-        offset = 0
-        chunks = pd.read_csv(self.csv_path, chunksize=chunksize, dtype=str)
-        for chunk in chunks:
-            chunk.reset_index(drop=False, inplace=True)
-            chunk["csv_idx"] = chunk["index"] + offset
-            sub_chunk = chunk[["subject", "relation", "object", "csv_idx"]].copy()
-
-            sub_chunk.dropna(subset=["subject", "relation", "object"], inplace=True)
-            temp_df = sub_chunk[sub_chunk["subject"] == subject_str]
-            if not temp_df.empty:
-                matched_df_list.append(temp_df)
-
-            offset += len(chunk)
+    @versioned_query
+    def top_subjects(self, keywords: list, k: int = 50) -> list:
+        """
+        用 食谱 x 功效 矩阵给全部食谱打分后取前 k 个。
+        得分为该食谱命中任一关键词的"食谱的功效"行数，
+        与对 search_many 结果按 subject 计数相同；同分按 CSV 中出现的先后。
+        """
+        store = self.store
+        matrix = store.benefits
+        matched = [store.matching_codes("object", kw) for kw in keywords if kw]
+        query = matrix.query_vector(
+            np.concatenate(matched) if matched else np.empty(0, dtype=np.int64)
+        )
+        top = matrix.top_k(matrix.scores(query), k)
+        return store.strings.decode_many(matrix.recipe_codes[top]).tolist()
 
-        if matched_df_list:
-            final_df = pd.concat(matched_df_list, ignore_index=True).drop_duplicates()
-        else:
-            final_df = pd.DataFrame(
-                columns=["subject", "relation", "object", "csv_idx"]
-            )
+    def filter_by_ingredients(
+        self, sub_df: pd.DataFrame, include: list, exclude: list
+    ) -> pd.DataFrame:
+        """
+        保留 sub_df 中 subject 含有全部 include 食材、且不含任何 exclude 食材的行。
+        sub_df 需带 csv_idx 列；判断走食材位图索引。
+        """
+        if sub_df.empty:
+            return sub_df
+        store = self.store
+        subject_codes = store.codes["subject"][sub_df["csv_idx"].to_numpy()]
+        mask = store.ingredients.filter(
+            subject_codes,
+            [store.strings.code_of(ing) for ing in include],
+            [store.strings.code_of(ing) for ing in exclude],
+        )
+        return sub_df[mask]
 
-        return final_df
+    @versioned_query
+    def get_all_triples_for_subject(self, subject_str: str) -> pd.DataFrame:
+        store = self.store
+        row_ids = store.only_complete(store.lookup("subject", subject_str))
+        return store.frame(row_ids, TRIPLE_COLUMNS + ["csv_idx"])
 
     def build_subgraph_from_df(self, sub_df: pd.DataFrame) -> nx.DiGraph:
         g_sub = nx.DiGraph()
@@ -121,26 +258,40 @@ class NutritionKG:
             g_sub.add_edge(s, o, relation=r)
         return g_sub
 
+    def display_name(self, subject_str: str, is_english: bool = False) -> str:
+        """回答中显示的菜名：英文时查中英对齐表，查不到则用原名。"""
+        return self._display_name(self.store, subject_str, is_english)
+
+    @staticmethod
+    def _display_name(store, subject_str: str, is_english: bool) -> str:
+        if is_english:
+            return store.alignment.to_english("recipe", subject_str, subject_str)
+        return subject_str
+
+    @versioned_query
+    def relation_groups(self, subject_str: str) -> tuple:
+        """
+        该食谱的边按关系分组并去重：((关系, ((对象, cat), …)), …)，
+        关系与对象都按在 CSV 中首次出现的顺序排列。
+        """
+        store = self.store
+        row_ids = store.only_complete(store.lookup("subject", subject_str))
+        groups = {}
+        for r, o, cat in store.frame(row_ids, ["relation", "object", "cat"]).itertuples(
+            index=False
+        ):
+            groups.setdefault(r, {}).setdefault(o, cat if isinstance(cat, str) else None)
+        return tuple((r, tuple(objs.items())) for r, objs in groups.items())
+
+    @versioned_query
     def get_full_data_for_subject(self, subject_str: str) -> pd.DataFrame:
-        chunksize = 100_000
-        matched_df_list = []
-        offset = 0
-        chunks = pd.read_csv(self.csv_path, chunksize=chunksize, dtype=str)
-        for chunk in chunks:
-            chunk.reset_index(drop=False, inplace=True)
-            chunk["csv_idx"] = chunk["index"] + offset
-
-            temp_df = chunk[chunk["subject"] == subject_str].copy()
-            if not temp_df.empty:
-                matched_df_list.append(temp_df)
-
-            offset += len(chunk)
-
-        if matched_df_list:
-            final_df = pd.concat(matched_df_list, ignore_index=True).drop_duplicates()
-        else:
-            final_df = pd.DataFrame()
+        store = self.store
+        row_ids = store.lookup("subject", subject_str)
+        if len(row_ids) == 0:
+            return pd.DataFrame()
 
+        final_df = store.frame(row_ids, store.columns + ["csv_idx"])
+        final_df.insert(0, "index", final_df["csv_idx"])
         return final_df
 
 
@@ -170,7 +321,21 @@ KEYWORD_SYSTEM_PROMPT = """1. 【角色设定】 你是一位资深的食药同
 """
 
 
-def extract_keywords(user_question: str) -> list:
+# 关键词只取决于问句（temperature=0），相同或近似的问句直接复用
+KEYWORD_CACHE = KeywordCache.from_env()
+
+
+def extract_keywords(user_question: str, before_request=None) -> list:
+    """
+    before_request 不为 None 时，在发出 LLM 请求前调用；返回 False 表示结果已不需要，
+    此时不发请求，直接返回空列表（见 Speculation）。
+    """
+    cached = KEYWORD_CACHE.lookup(user_question)
+    if cached is not None:
+        return cached
+    if before_request is not None and not before_request():
+        return []
+
     messages = [
         {"role": "system", "content": KEYWORD_SYSTEM_PROMPT},
         {
@@ -179,14 +344,13 @@ def extract_keywords(user_question: str) -> list:
         },
     ]
     try:
-        response = openai.ChatCompletion.create(
-            engine=deployment, messages=messages, temperature=0.0, max_tokens=200
-        )
-        raw_text = response.choices[0].message.content.strip()
-    except Exception:
+        raw_text = llm.chat("keywords", messages, temperature=0.0, max_tokens=200)
+    except LLMError as e:
+        print(f"[LLM] 关键词提取失败: {e}")
         return []
     pattern = r"\(([一-龥]{2})\)"
     matches = re.findall(pattern, raw_text)
+    KEYWORD_CACHE.add(user_question, matches)
     return matches
 
 
@@ -213,9 +377,52 @@ MODERN_STYLE_SYSTEM_PROMPT = r"""你是一位专业营养师和医学顾问，
 """
 
 
-def generate_final_explanation(
+KG_CONTEXT_TOKEN_BUDGET = budget_from_env()
+KG_CONTEXT_STATS = ContextStats()
+
+
+def build_kg_context(
+    nutrition_kg: NutritionKG,
+    subjects: list,
+    display_names: list,
+    keywords: list,
+    budget: int = None,
+) -> list:
+    """
+    生成提示词中的知识图谱部分：每道菜一块，边去重后按关系合并成一行，
+    超出 token 预算时按优先级截断（见 kg_context.compact_blocks）。
+    三元组与回答一样用中文（英文回答由中文译出），标题沿用回答中显示的菜名。
+    与原先逐行 "菜 -[关系]-> 对象" 的文本相比节省的 token 数逐次写入日志并累计到
+    KG_CONTEXT_STATS，原文本的 token 数由同一份分组数据估算，不再渲染原格式。
+    """
+    if budget is None:
+        budget = KG_CONTEXT_TOKEN_BUDGET
+    recipes = [
+        (name, nutrition_kg.relation_groups(subj))
+        for subj, name in zip(subjects, display_names)
+    ]
+    blocks, truncated = compact_blocks(recipes, keywords, budget)
+
+    before = sum(
+        line_format_tokens(subj, name, groups)
+        for subj, (name, groups) in zip(subjects, recipes)
+    )
+    after = estimate_tokens("\n\n".join(blocks))
+    KG_CONTEXT_STATS.record(before, after, truncated)
+    logger.info(
+        "KG context for %d recipes: %d tokens before, %d after, %d saved%s",
+        len(subjects),
+        before,
+        after,
+        before - after,
+        " (truncated)" if truncated else "",
+    )
+    return blocks
+
+
+def final_explanation_messages(
     user_question: str, keywords: list, recommended_names: list, subgraph_texts: list
-) -> str:
+) -> list:
     combined_subgraphs = "\n\n".join(subgraph_texts)
     recommended_str = "\n".join(
         f"{i+1}. {name}" for i, name in enumerate(recommended_names)
@@ -238,16 +445,33 @@ def generate_final_explanation(
         {"role": "system", "content": MODERN_STYLE_SYSTEM_PROMPT},
         {"role": "user", "content": user_content},
     ]
+    return messages
+
+
+def generate_final_explanation(
+    user_question: str, keywords: list, recommended_names: list, subgraph_texts: list
+) -> str:
+    messages = final_explanation_messages(
+        user_question, keywords, recommended_names, subgraph_texts
+    )
     try:
-        response = openai.ChatCompletion.create(
-            engine=deployment, messages=messages, temperature=0.2, max_tokens=1200
-        )
-        final_answer = response.choices[0].message.content.strip()
-    except Exception:
+        final_answer = llm.chat("explanation", messages, temperature=0.2, max_tokens=1200)
+    except LLMError as e:
+        print(f"[LLM] 生成回答失败: {e}")
         final_answer = "对不起，生成回答时发生错误。"
     return final_answer
 
 
+def stream_final_explanation(
+    user_question: str, keywords: list, recommended_names: list, subgraph_texts: list
+):
+    """与 generate_final_explanation 相同的请求，以流式逐块返回文本。"""
+    messages = final_explanation_messages(
+        user_question, keywords, recommended_names, subgraph_texts
+    )
+    return stream_chat("explanation", messages, 0.2, 1200, "对不起，生成回答时发生错误。")
+
+
 # --------------------- 6. Translation if mostly English ---------------------
 TRANSLATION_SYSTEM_PROMPT = """You are a professional English translator.
 Please translate the following Chinese text (including any Markdown code blocks) into clear, coherent English.
@@ -255,37 +479,286 @@ Maintain the Markdown formatting and code blocks.
 """
 
 
+BATCH_TRANSLATION_SYSTEM_PROMPT = (
+    TRANSLATION_SYSTEM_PROMPT
+    + """The text is split into segments. Each segment starts with a marker line such as <<<SEG 0>>>.
+Translate every segment and output it right after the same marker line, keeping every marker exactly as given.
+Output nothing except the markers and the translations.
+"""
+)
+
+# 片段级翻译记忆：热门菜谱段落在不同用户间大量重复，译过的片段直接复用
+TRANSLATION_MEMORY = TranslationMemory(
+    max_entries=int(os.getenv("TRANSLATION_MEMORY_MAX_ENTRIES", "20000")),
+    max_bytes=int(os.getenv("TRANSLATION_MEMORY_MAX_BYTES", str(32 << 20))),
+)
+# 单次翻译请求允许的最大输出 token 数（gpt-4o 的输出上限为 16384）
+TRANSLATION_MAX_OUTPUT_TOKENS = int(os.getenv("TRANSLATION_MAX_OUTPUT_TOKENS", "16000"))
+
+
+def translation_max_tokens(segments: list) -> int:
+    """按原文估算译文的 token 上限：英文约为中文的两倍，另加每段标记与少量余量。"""
+    needed = 256 + sum(2 * estimate_tokens(seg) + 16 for seg in segments)
+    return min(needed, TRANSLATION_MAX_OUTPUT_TOKENS)
+
+
+def translate_segment(segment: str) -> str:
+    """单独翻译一个片段（批量输出里缺了或截断了该片段时使用），结果写入翻译记忆。"""
+    messages = [
+        {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
+        {"role": "user", "content": segment},
+    ]
+    translation = llm.chat(
+        "translation",
+        messages,
+        temperature=0.0,
+        max_tokens=max(1000, translation_max_tokens([segment])),
+    )
+    TRANSLATION_MEMORY.put(segment, translation)
+    return translation
+
+
+def translation_chunks(chinese_text: str):
+    """
+    按段落与标题切分后逐块产出译文：命中翻译记忆的片段直接使用，
+    其余片段合并为一次流式请求，按原文顺序在各自译完时输出。
+    批量输出的最后一个片段只有在模型正常结束（finish_reason 为 stop）时才采用，
+    否则可能被 max_tokens 截断，改为单独翻译，避免把半截译文写进翻译记忆。
+    失败时抛出 LLMError。
+    """
+    items = split_segments(chinese_text.strip())
+    translated = {}
+    pending = []
+    for i, (needs_translation, text) in enumerate(items):
+        if not needs_translation:
+            translated[i] = text
+            continue
+        hit = TRANSLATION_MEMORY.get(text)
+        if hit is None:
+            pending.append(i)
+        else:
+            translated[i] = hit
+
+    done = 0
+
+    def ready():
+        # 按顺序输出已经就绪的块，块之间补回换行
+        nonlocal done
+        out = []
+        while done < len(items) and done in translated:
+            out.append(translated[done] + ("\n" if done < len(items) - 1 else ""))
+            done += 1
+        return "".join(out)
+
+    text = ready()
+    if text:
+        yield text
+    if pending:
+        segments = [items[i][1] for i in pending]
+        messages = [
+            {"role": "system", "content": BATCH_TRANSLATION_SYSTEM_PROMPT},
+            {"role": "user", "content": batch_prompt(segments)},
+        ]
+        finish = []
+        batch = llm.stream(
+            "translation",
+            messages,
+            0.0,
+            translation_max_tokens(segments),
+            on_finish=finish.append,
+        )
+        for seg_id, translation, closed in parse_batch(batch):
+            if not 0 <= seg_id < len(pending) or pending[seg_id] in translated:
+                continue
+            if not closed and finish[-1:] != ["stop"]:
+                print(f"[Translation] 批量翻译未正常结束（{finish}），最后一段单独翻译")
+                continue
+            item_id = pending[seg_id]
+            translated[item_id] = translation
+            TRANSLATION_MEMORY.put(items[item_id][1], translation)
+            text = ready()
+            if text:
+                yield text
+        for item_id in pending:
+            if item_id not in translated:
+                translated[item_id] = translate_segment(items[item_id][1])
+        text = ready()
+        if text:
+            yield text
+
+
 def translate_to_english(chinese_text: str) -> str:
     try:
-        response = openai.ChatCompletion.create(
-            engine=deployment,
-            messages=[
-                {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
-                {"role": "user", "content": chinese_text},
-            ],
-            temperature=0.0,
-            max_tokens=1000,
-        )
-        eng_text = response.choices[0].message.content.strip()
-        return eng_text
-    except Exception:
+        return "".join(translation_chunks(chinese_text)).strip()
+    except LLMError as e:
+        print(f"[LLM] 翻译失败: {e}")
         return "Sorry, translation error occurred."
 
 
-# --------------------- 7. Save CSV for top 3 recommended recipes ---------------------
-def clear_old_kg_files():
+def stream_translation(chinese_text: str):
+    produced = False
+    try:
+        for text in translation_chunks(chinese_text):
+            produced = True
+            yield text
+    except LLMError as e:
+        print(f"[LLM] 流式翻译中断: {e}")
+        if not produced:
+            yield "Sorry, translation error occurred."
+
+
+# --------------------- 7. Concurrent LLM Stages ---------------------
+# LLM 调用都是阻塞的网络往返，放进线程池后可与意图判断、KG 检索和写文件重叠进行
+LLM_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_POOL_WORKERS", "8")), thread_name_prefix="llm"
+)
+
+
+def submit_llm(fn, *args, **kwargs) -> Future:
+    return LLM_POOL.submit(fn, *args, **kwargs)
+
+
+class SpeculationStats:
+    """提前提交的 LLM 调用：用上的、请求发出前取消的、请求已发出后才取消（浪费）的次数。"""
+
+    def __init__(self):
+        self.started = 0
+        self.used = 0
+        self.avoided = 0
+        self.wasted = 0
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "used": self.used,
+                "avoided": self.avoided,
+                "wasted": self.wasted,
+            }
+
+
+SPECULATION_STATS = SpeculationStats()
+
+
+class Speculation:
+    """
+    提前提交到 LLM_POOL、最终可能用不上的调用。fn 以关键字参数 before_request 接收一个回调，
+    在发出 LLM 请求前调用它，返回 False 时放弃请求。
+    cancel() 对还在排队的任务直接取消；已经开始执行但还没发请求的，由 before_request 拦下；
+    请求已经发出的无法撤回，计入 SPECULATION_STATS 的 wasted。
+    """
+
+    def __init__(self, fn, *args):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._sent = False
+        SPECULATION_STATS.record("started")
+        self.future = submit_llm(fn, *args, before_request=self._before_request)
+
+    def _before_request(self) -> bool:
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._sent = True
+            return True
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            sent = self._sent
+        if not self.future.cancel() and sent:
+            SPECULATION_STATS.record("wasted")
+        else:
+            SPECULATION_STATS.record("avoided")
+
+    def result(self):
+        SPECULATION_STATS.record("used")
+        return self.future.result()
+
+
+def speculate_keywords(user_text: str) -> Speculation:
+    """提前开始提取关键词；若最终不需要，调用方应 cancel()。"""
+    return Speculation(extract_keywords, user_text)
+
+
+def resolve(value):
+    """Future / Speculation 取结果，普通值原样返回。"""
+    return value.result() if isinstance(value, (Future, Speculation)) else value
+
+
+def stream_chat(
+    stage: str, messages: list, temperature: float, max_tokens: int, fallback: str
+):
+    """
+    流式调用，逐块产出文本。
+    还没有产出任何内容就出错时产出 fallback，与非流式调用的兜底文案一致。
+    """
+    produced = False
+    try:
+        for text in llm.stream(stage, messages, temperature, max_tokens):
+            produced = True
+            yield text
+    except LLMError as e:
+        print(f"[LLM] 流式输出中断: {e}")
+        if not produced:
+            yield fallback
+
+
+def answer_chunks(chinese_chunks, translate: bool):
+    """
+    产出最终回答的文本块。chinese_chunks() 返回中文回答的流；
+    需要英文时先完整取得中文回答，再流式输出译文。
+    """
+    if translate:
+        yield from stream_translation("".join(chinese_chunks()).strip())
+    else:
+        yield from chinese_chunks()
+
+
+def record_when_done(chunks, on_complete):
+    """
+    原样转发 chunks，全部输出后以完整文本调用 on_complete（写历史）；
+    客户端中途断开时也会读完剩余内容再调用。
+    """
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    finally:
+        parts.extend(chunks)
+        on_complete("".join(parts).strip())
+
+
+def stream_answer(chinese_chunks, translate: bool, on_complete):
+    return record_when_done(answer_chunks(chinese_chunks, translate), on_complete)
+
+
+# --------------------- 8. Save CSV for top 3 recommended recipes ---------------------
+def clear_old_kg_files(kg_dir: str):
     for i in range(1, 4):
-        fname = f"KG{i}.csv"
+        fname = os.path.join(kg_dir, f"KG{i}.csv")
         if os.path.exists(fname):
             os.remove(fname)
 
 
 def self_save_full_subject_csv(
-    nutrition_kg: NutritionKG, subject_name: str, rank_id: int, is_english: bool = False
+    nutrition_kg: NutritionKG,
+    subject_name: str,
+    rank_id: int,
+    is_english: bool = False,
+    kg_dir: str = None,
 ) -> (pd.DataFrame, str):
     """
-    根据 subject_name 获取所有行并写入 KG{rank_id}.csv。
-    若 is_english=True，则尝试查找其英文行(行号+1)并覆盖保存。
+    根据 subject_name 获取所有行；kg_dir 不为 None 时同时写入 kg_dir/KG{rank_id}.csv。
+    若 is_english=True，则通过中英对齐表换成对应的英文行。
     返回 (最终DataFrame, 用于在回答中显示的菜名)。
     """
     full_df = nutrition_kg.get_full_data_for_subject(subject_name)
@@ -294,48 +767,87 @@ def self_save_full_subject_csv(
 
     display_name = subject_name
     if is_english:
-        all_data = pd.read_csv(nutrition_kg.csv_path, dtype=str)
-        all_data.reset_index(drop=False, inplace=True)
-        new_df_list = []
-        for _, row in full_df.iterrows():
-            real_idx = row["csv_idx"]
-            english_row_idx = real_idx + 1
-            sub_row = all_data[all_data["index"] == english_row_idx]
-            if not sub_row.empty:
-                new_df_list.append(sub_row.drop(columns=["index"]))
-        if new_df_list:
-            english_full_df = pd.concat(
-                new_df_list, ignore_index=True
-            ).drop_duplicates()
-            if not english_full_df.empty:
-                subj_list = english_full_df["subject"].dropna().unique()
-                if len(subj_list) > 0:
-                    display_name = subj_list[0]
-            full_df = english_full_df
-
-    filename = f"KG{rank_id}.csv"
-    full_df.to_csv(filename, index=False, encoding="utf-8-sig")
+        store = nutrition_kg.store
+        english_ids = store.alignment.english_rows(full_df["csv_idx"].to_numpy())
+        full_df = store.frame(english_ids, store.columns).drop_duplicates()
+        display_name = store.alignment.to_english("recipe", subject_name, subject_name)
+
+    if kg_dir is not None:
+        filename = os.path.join(kg_dir, f"KG{rank_id}.csv")
+        full_df.to_csv(filename, index=False, encoding="utf-8-sig")
     return full_df, display_name
 
 
-# --------------------- 8. Multi-round History and Main Chat Loop ---------------------
-def append_history(round_id: int, record_type: str, content: str):
+def save_top_subject_csvs(
+    nutrition_kg: NutritionKG,
+    subjects: list,
+    is_english: bool = False,
+    kg_dir: str = None,
+) -> pd.DataFrame:
+    """
+    取前 n 道菜的全部行，在内存中合并后作为返回给前端的知识图谱。
+    kg_dir 不为 None 时（每个请求各自的目录）另外写出 KG1..KGn.csv 留档。
+    """
+    if kg_dir is not None:
+        os.makedirs(kg_dir, exist_ok=True)
+        clear_old_kg_files(kg_dir)
+    frames = []
+    for i, subj in enumerate(subjects, start=1):
+        full_df, _ = self_save_full_subject_csv(
+            nutrition_kg, subj, i, is_english=is_english, kg_dir=kg_dir
+        )
+        if not full_df.empty:
+            frames.append(full_df)
+    if not frames:
+        if subjects:
+            print("No KG rows found.")
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+# --------------------- 9. Multi-round History and Main Chat Loop ---------------------
+def persist_history_rows(history_csv: str, records: list):
+    """
+    把 (round, type, content, time) 记录追加到历史文件，由 SESSIONS 在后台调用。
+    全部记录先写进缓冲区，再一次 write 落盘；格式与 DataFrame.to_csv 追加时相同。
+    返回写入的字节数，SESSIONS 据此判断文件是否只被本进程写过。
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if not os.path.exists(history_csv):
+        buffer.write("\ufeff")
+        writer.writerow(["round", "type", "content", "time"])
+    writer.writerows(records)
+    data = buffer.getvalue().encode("utf-8")
+    with open(history_csv, "ab") as f:
+        f.write(data)
+    return len(data)
+
+
+# 各会话历史文件的内存状态（轮次、上一轮回答、关键词、候选），写入先进内存再后台落盘
+SESSIONS = SessionCache(
+    persist_history_rows,
+    max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1024")),
+    flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5")),
+    max_pending=int(os.getenv("SESSION_MAX_PENDING", "10000")),
+)
+
+
+def commit_round(history_csv: str, round_id: int, records: list):
+    """
+    一次提交一轮的全部 (type, content) 记录：内存中的会话状态同时更新，
+    落盘时与同一文件的其他待写记录一起一次写入。
+    """
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    new_data = pd.DataFrame(
-        [{"round": round_id, "type": record_type, "content": content, "time": now_str}]
-    )
-    new_data.to_csv(
-        HISTORY_CSV, mode="a", header=False, index=False, encoding="utf-8-sig"
-    )
+    SESSIONS.commit(history_csv, round_id, records, now_str)
 
 
-def load_latest_round():
-    if not os.path.exists(HISTORY_CSV):
-        return 0
-    df = pd.read_csv(HISTORY_CSV, encoding="utf-8-sig")
-    if df.empty:
-        return 0
-    return df["round"].max()
+def append_history(history_csv: str, round_id: int, record_type: str, content: str):
+    commit_round(history_csv, round_id, [(record_type, content)])
+
+
+def load_latest_round(history_csv: str):
+    return SESSIONS.get(history_csv).round
 
 
 def detect_language(user_text: str) -> bool:
@@ -348,48 +860,23 @@ def detect_language(user_text: str) -> bool:
     return en_count > zh_count
 
 
-def get_top50_subjects(df: pd.DataFrame) -> list:
-    if df.empty:
-        return []
-    counts_series = df["subject"].value_counts()
-    subject_counts = list(counts_series.items())
-    subject_counts.sort(key=lambda x: x[1], reverse=True)
-    top_subs = [item[0] for item in subject_counts[:50]]
-    return top_subs
-
-
 def is_english_word(text: str) -> bool:
     en_count = len(re.findall(r"[A-Za-z]", text))
     zh_count = len(re.findall(r"[\u4E00-\u9FFF]", text))
     return en_count > zh_count
 
 
-def map_english_ingredients_to_chinese(ings: list, csv_path: str) -> (list, dict):
+def map_english_ingredients_to_chinese(
+    ings: list, nutrition_kg: NutritionKG
+) -> (list, dict):
     """
     将英文食材映射到对应的中文名称(若数据库有)，返回 (转换后列表, 映射字典)
-    - 在此函数中加入详细打印信息，方便排查搜不到/映射失败的原因。
+    - 映射直接查加载 KG 时建好的中英对齐表，不再读取 CSV。
     """
     if not ings:
         return ings, {}
 
-    big_df = pd.read_csv(csv_path, dtype=str)
-    big_df.reset_index(drop=False, inplace=True)
-
-    # 这里可以根据自己的实际情况，决定只匹配 "Ingredient" 还是 "食谱的食材构成"
-    # 或者两者皆可
-    big_df = big_df[
-        (big_df["relation"] == "Ingredient") | (big_df["relation"] == "食谱的食材构成")
-    ].copy()
-
-    if big_df.empty:
-        print(
-            "[DEBUG] 整个CSV中，没有 relation=Ingredient 或 relation=食谱的食材构成 的记录。"
-        )
-        return ings, {}
-
-    # 添加一列小写
-    big_df["object_lower"] = big_df["object"].str.lower()
-
+    alignment = nutrition_kg.store.alignment
     result_ings = []
     map_dict = {}
 
@@ -400,126 +887,134 @@ def map_english_ingredients_to_chinese(ings: list, csv_path: str) -> (list, dict
             result_ings.append(ing)
             continue
 
-        ing_lower = ing.lower()
-        print(
-            f"\n[DEBUG] 正在尝试将英文食材 '{ing}' (小写: '{ing_lower}') 映射为中文..."
-        )
-
-        # 在 big_df 中搜索
-        match_df = big_df[big_df["object_lower"] == ing_lower]
-
-        if match_df.empty:
-            print(
-                f"[DEBUG] 未在 CSV 里找到任何 object_lower='{ing_lower}' 的行，映射失败。"
-            )
+        zh_ing = alignment.to_chinese("ingredient", ing)
+        if zh_ing is None:
+            print(f"[DEBUG] 中英对齐表里没有食材 '{ing}'，映射失败。")
             result_ings.append(ing)
         else:
-            # 如果搜到多行，只取第一行（沿用原逻辑）
-            row = match_df.iloc[0]
-            row_above_idx = row["index"] - 1
-
-            print(f"[DEBUG] 找到英文行: index={row['index']}, object={row['object']}")
-            if row_above_idx < 0:
-                # 说明是 CSV 第一行，没法往上找
-                print("[DEBUG] 英文行在 CSV 第 0 行或之前，无法找到上一行中文食材。")
-                result_ings.append(ing)
-            else:
-                above_df = big_df[big_df["index"] == row_above_idx]
-                if above_df.empty:
-                    print(
-                        f"[DEBUG] 上一行 index={row_above_idx} 不存在或不符合条件，无法拿到中文。"
-                    )
-                    result_ings.append(ing)
-                else:
-                    zh_ing = above_df["object"].values[0]
-                    print(
-                        f"[DEBUG] 已匹配到中文行: index={row_above_idx}, object={zh_ing}"
-                    )
-                    result_ings.append(zh_ing)
-                    map_dict[ing] = zh_ing
+            print(f"[DEBUG] 英文食材 '{ing}' 已映射为中文: {zh_ing}")
+            result_ings.append(zh_ing)
+            map_dict[ing] = zh_ing
 
     return result_ings, map_dict
 
 
-def do_new_round(user_text: str, nutrition_kg: NutritionKG):
-    round_id = load_latest_round() + 1
+ROUND_FLIGHTS = SingleFlight(max_age=float(os.getenv("SINGLE_FLIGHT_MAX_AGE", "120")))
+
+
+def explain_and_translate(explain_args: tuple, translate: bool) -> str:
+    chinese_ans = generate_final_explanation(*explain_args)
+    return translate_to_english(chinese_ans) if translate else chinese_ans
 
-    keywords = extract_keywords(user_text)
-    result_dfs = []
-    for kw in keywords:
-        sub_df = nutrition_kg.advanced_search(
-            "食谱的功效", object_filter=kw, exact_relation=True
-        )
-        if not sub_df.empty:
-            result_dfs.append(sub_df)
-    if result_dfs:
-        final_df = pd.concat(result_dfs, ignore_index=True).drop_duplicates()
-    else:
-        final_df = pd.DataFrame(columns=["subject", "relation", "object", "csv_idx"])
 
-    top_50 = get_top50_subjects(final_df)
-    random.shuffle(top_50)
-    top_3 = top_50[:3]
+def plan_new_round(
+    user_text: str, nutrition_kg: NutritionKG, keywords=None, stream: bool = False
+) -> dict:
+    """
+    新一轮问答中与用户无关的部分：关键词、候选食谱、展示的 3 道菜和回答。
+    回答在返回时已提交生成：stream=False 时为 Future，stream=True 时为 Broadcast。
+    """
+    if keywords is None:
+        keywords = extract_keywords(user_text)
+    keywords = resolve(keywords)
+    top_50 = nutrition_kg.top_subjects(keywords, 50)
+    top_3 = random.sample(top_50, min(3, len(top_50)))
 
-    clear_old_kg_files()
     is_eng = detect_language(user_text)
-    display_names = []
-    subgraph_texts = []
+    display_names = [nutrition_kg.display_name(subj, is_eng) for subj in top_3]
+    subgraph_texts = build_kg_context(nutrition_kg, top_3, display_names, keywords)
 
-    for i, subj in enumerate(top_3, start=1):
-        full_df, disp_name = self_save_full_subject_csv(
-            nutrition_kg, subj, i, is_english=is_eng
+    explain_args = (user_text, keywords, display_names, subgraph_texts)
+    if stream:
+        answer = Broadcast(
+            answer_chunks(lambda: stream_final_explanation(*explain_args), is_eng)
         )
-        display_names.append(disp_name)
-
-        subj_df = nutrition_kg.get_all_triples_for_subject(subj)
-        g_sub = nutrition_kg.build_subgraph_from_df(subj_df)
-        lines = []
-        for u, v, data in g_sub.edges(data=True):
-            r = data.get("relation", "")
-            lines.append(f"{u} -[{r}]-> {v}")
-        sub_text = f"【KG for {disp_name}】\n" + "\n".join(lines)
-        subgraph_texts.append(sub_text)
-
-    chinese_ans = generate_final_explanation(
-        user_text, keywords, display_names, subgraph_texts
-    )
-    final_ans = translate_to_english(chinese_ans) if is_eng else chinese_ans
-
-    append_history(round_id, "question", user_text)
-    for kw in keywords:
-        append_history(round_id, "keyword", kw)
-    for c in top_50:
-        append_history(round_id, "candidate", c)
-    append_history(round_id, "answer", final_ans)
-    if len(top_3) > 0:
-        frames = []
-        for i in range(1, len(top_3) + 1):
-            fname = f"KG{i}.csv"
-            if os.path.exists(fname):
-                frames.append(pd.read_csv(fname, dtype=str))
-        if frames:
-            merged_kg = pd.concat(frames, ignore_index=True)
-        else:
-            print("No KG files found.")
     else:
-        merged_kg = pd.DataFrame()
+        answer = submit_llm(explain_and_translate, explain_args, is_eng)
+    return {
+        "keywords": keywords,
+        "candidates": top_50,
+        "top_3": top_3,
+        "is_eng": is_eng,
+        "answer": answer,
+    }
+
+
+def do_new_round(
+    context: RequestContext,
+    user_text: str,
+    nutrition_kg: NutritionKG,
+    keywords=None,
+    stream: bool = False,
+):
+    """
+    keywords 可以是调用方提前提交的 Speculation（见 speculate_keywords）。
+    相同问题、相同语言的请求同时到达时，关键词、候选食谱和回答只计算一次，
+    由 ROUND_FLIGHTS 在这些请求间共享；轮次、候选顺序（前 3 道之外各自打乱）
+    和历史记录仍按用户分别处理。
+    “相同问题”只忽略空白、大小写、全半角、繁简与标点的差异（normalize_text），
+    不去掉套话：共享的回答是按 leader 的问句生成的，措辞不同的问题不能合并。
+    stream=True 时返回 (merged_kg, 回答文本块的生成器)，历史在生成器读完后写入。
+    """
+    round_id = load_latest_round(context.history_csv) + 1
+
+    flight_key = (
+        normalize_text(user_text) or user_text,
+        detect_language(user_text),
+        nutrition_kg.version,
+        stream,
+    )
+    plan, shared = ROUND_FLIGHTS.do(
+        flight_key,
+        lambda: plan_new_round(user_text, nutrition_kg, keywords, stream),
+        until=lambda plan: plan["answer"],
+    )
+    if shared:
+        print(f"[SingleFlight] 复用进行中的相同问题: {user_text}")
+        if isinstance(keywords, (Future, Speculation)):
+            keywords.cancel()
+
+    top_3 = plan["top_3"]
+    rest = [c for c in plan["candidates"] if c not in top_3]
+    random.shuffle(rest)
+    candidates = top_3 + rest
+    is_eng = plan["is_eng"]
+
+    def record_round(final_ans: str):
+        commit_round(
+            context.history_csv,
+            round_id,
+            [("question", user_text)]
+            + [("keyword", kw) for kw in plan["keywords"]]
+            + [("candidate", c) for c in candidates]
+            + [("answer", final_ans)],
+        )
+
+    # 回答生成期间取出并合并 KG 结果
+    merged_kg = save_top_subject_csvs(
+        nutrition_kg, top_3, is_english=is_eng, kg_dir=context.kg_dir
+    )
+    if stream:
+        return merged_kg, record_when_done(plan["answer"].subscribe(), record_round)
+
+    final_ans = plan["answer"].result()
+    record_round(final_ans)
 
     return merged_kg, final_ans
 
 
-def do_chase_question(user_text: str):
-    round_id = load_latest_round()
+def do_chase_question(context: RequestContext, user_text: str, stream: bool = False):
+    """stream=True 时返回回答文本块的生成器，历史在生成器读完后写入。"""
+    session = SESSIONS.get(context.history_csv)
+    round_id = session.round
     if round_id < 1:
         print("No previous round to chase. Please start a new question.")
         return
 
-    df = pd.read_csv(HISTORY_CSV, encoding="utf-8-sig")
-    last_ans_rows = df[(df["round"] == round_id) & (df["type"] == "answer")]
-    if last_ans_rows.empty:
+    last_final_answer = session.last_answer
+    if last_final_answer is None:
         print("No final answer in the last round. Please start a new question.")
         return
-    last_final_answer = last_ans_rows["content"].values[-1]
 
     is_eng = detect_language(user_text)
     chase_prompt = f"""\
@@ -535,104 +1030,105 @@ def do_chase_question(user_text: str):
         {"role": "system", "content": chase_sys_prompt},
         {"role": "user", "content": chase_prompt},
     ]
-    try:
-        response = openai.ChatCompletion.create(
-            engine=deployment, messages=messages, temperature=0.2, max_tokens=1000
+    new_round_id = round_id + 1
+
+    def record_round(final_ans: str):
+        commit_round(
+            context.history_csv,
+            new_round_id,
+            [("question", user_text), ("answer", final_ans)],
+        )
+
+    if stream:
+        return stream_answer(
+            lambda: stream_chat("chase", messages, 0.2, 1000, "对不起，无法进行追问解答。"),
+            is_eng,
+            record_round,
         )
-        chase_ans_zh = response.choices[0].message.content.strip()
-    except Exception:
+
+    try:
+        chase_ans_zh = llm.chat("chase", messages, temperature=0.2, max_tokens=1000)
+    except LLMError as e:
+        print(f"[LLM] 追问解答失败: {e}")
         chase_ans_zh = "对不起，无法进行追问解答。"
 
     final_ans = translate_to_english(chase_ans_zh) if is_eng else chase_ans_zh
-    new_round_id = round_id + 1
-    append_history(new_round_id, "question", user_text)
-    append_history(new_round_id, "answer", final_ans)
+    record_round(final_ans)
 
     return final_ans
 
 
-def do_new_recommendation(user_text: str, nutrition_kg: NutritionKG):
-    round_id = load_latest_round()
+def do_new_recommendation(
+    context: RequestContext, user_text: str, nutrition_kg: NutritionKG
+):
+    session = SESSIONS.get(context.history_csv)
+    round_id = session.round
     if round_id < 1:
         print("No previous round. Please start a new question.")
         return
 
-    df = pd.read_csv(HISTORY_CSV, encoding="utf-8-sig")
-    last_50 = df[(df["round"] == round_id) & (df["type"] == "candidate")]
-    if last_50.empty:
+    last_50_list = list(session.candidates)
+    if not last_50_list:
         print("No candidate recipes from last round. Please start a new question.")
         return
 
-    last_50_list = list(last_50["content"].values)
     if len(last_50_list) < 6:
         print(
             "Not enough recipes to recommend new ones. Need at least 6 from last round."
         )
         return
 
-    tmp_r = round_id
-    kw_df = df[(df["round"] == tmp_r) & (df["type"] == "keyword")]
-    while tmp_r > 0 and kw_df.empty:
-        tmp_r -= 1
-        kw_df = df[(df["round"] == tmp_r) & (df["type"] == "keyword")]
-    if kw_df.empty:
+    old_keywords = list(session.keywords)
+    if not old_keywords:
         print("No TCM keywords found in any previous round.")
         return
-    old_keywords = list(kw_df["content"].values)
 
     new_3 = last_50_list[3:6]
-    clear_old_kg_files()
     is_eng = detect_language(user_text)
-    display_names = []
-    subgraph_texts = []
+    display_names = [nutrition_kg.display_name(subj, is_eng) for subj in new_3]
+    subgraph_texts = build_kg_context(
+        nutrition_kg, new_3, display_names, old_keywords
+    )
 
-    for i, subj in enumerate(new_3, start=1):
-        full_df, disp_name = self_save_full_subject_csv(
-            nutrition_kg, subj, i, is_english=is_eng
-        )
-        display_names.append(disp_name)
-
-        subj_df = nutrition_kg.get_all_triples_for_subject(subj)
-        g_sub = nutrition_kg.build_subgraph_from_df(subj_df)
-        lines = []
-        for u, v, data in g_sub.edges(data=True):
-            r = data.get("relation", "")
-            lines.append(f"{u} -[{r}]-> {v}")
-        sub_text = f"【KG for {disp_name}】\n" + "\n".join(lines)
-        subgraph_texts.append(sub_text)
-
-    q_df = df[(df["round"] == round_id) & (df["type"] == "question")]
-    tmp_qr = round_id
-    while tmp_qr > 0 and q_df.empty:
-        tmp_qr -= 1
-        q_df = df[(df["round"] == tmp_qr) & (df["type"] == "question")]
-
-    if q_df.empty:
+    if session.question is None:
         old_question_text = "No question found from any round."
     else:
-        old_question_text = q_df["content"].values[0]
+        old_question_text = session.question
 
     combined_question = f"{old_question_text}\n(用户补充需求: {user_text})"
-    zh_ans = generate_final_explanation(
-        combined_question, old_keywords, display_names, subgraph_texts
+    answer = submit_llm(
+        generate_final_explanation,
+        combined_question,
+        old_keywords,
+        display_names,
+        subgraph_texts,
     )
+    save_top_subject_csvs(nutrition_kg, new_3, is_english=is_eng, kg_dir=context.kg_dir)
+    zh_ans = answer.result()
     final_ans = translate_to_english(zh_ans) if is_eng else zh_ans
 
     new_round_id = round_id + 1
-    append_history(new_round_id, "question", user_text)
-    append_history(new_round_id, "answer", final_ans)
+    commit_round(
+        context.history_csv,
+        new_round_id,
+        [("question", user_text), ("answer", final_ans)],
+    )
 
     print("\n===== New 3-Recipe Recommendation Answer =====\n")
     return final_ans
 
 
-def do_include_exclude(user_text, nutrition_kg: NutritionKG):
+def do_include_exclude(
+    context: RequestContext, user_text, nutrition_kg: NutritionKG, stream: bool = False
+):
     """
     在该函数里，我们根据包含/排除的食材是否有英文，来决定最终回答语言：
       - 若 JSON 中包含的食材里有任何英文，则最终回答输出【中文】；
       - 若 JSON 中所有的食材都是中文，则最终回答输出【英文】。
+    stream=True 时返回 (merged_kg, 回答文本块的生成器)，历史在生成器读完后写入。
     """
-    round_id = load_latest_round()
+    session = SESSIONS.get(context.history_csv)
+    round_id = session.round
     if round_id < 1:
         print("No previous round. Please start a new question.")
         return
@@ -650,82 +1146,33 @@ def do_include_exclude(user_text, nutrition_kg: NutritionKG):
     any_english = any(is_english_word(ing) for ing in all_ings)
 
     mapped_includes, map_in_dict = map_english_ingredients_to_chinese(
-        include_ings, nutrition_kg.csv_path
+        include_ings, nutrition_kg
     )
     mapped_excludes, map_ex_dict = map_english_ingredients_to_chinese(
-        exclude_ings, nutrition_kg.csv_path
+        exclude_ings, nutrition_kg
     )
 
-    df_hist = pd.read_csv(HISTORY_CSV, encoding="utf-8-sig")
-    tmp_r = round_id
-    kw_df = df_hist[(df_hist["round"] == tmp_r) & (df_hist["type"] == "keyword")]
-    while tmp_r > 0 and kw_df.empty:
-        tmp_r -= 1
-        kw_df = df_hist[(df_hist["round"] == tmp_r) & (df_hist["type"] == "keyword")]
-    if kw_df.empty:
+    old_keywords = list(session.keywords)
+    if not old_keywords:
         print("No TCM keywords found in any previous round.")
         return
-    old_keywords = list(kw_df["content"].values)
-
-    result_dfs = []
-    for kw in old_keywords:
-        sub_df = nutrition_kg.advanced_search(
-            "食谱的功效", object_filter=kw, exact_relation=True
-        )
-        if not sub_df.empty:
-            result_dfs.append(sub_df)
-    if result_dfs:
-        final_df = pd.concat(result_dfs, ignore_index=True).drop_duplicates()
-    else:
-        final_df = pd.DataFrame(columns=["subject", "relation", "object", "csv_idx"])
 
+    final_df = nutrition_kg.search_many("食谱的功效", old_keywords)
     if final_df.empty:
         print("No recipes match the previous keywords. Cannot apply include/exclude.")
         return
 
-    candidate_subjects = set(final_df["subject"].unique().tolist())
-    ing_df = nutrition_kg.advanced_search("食谱的食材构成", None, True)
-
-    # print("\n=== 分步处理 include 条件 ===")
-    for orig_ing, ing in zip(include_ings, mapped_includes):
-        has_ing_set = set(ing_df[ing_df["object"] == ing]["subject"])
-        candidate_subjects = candidate_subjects.intersection(has_ing_set)
-        # if orig_ing != ing:
-        #     print(
-        #         f"包含食材 '{orig_ing}' (映射为 '{ing}') 后，剩余可选菜数量: {len(candidate_subjects)}"
-        #     )
-        # else:
-        #     print(f"包含食材 '{ing}' 后，剩余可选菜数量: {len(candidate_subjects)}")
-
-        # if not candidate_subjects:
-        #     print("已经没有满足所有 include 条件的菜谱了。")
-        #     break
-
-    if not candidate_subjects:
-        print("\n=== 最终搜索结果为空 ===")
-        return
-
-    # print("\n=== 分步处理 exclude 条件 ===")
-    for orig_ing, ing in zip(exclude_ings, mapped_excludes):
-        has_ing_set = set(ing_df[ing_df["object"] == ing]["subject"])
-        new_candidates = candidate_subjects.difference(has_ing_set)
-        if orig_ing != ing:
-            print(
-                f"排除含食材 '{orig_ing}' (映射为 '{ing}') 后，剩余可选菜数量: {len(new_candidates)}"
-            )
-        else:
-            print(f"排除含食材 '{ing}' 后，剩余可选菜数量: {len(new_candidates)}")
-
-        candidate_subjects = new_candidates
-        if not candidate_subjects:
-            print("已经没有满足 exclude 条件后的菜谱了。")
-            break
-
-    if not candidate_subjects:
+    sub_filtered_df = nutrition_kg.filter_by_ingredients(
+        final_df, mapped_includes, mapped_excludes
+    )
+    print(
+        f"包含食材 {mapped_includes}、排除食材 {mapped_excludes} 后，"
+        f"剩余可选菜数量: {sub_filtered_df['subject'].nunique()}"
+    )
+    if sub_filtered_df.empty:
         print("\n=== 最终搜索结果为空 ===")
         return
 
-    sub_filtered_df = final_df[final_df["subject"].isin(candidate_subjects)]
     count_series = sub_filtered_df["subject"].value_counts()
     sorted_subjects = list(count_series.index)
     top_3 = sorted_subjects[:3]
@@ -733,31 +1180,16 @@ def do_include_exclude(user_text, nutrition_kg: NutritionKG):
         print("No recipes left after filtering.")
         return
 
-    clear_old_kg_files()
-    display_names = []
-    subgraph_texts = []
-
     # 这里依然用 detect_language(user_text) 判断是否要拿英文行, 以保持和原代码一致
     # 但回答时我们根据 any_english 来决定语种
     # is_eng_for_csv = detect_language(user_text)
     is_eng_for_csv = any_english
     # print(is_eng_for_csv)
 
-    for i, subj in enumerate(top_3, start=1):
-        full_df, disp_name = self_save_full_subject_csv(
-            nutrition_kg, subj, i, is_english=is_eng_for_csv
-        )
-        display_names.append(disp_name)
-
-        subj_df = nutrition_kg.get_all_triples_for_subject(subj)
-        g_sub = nutrition_kg.build_subgraph_from_df(subj_df)
-        edges = g_sub.edges(data=True)
-        lines = []
-        for u, v, data in edges:
-            r = data.get("relation", "")
-            lines.append(f"{u} -[{r}]-> {v}")
-        sub_text = f"【KG for {disp_name}】\n" + "\n".join(lines)
-        subgraph_texts.append(sub_text)
+    display_names = [nutrition_kg.display_name(subj, is_eng_for_csv) for subj in top_3]
+    subgraph_texts = build_kg_context(
+        nutrition_kg, top_3, display_names, old_keywords
+    )
 
     explanation_text = (
         "用户要求包含食材: "
@@ -766,35 +1198,41 @@ def do_include_exclude(user_text, nutrition_kg: NutritionKG):
         + str(mapped_excludes)
         + f"。\n这是基于上一轮关键词 {old_keywords} 过滤后的结果：\n"
     )
-    # 先生成中文版本
-    zh_ans = generate_final_explanation(
-        explanation_text, old_keywords, display_names, subgraph_texts
+    new_round_id = round_id + 1
+
+    def record_round(final_ans: str):
+        commit_round(
+            context.history_csv,
+            new_round_id,
+            [("question", user_text), ("answer", final_ans)],
+        )
+
+    explain_args = (explanation_text, old_keywords, display_names, subgraph_texts)
+    if stream:
+        merged_kg = save_top_subject_csvs(
+            nutrition_kg, top_3, is_english=is_eng_for_csv, kg_dir=context.kg_dir
+        )
+        chunks = stream_answer(
+            lambda: stream_final_explanation(*explain_args), any_english, record_round
+        )
+        return merged_kg, chunks
+
+    # 先生成中文版本，同时取出并合并 KG 结果
+    answer = submit_llm(generate_final_explanation, *explain_args)
+    merged_kg = save_top_subject_csvs(
+        nutrition_kg, top_3, is_english=is_eng_for_csv, kg_dir=context.kg_dir
     )
+    zh_ans = answer.result()
 
     # 如果 json 中有英文, 则最终输出中文; 否则输出英文
     if any_english:
         final_ans = translate_to_english(zh_ans)
     else:
         final_ans = zh_ans
-
-    new_round_id = round_id + 1
-    append_history(new_round_id, "question", user_text)
-    append_history(new_round_id, "answer", final_ans)
+    record_round(final_ans)
 
     # print("\n===== Include/Exclude Filtered Recipes =====\n")
     # print(final_ans)
-    # print("\n===== Final Answer-KG =====\n")
-    frames = []
-    for i in range(1, len(top_3) + 1):
-        fname = f"KG{i}.csv"
-        if os.path.exists(fname):
-            frames.append(pd.read_csv(fname, dtype=str))
-    if frames:
-        merged_kg = pd.concat(frames, ignore_index=True)
-        # print(merged_kg)
-    else:
-        merged_kg = pd.DataFrame()
-
     return merged_kg, final_ans
 
 
@@ -802,7 +1240,8 @@ def main():
     print("=== Multi-turn interactive system ===")
     print("Type 'exit' to quit at any time.")
 
-    init_history_file()
+    # 命令行只有一个用户，KG1..KG3.csv 照旧写在当前目录
+    context = init_history_file(kg_dir=".")
     nutrition_kg = NutritionKG(CSV_PATH)
 
     while True:
@@ -820,13 +1259,13 @@ def main():
             pass
 
         if is_json_input:
-            do_include_exclude(user_text, nutrition_kg)
+            do_include_exclude(context, user_text, nutrition_kg)
         elif "do_chase_question" in user_text.lower():
-            do_chase_question(user_text)
+            do_chase_question(context, user_text)
         elif "do_new_recommendation" in user_text.lower():
-            do_new_recommendation(user_text, nutrition_kg)
+            do_new_recommendation(context, user_text, nutrition_kg)
         else:
-            do_new_round(user_text, nutrition_kg)
+            do_new_round(context, user_text, nutrition_kg)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 import networkx as nx
 
+from kg_graph import CSRGraph
+
 
 class NutritionKG:
     def __init__(self, csv_path="./test_rows_triples.csv"):
@@ -27,30 +30,24 @@ class NutritionKG:
         self.df = self.df[self.df["relation"].isin(valid_relations)]
         self.df.reset_index(drop=True, inplace=True)
 
-        # Create unique ID mapping
-        self.node_to_id = {}
-        self.id_counter = 1
-
-        self.graph = nx.DiGraph()
-        for _, row in self.df.iterrows():
-            subj = row["subject"]
-            rel = row["relation"]
-            obj = row["object"]
-
-            # Assign unique IDs
-            if subj not in self.node_to_id:
-                self.node_to_id[subj] = self.id_counter
-                self.id_counter += 1
-            if obj not in self.node_to_id:
-                self.node_to_id[obj] = self.id_counter
-                self.id_counter += 1
+        # 以 CSR 陣列保存整張圖；節點編號依首次出現順序，從 1 開始
+        self.kg_graph = CSRGraph.from_df(self.df)
 
-            # Add nodes with IDs
-            self.graph.add_node(self.node_to_id[subj], name=subj)
-            self.graph.add_node(self.node_to_id[obj], name=obj)
-            self.graph.add_edge(
-                self.node_to_id[subj], self.node_to_id[obj], relation=rel
+        # Create unique ID mapping
+        self.node_to_id = {
+            name: i + 1 for i, name in enumerate(self.kg_graph.names.tolist())
+        }
+        self.id_counter = len(self.node_to_id) + 1
+        self._nx_graph = None
+
+    @property
+    def graph(self) -> nx.DiGraph:
+        """networkx 版本的整張圖，僅在首次存取時由 CSR 匯出。"""
+        if self._nx_graph is None:
+            self._nx_graph = self.kg_graph.to_networkx(
+                node_labels=range(1, len(self.kg_graph) + 1)
             )
+        return self._nx_graph
 
     def search_by_subject(self, keyword, exact=False):
         if exact:
@@ -78,23 +75,86 @@ class NutritionKG:
         )
         return self.df[cond]
 
+    def neighbors(self, name, relations=None) -> list:
+        """name 指向的節點名稱，可用 relations 限定關係。"""
+        g = self.kg_graph
+        return g.names[g.neighbors(g.node_id(name), relations)].tolist()
+
+    def predecessors(self, name, relations=None) -> list:
+        """指向 name 的節點名稱，可用 relations 限定關係。"""
+        g = self.kg_graph
+        return g.names[g.predecessors(g.node_id(name), relations)].tolist()
+
+    def subgraph(self, names) -> CSRGraph:
+        """由 names 中節點之間的邊構成的子圖（CSR 形式）。"""
+        return self.kg_graph.subgraph(self.kg_graph.node_ids(names))
+
+    def k_hop(self, names, k=2, relations=None, direction="out") -> pd.DataFrame:
+        """
+        從 names 出發 BFS 最多 k 跳的鄰域，回傳 name / hops 兩欄（依 BFS 順序）。
+        relations 限定可走的關係；direction 為 "out"、"in" 或 "both"。
+        """
+        if isinstance(names, str):
+            names = [names]
+        g = self.kg_graph
+        nodes, hops = g.k_hop(g.node_ids(names), k, relations, direction)
+        return pd.DataFrame({"name": g.names[nodes], "hops": hops})
+
+    def k_hop_triples(self, names, k=2, relations=None, direction="out") -> pd.DataFrame:
+        """k 跳鄰域內節點之間的三元組（subject / relation / object）。"""
+        if isinstance(names, str):
+            names = [names]
+        g = self.kg_graph
+        nodes, _ = g.k_hop(g.node_ids(names), k, relations, direction)
+        keep = np.zeros(len(g), dtype=bool)
+        keep[nodes] = True
+        edges = keep[g.sources] & keep[g.targets] & g._relation_mask(g.relations, relations)
+        return self.df[edges].copy()
+
+    def find_paths(self, names, relation_path, direction="out", limit=1000) -> pd.DataFrame:
+        """
+        依關係序列走多跳路徑，例如 食譜 → 食材 → 營養素 → 限制：
+        relation_path = [["含有", "contains"], "具有", "食用限制"]。
+        每一跳可為關係名、關係名列表或 None（不限）。
+        回傳每條路徑一列：node_0..node_h 與 relation_1..relation_h。
+        """
+        if isinstance(names, str):
+            names = [names]
+        g = self.kg_graph
+        nodes, rels, _ = g.typed_paths(g.node_ids(names), relation_path, direction, limit)
+        relation_names = np.asarray(g.relation_names, dtype=object)
+        columns = {}
+        for hop in range(nodes.shape[1]):
+            if hop:
+                columns[f"relation_{hop}"] = relation_names[rels[:, hop - 1]]
+            columns[f"node_{hop}"] = g.names[nodes[:, hop]]
+        return pd.DataFrame(columns)
+
+    def shortest_path(self, source, target, max_hops=4, relations=None, direction="out"):
+        """
+        source 到 target 的最短路徑（最多 max_hops 跳），
+        回傳 (subject, relation, object) 列表；不可達時回傳 None。
+        """
+        g = self.kg_graph
+        edges = g.shortest_path(
+            g.node_id(source), g.node_id(target), max_hops, relations, direction
+        )
+        if edges is None:
+            return None
+        return [
+            (g.names[g.sources[e]], g.relation_names[g.relations[e]], g.names[g.targets[e]])
+            for e in edges
+        ]
+
     def get_subgraph_from_df(self, sub_df):
-        g_sub = nx.DiGraph()
-        for _, row in sub_df.iterrows():
-            subj = row["subject"]
-            rel = row["relation"]
-            obj = row["object"]
-
-            # Use existing IDs or create new ones
-            if subj not in self.node_to_id:
-                self.node_to_id[subj] = self.id_counter
-                self.id_counter += 1
-            if obj not in self.node_to_id:
-                self.node_to_id[obj] = self.id_counter
+        sub_graph = CSRGraph.from_df(sub_df)
+
+        # Use existing IDs or create new ones
+        labels = []
+        for name in sub_graph.names.tolist():
+            if name not in self.node_to_id:
+                self.node_to_id[name] = self.id_counter
                 self.id_counter += 1
+            labels.append(self.node_to_id[name])
 
-            # Add nodes with IDs
-            g_sub.add_node(self.node_to_id[subj], name=subj)
-            g_sub.add_node(self.node_to_id[obj], name=obj)
-            g_sub.add_edge(self.node_to_id[subj], self.node_to_id[obj], relation=rel)
-        return g_sub
+        return sub_graph.to_networkx(node_labels=labels)
@@ -0,0 +1,306 @@
+import atexit
+import csv
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(path: str):
+    """文件的 (大小, 修改时间)，文件不存在时为 None；用于发现其他进程的写入。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class SessionState:
+    """
+    一个会话历史文件（<user>_task<N>.csv）的内存状态：
+    最新轮次、该轮的回答与候选食谱，以及最近一次出现的关键词和问题
+    （与原先从最新轮次往前找 keyword / question 的结果相同）。
+    pending 为尚未写入文件的记录，flushing 为正在写入、尚未确认成功的记录，
+    signature 为最近一次读取或写入后文件的 file_signature；flushes 在每次开始写入时加一。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.round = 0
+        self.last_answer = None
+        self.candidates = []
+        self.keywords = []
+        self.question = None
+        self.pending = []
+        self.flushing = []
+        self.flushes = 0
+        self.signature = None
+        self.lock = threading.Lock()
+        self._keyword_round = None
+        self._question_round = None
+
+    def refresh_from(self, fresh: "SessionState"):
+        """
+        用重新读取的文件状态替换内存状态，再补上本进程正在写入和尚未写入的记录（调用方持有 lock）。
+        只在没有写入进行中时调用，否则文件里可能已有一部分 flushing 记录。
+        """
+        for name in (
+            "round",
+            "last_answer",
+            "candidates",
+            "keywords",
+            "question",
+            "signature",
+            "_keyword_round",
+            "_question_round",
+        ):
+            setattr(self, name, getattr(fresh, name))
+        for round_id, record_type, content, _ in self.flushing + self.pending:
+            self.apply(round_id, record_type, content)
+
+    def apply(self, round_id: int, record_type: str, content: str):
+        """把一条记录合并进内存状态（调用方持有 lock，或对象尚未共享）。"""
+        if round_id > self.round:
+            self.round = round_id
+            self.last_answer = None
+            self.candidates = []
+        elif round_id < self.round:
+            # 比最新轮次还旧的记录只影响文件，不影响"最近一次"的状态
+            return
+        if record_type == "answer":
+            self.last_answer = content
+        elif record_type == "candidate":
+            self.candidates.append(content)
+        elif record_type == "keyword":
+            if self._keyword_round != round_id:
+                self._keyword_round = round_id
+                self.keywords = []
+            self.keywords.append(content)
+        elif record_type == "question" and self._question_round != round_id:
+            self._question_round = round_id
+            self.question = content
+
+
+class SessionCache:
+    """
+    按历史文件缓存 SessionState，LRU 淘汰。
+    读取只在第一次访问（或被淘汰后）解析一次 CSV；写入先更新内存并排队，
+    由后台线程每 flush_interval 秒调用 persist(path, records) 批量落盘（write-behind），
+    淘汰前与进程退出时也会落盘。persist 返回写入的字节数（不知道时返回 None，写完后会重读文件）。
+
+    多个 worker 进程：每次命中都比较文件的大小与修改时间，文件被其他进程写过
+    就重新读取，因此不会一直沿用过期的轮次。但别的进程尚未落盘的记录仍看不到，
+    同一会话的请求落到不同 worker 时应设 flush_interval=0（同步写入），
+    或让同一用户的请求固定到同一个 worker。
+
+    落盘失败时记录保留在内存中下次重试，失败次数与最近的错误见 stats()；
+    单个会话积压超过 max_pending 条时丢弃最旧的记录并记错误日志，避免无限增长。
+    """
+
+    def __init__(
+        self,
+        persist,
+        max_sessions: int = 1024,
+        flush_interval: float = 0.5,
+        max_pending: int = 10000,
+    ):
+        self.persist = persist
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._sessions = OrderedDict()
+        self._evicting = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self.flush_failures = 0
+        self.dropped = 0
+        self.last_flush_error = None
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key(path: str) -> str:
+        return os.path.abspath(path)
+
+    def get(self, path: str) -> SessionState:
+        key = self.key(path)
+        with self._lock:
+            state = self._sessions.get(key)
+            if state is None:
+                # 刚被淘汰、还没落盘完的会话直接放回来，避免从文件读到旧状态
+                state = self._evicting.get(key)
+                if state is not None:
+                    self._sessions[key] = state
+            if state is not None:
+                self._sessions.move_to_end(key)
+                self.hits += 1
+        if state is not None:
+            self._revalidate(state)
+            return state
+        with self._lock:
+            self.misses += 1
+        state = self._load(path)
+        with self._lock:
+            # 并发加载同一文件时以先放进去的为准
+            state = self._sessions.setdefault(key, state)
+            self._sessions.move_to_end(key)
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                old_key, old = self._sessions.popitem(last=False)
+                self._evicting[old_key] = old
+                evicted.append((old_key, old))
+                self.evictions += 1
+        for old_key, old in evicted:
+            self._flush_state(old)
+            with self._lock:
+                if self._evicting.get(old_key) is old:
+                    del self._evicting[old_key]
+        return state
+
+    def _revalidate(self, state: SessionState):
+        """
+        文件在本进程之外被改写过时重新读取。
+        本进程正在写入时不读：内存状态已包含这些记录，写完后由 _flush_state 决定是否需要重读。
+        """
+        with state.lock:
+            if state.flushing:
+                return
+            flushes = state.flushes
+        if file_signature(state.path) == state.signature:
+            return
+        fresh = self._load(state.path)
+        with state.lock:
+            if state.flushing or state.flushes != flushes:
+                # 读文件期间本进程开始了写入，读到的内容可能只含一部分记录；下次访问再读
+                return
+            state.refresh_from(fresh)
+        with self._lock:
+            self.reloads += 1
+
+    @staticmethod
+    def _load(path: str) -> SessionState:
+        """逐行扫描一遍文件得到状态，不构造 DataFrame；之后轮次等都由内存维护。"""
+        state = SessionState(path)
+        # 先取签名再读：读的过程中文件又被写入时，下次访问会再读一遍
+        state.signature = file_signature(path)
+        if state.signature is None:
+            return state
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) < 3 or not row[0].strip():
+                    continue
+                try:
+                    round_id = int(float(row[0]))
+                except ValueError:
+                    continue
+                state.apply(round_id, row[1], row[2])
+        return state
+
+    def commit(self, path: str, round_id: int, records: list, time_str: str):
+        """一轮的 (type, content) 记录整体并入内存状态并排队落盘，其他请求不会看到半轮。"""
+        state = self.get(path)
+        with state.lock:
+            for record_type, content in records:
+                state.apply(round_id, record_type, content)
+            state.pending.extend(
+                (round_id, record_type, content, time_str) for record_type, content in records
+            )
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.flush_interval)
+                    self.flush()
+
+            self._flusher = threading.Thread(target=run, daemon=True)
+            self._flusher.start()
+
+    def _flush_state(self, state: SessionState):
+        with self._flush_lock:
+            with state.lock:
+                if not state.pending:
+                    return
+                records, state.pending = state.pending, []
+                state.flushing = records
+                state.flushes += 1
+                expected = state.signature
+            before = file_signature(state.path)
+            try:
+                written = self.persist(state.path, records)
+            except Exception as e:
+                with state.lock:
+                    state.flushing = []
+                    state.pending[:0] = records
+                    overflow = len(state.pending) - self.max_pending
+                    if overflow > 0:
+                        del state.pending[:overflow]
+                with self._lock:
+                    self.flush_failures += 1
+                    self.last_flush_error = f"{state.path}: {e!r}"
+                    if overflow > 0:
+                        self.dropped += overflow
+                logger.error("Failed to write session history %s: %r", state.path, e)
+                if overflow > 0:
+                    logger.error(
+                        "Dropped %d unwritten records of %s after repeated failures",
+                        overflow,
+                        state.path,
+                    )
+                return
+            after = file_signature(state.path)
+            with state.lock:
+                state.flushing = []
+                # 写入前文件与上次读取时一致、写入后恰好多了本次的字节数，才认为只有本进程写过；
+                # 否则保留旧签名，下次访问重新读取（此时记录都已在文件中）
+                if (
+                    before == expected
+                    and written is not None
+                    and after is not None
+                    and after[0] == (before[0] if before else 0) + written
+                ):
+                    state.signature = after
+
+    def flush(self):
+        """把所有会话的待写记录落盘。"""
+        with self._lock:
+            states = list(self._sessions.values()) + list(self._evicting.values())
+        for state in states:
+            self._flush_state(state)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "maxSessions": self.max_sessions,
+                "pending": sum(
+                    len(s.pending) + len(s.flushing) for s in self._sessions.values()
+                ),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+                "flushFailures": self.flush_failures,
+                "droppedRecords": self.dropped,
+                "lastFlushError": self.last_flush_error,
+                "hitRate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Broadcast:
+    """
+    可被多个订阅者重复读取的文本流。源迭代器只读一遍，读到的块缓存在内存里；
+    每个 subscribe() 都从头开始产出全部块，读到缓存末尾的订阅者负责从源拉取下一块，
+    因此不需要额外线程，任一订阅者断开也不影响其他人。
+    源结束（或抛出异常）后依次调用 add_done_callback 注册的回调。
+    """
+
+    def __init__(self, source):
+        self._source = iter(source)
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _pull(self, index: int) -> bool:
+        """确保第 index 块已读到，源已结束时返回 False。"""
+        if index < len(self._chunks):
+            return True
+        with self._lock:
+            if index < len(self._chunks):
+                return True
+            if self._done:
+                return False
+            try:
+                self._chunks.append(next(self._source))
+                return True
+            except StopIteration:
+                self._done = True
+            except BaseException as e:
+                self._done = True
+                self._error = e
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+        return False
+
+    def subscribe(self):
+        index = 0
+        while self._pull(index):
+            yield self._chunks[index]
+            index += 1
+        if self._error is not None:
+            raise self._error
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+
+class SingleFlight:
+    """
+    合并同一时刻的相同计算：第一个到达的请求（leader）执行 fn，
+    在它完成前到达的相同 key 的请求等待并共享其结果（或异常）。
+
+    until(result) 返回带 add_done_callback 的对象（Future、Broadcast）时，
+    条目保留到该对象完成为止，期间到达的请求也共享结果；
+    无论如何条目最多保留 max_age 秒，避免没人读完的流一直被复用。
+    """
+
+    def __init__(self, max_age: float = 120.0):
+        self.max_age = max_age
+        self._calls = {}  # key -> (Future, 开始时间)
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, until=None):
+        """返回 (结果, 是否复用了其他请求的计算)。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry is not None and now - entry[1] > self.max_age:
+                entry = None
+            if entry is None:
+                call = Future()
+                self._calls[key] = (call, now)
+                self.leaders += 1
+            else:
+                call = entry[0]
+                self.shared += 1
+        if entry is not None:
+            return call.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._forget(key, call)
+            call.set_exception(e)
+            raise
+        call.set_result(result)
+        pending = until(result) if until is not None else None
+        if pending is None:
+            self._forget(key, call)
+        else:
+            pending.add_done_callback(lambda _: self._forget(key, call))
+        return result, False
+
+    def _forget(self, key, call):
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry is not None and entry[0] is call:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "inFlight": len(self._calls),
+                "leaders": self.leaders,
+                "shared": self.shared,
+            }
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 测试直接导入服务端模块；关闭会在工作目录写文件或起后台线程的功能
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault("KEYWORD_CACHE", "0")
+os.environ.setdefault("SESSION_FLUSH_INTERVAL", "0")
+
+RECIPES_CSV = os.path.join(REPO_DIR, "merged_cleaned_all_recipes.csv")
+
+
+@pytest.fixture(scope="session")
+def nutrition_kg():
+    """用仓库里的完整食谱 CSV 构建的知识图谱，整个测试会话共用。"""
+    from main_new import NutritionKG
+
+    return NutritionKG(RECIPES_CSV)
+
+
+@pytest.fixture
+def small_csv(tmp_path):
+    """食谱 CSV 的前 400 行，用于需要改写数据集或渲染全部食谱的测试。"""
+    path = tmp_path / "recipes.csv"
+    with open(RECIPES_CSV, encoding="utf-8-sig") as src:
+        head = [next(src) for _ in range(400)]
+    path.write_text("".join(head), encoding="utf-8")
+    return str(path)
+
+
+class BaselineKG:
+    """原先 main_new.NutritionKG 每次查询都逐块扫描 CSV 的实现，作为检索结果的对照。"""
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+
+    def _chunks(self):
+        offset = 0
+        for chunk in pd.read_csv(self.csv_path, chunksize=100_000, dtype=str):
+            chunk.reset_index(drop=False, inplace=True)
+            chunk["csv_idx"] = chunk["index"] + offset
+            yield chunk
+            offset += len(chunk)
+
+    @staticmethod
+    def _concat(matched_df_list, columns):
+        if matched_df_list:
+            return pd.concat(matched_df_list, ignore_index=True).drop_duplicates()
+        return pd.DataFrame(columns=columns)
+
+    def advanced_search(self, relation_filter, object_filter=None, exact_relation=True):
+        matched_df_list = []
+        for chunk in self._chunks():
+            sub_chunk = chunk[["subject", "relation", "object", "csv_idx"]].copy()
+            sub_chunk.dropna(subset=["subject", "relation", "object"], inplace=True)
+            if exact_relation:
+                temp_df = sub_chunk[sub_chunk["relation"] == relation_filter]
+            else:
+                temp_df = sub_chunk[
+                    sub_chunk["relation"].str.contains(relation_filter, na=False)
+                ]
+            if object_filter:
+                temp_df = temp_df[temp_df["object"].str.contains(object_filter, na=False)]
+            if not temp_df.empty:
+                matched_df_list.append(temp_df)
+        return self._concat(matched_df_list, ["subject", "relation", "object", "csv_idx"])
+
+    def get_all_triples_for_subject(self, subject_str):
+        matched_df_list = []
+        for chunk in self._chunks():
+            sub_chunk = chunk[["subject", "relation", "object", "csv_idx"]].copy()
+            sub_chunk.dropna(subset=["subject", "relation", "object"], inplace=True)
+            temp_df = sub_chunk[sub_chunk["subject"] == subject_str]
+            if not temp_df.empty:
+                matched_df_list.append(temp_df)
+        return self._concat(matched_df_list, ["subject", "relation", "object", "csv_idx"])
+
+    def get_full_data_for_subject(self, subject_str):
+        matched_df_list = []
+        for chunk in self._chunks():
+            temp_df = chunk[chunk["subject"] == subject_str].copy()
+            if not temp_df.empty:
+                matched_df_list.append(temp_df)
+        return self._concat(matched_df_list, None)
+
+
+@pytest.fixture(scope="session")
+def baseline_kg():
+    return BaselineKG(RECIPES_CSV)
+
+
+def assert_same_rows(new_df, old_df):
+    """按行号排序后逐列比较，忽略索引与 dtype（旧实现的空结果没有 dtype）。"""
+    assert list(new_df.columns) == list(old_df.columns)
+    if old_df.empty:
+        assert new_df.empty
+        return
+    new_df = new_df.sort_values("csv_idx").reset_index(drop=True)
+    old_df = old_df.sort_values("csv_idx").reset_index(drop=True)
+    pd.testing.assert_frame_equal(new_df, old_df, check_dtype=False)
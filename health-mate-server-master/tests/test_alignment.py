@@ -0,0 +1,105 @@
+import pandas as pd
+import pytest
+
+from conftest import RECIPES_CSV
+from main_new import (
+    is_english_word,
+    map_english_ingredients_to_chinese,
+    self_save_full_subject_csv,
+)
+
+
+@pytest.fixture(scope="module")
+def all_data():
+    df = pd.read_csv(RECIPES_CSV, dtype=str)
+    df.reset_index(drop=False, inplace=True)
+    return df
+
+
+def baseline_ingredient_map(all_data):
+    """
+    原先 map_english_ingredients_to_chinese 的规则：在食材行中找第一条
+    小写 object 相同的行，取它上一行（同样须为食材行）的 object。
+    这里用字典代替逐个过滤 DataFrame，结果相同。
+    """
+    big_df = all_data[
+        (all_data["relation"] == "Ingredient") | (all_data["relation"] == "食谱的食材构成")
+    ]
+    object_at = dict(zip(big_df["index"], big_df["object"]))
+    first_row = {}
+    for idx, obj in zip(big_df["index"], big_df["object"]):
+        first_row.setdefault(obj.lower(), idx)
+    mapping = {}
+    for lower, idx in first_row.items():
+        if idx - 1 in object_at:
+            mapping[lower] = object_at[idx - 1]
+    return mapping
+
+
+def baseline_english_rows(all_data, full_df):
+    """原先 self_save_full_subject_csv(is_english=True) 的规则：逐行取 csv_idx + 1 的行。"""
+    ids = [i + 1 for i in full_df["csv_idx"] if i + 1 < len(all_data)]
+    english = all_data.iloc[ids].drop(columns=["index"]).drop_duplicates()
+    subjects = english["subject"].dropna().unique()
+    return english.reset_index(drop=True), subjects[0] if len(subjects) else None
+
+
+def test_ingredient_mapping_matches_baseline(nutrition_kg, all_data):
+    expected = baseline_ingredient_map(all_data)
+    english = all_data.loc[all_data["relation"] == "Ingredient", "object"].unique()
+    checked = 0
+    for ing in english:
+        if not is_english_word(ing):
+            continue
+        for query in (ing, ing.upper(), ing.lower()):
+            mapped, map_dict = map_english_ingredients_to_chinese([query], nutrition_kg)
+            zh = expected.get(query.lower())
+            assert mapped == [zh if zh is not None else query], query
+            assert map_dict == ({query: zh} if zh is not None else {})
+        checked += 1
+    assert checked > 100
+
+
+def test_chinese_and_unknown_ingredients_are_kept(nutrition_kg):
+    assert map_english_ingredients_to_chinese([], nutrition_kg) == ([], {})
+    assert map_english_ingredients_to_chinese(["大蒜", "Unobtainium"], nutrition_kg) == (
+        ["大蒜", "Unobtainium"],
+        {},
+    )
+
+
+def test_english_recipe_rows_match_baseline(nutrition_kg, all_data):
+    chinese_rows = all_data["relation"].isin(["食谱的功效", "食谱的食材构成"])
+    # 只看每一行都是中文关系的食谱；中英行共用英文菜名的见下一个测试
+    mixed = set(all_data.loc[~chinese_rows, "subject"])
+    subjects = all_data.loc[chinese_rows, "subject"].unique()
+    subjects = [s for s in subjects if s not in mixed]
+    for subject in subjects[::25]:
+        full_df, display_name = self_save_full_subject_csv(
+            nutrition_kg, subject, 1, is_english=True
+        )
+        expected_df, expected_name = baseline_english_rows(
+            all_data, nutrition_kg.get_full_data_for_subject(subject)
+        )
+        pd.testing.assert_frame_equal(
+            full_df.reset_index(drop=True), expected_df, check_dtype=False
+        )
+        assert display_name == expected_name
+
+
+def test_recipes_sharing_the_english_name_keep_their_own_rows(nutrition_kg, all_data):
+    """
+    个别食谱的中文行也用英文菜名，旧实现逐行取下一行会混入中文行和下一道菜的行，
+    对齐表只换成该食谱自己的英文行。
+    """
+    subject = "Grilled Salmon with Lemon"
+    full_df, display_name = self_save_full_subject_csv(
+        nutrition_kg, subject, 1, is_english=True
+    )
+    own = all_data[(all_data["subject"] == subject) & (all_data["relation"] == "Ingredient")]
+    assert display_name == subject
+    assert set(full_df["subject"]) == {subject}
+    assert set(full_df["relation"]) == {"Health Benefit", "Ingredient"}
+    assert list(full_df.loc[full_df["relation"] == "Ingredient", "object"]) == list(
+        own["object"]
+    )
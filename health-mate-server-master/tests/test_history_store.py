@@ -0,0 +1,194 @@
+import csv
+import random
+import threading
+import time
+
+import history_store
+from history_store import NEW_SESSION, HistoryStore
+
+
+class CsvHistory:
+    """原先 history/<user_id>.csv 的读写逻辑（main.py 中的实现），作为对照。"""
+
+    def __init__(self):
+        self.rows = [["type", "content", "time"], ["chat", NEW_SESSION, "t0"]]
+
+    def append(self, record_type, content, time):
+        self.rows.append([record_type, content, time])
+
+    def undo(self) -> bool:
+        for i in range(len(self.rows) - 1, 0, -1):
+            if self.rows[i][0] in ["include", "exclude"]:
+                self.rows.pop(i)
+                return True
+        return False
+
+    def records(self):
+        return [
+            {"type": r[0], "content": r[1], "time": r[2]}
+            for r in self.rows[1:]
+            if len(r) == 3
+        ]
+
+    def session_count(self):
+        return sum(1 for r in self.rows[1:] if r[0] == "chat" and r[1] == NEW_SESSION)
+
+    def current_session(self):
+        result = []
+        for row in reversed(self.rows[1:]):
+            if row[0] == "chat" and row[1] == NEW_SESSION:
+                break
+            result.append({"type": row[0], "content": row[1], "time": row[2]})
+        return list(reversed(result))
+
+    def pending_operations(self):
+        result = []
+        for row in reversed(self.rows[1:-1]):
+            if row[0] == "apply":
+                break
+            if row[0] in ("include", "exclude"):
+                result.append({"type": row[0], "content": row[1], "time": row[2]})
+        return list(reversed(result))
+
+
+def random_operation(rng, step):
+    record_type = rng.choice(
+        ["include", "include", "exclude", "apply", "chat", "recommendation", "undo"]
+    )
+    content = NEW_SESSION if record_type == "chat" and rng.random() < 0.2 else f"c{step}"
+    return record_type, content, f"t{step}"
+
+
+def assert_same(store, user_id, reference):
+    assert store.records(user_id) == reference.records()
+    assert store.session_count(user_id) == reference.session_count()
+    assert store.current_session(user_id) == reference.current_session()
+    assert store.pending_operations(user_id) == reference.pending_operations()
+
+
+def test_matches_csv_semantics_including_undo_and_compaction(tmp_path):
+    rng = random.Random(7)
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    for user_id in ("alice", "bob"):
+        store.ensure_user(user_id)
+        reference = CsvHistory()
+        reference.rows[1][2] = store.records(user_id)[0]["time"]
+        for step in range(300):
+            record_type, content, time = random_operation(rng, step)
+            if record_type == "undo":
+                assert store.undo_last_operation(user_id) == reference.undo()
+            else:
+                store.append(user_id, record_type, content, time)
+                reference.append(record_type, content, time)
+            if step % 50 == 0:
+                store.compact()
+            assert_same(store, user_id, reference)
+
+
+def test_undo_without_operations(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    assert not store.undo_last_operation("nobody")
+    store.ensure_user("alice")
+    store.append("alice", "chat", "hi", "t1")
+    assert not store.undo_last_operation("alice")
+
+
+def test_concurrent_undo_removes_each_operation_once(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    store = HistoryStore(path)
+    store.ensure_user("alice")
+    for i in range(50):
+        store.append("alice", "include", f"i{i}", f"t{i}")
+
+    threads = [
+        threading.Thread(
+            target=lambda: [store.undo_last_operation("alice") for _ in range(10)]
+        )
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    remaining = [r["content"] for r in store.records("alice") if r["type"] == "include"]
+    assert remaining == [f"i{i}" for i in range(10)]
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+def test_migration_imports_user_files_once(tmp_path):
+    history_dir = tmp_path / "history"
+    history_dir.mkdir()
+    write_csv(
+        history_dir / "alice.csv",
+        [
+            ["type", "content", "time"],
+            ["chat", NEW_SESSION, "t0"],
+            ["include", "鸡蛋", "t1"],
+            ["broken"],
+            ["apply", "apply", "t2"],
+        ],
+    )
+    write_csv(
+        history_dir / "alice_task1.csv",
+        [["round", "type", "content", "time"], [1, "question", "q", "t"]],
+    )
+    write_csv(history_dir / "intent_decisions.csv", [["question", "label", "time"]])
+
+    store = HistoryStore(str(history_dir / "history.sqlite3"))
+    assert store.migrate_csv_dir(str(history_dir)) == 3
+    assert store.migrate_csv_dir(str(history_dir)) == 0
+
+    reference = CsvHistory()
+    reference.append("include", "鸡蛋", "t1")
+    reference.append("apply", "apply", "t2")
+    reference.rows[1][2] = "t0"
+    assert_same(store, "alice", reference)
+    assert store.session_count("alice_task1") == 0
+
+
+def test_concurrent_workers_migrate_each_file_once(tmp_path, monkeypatch):
+    real_reader = csv.reader
+
+    def slow_reader(f):
+        # 拉长“检查是否已导入”到“开始写入”之间的窗口，让各 worker 都先通过检查
+        time.sleep(0.05)
+        return real_reader(f)
+
+    monkeypatch.setattr(history_store.csv, "reader", slow_reader, raising=True)
+    history_dir = tmp_path / "history"
+    history_dir.mkdir()
+    for user in range(5):
+        rows = [["type", "content", "time"], ["chat", NEW_SESSION, "t0"]]
+        rows += [["include", f"i{i}", f"t{i}"] for i in range(20)]
+        write_csv(history_dir / f"user{user}.csv", rows)
+
+    path = str(history_dir / "history.sqlite3")
+    HistoryStore(path)
+    start = threading.Barrier(4)
+    imported = []
+    errors = []
+
+    def worker():
+        store = HistoryStore(path)
+        start.wait()
+        try:
+            imported.append(store.migrate_csv_dir(str(history_dir)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert sum(imported) == 5 * 21
+    store = HistoryStore(path)
+    for user in range(5):
+        assert len(store.records(f"user{user}")) == 21
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def candidates(nutrition_kg):
+    return nutrition_kg.search_many("食谱的功效", ["补血", "健脾", "安神", "清热", "补气"])
+
+
+def baseline_filter(nutrition_kg, final_df, includes, excludes):
+    """原先 do_include_exclude 中逐个食材求集合交/差的过滤逻辑，返回剩下的 subject。"""
+    candidate_subjects = set(final_df["subject"].unique().tolist())
+    ing_df = nutrition_kg.advanced_search("食谱的食材构成", None, True)
+    for ing in includes:
+        candidate_subjects &= set(ing_df[ing_df["object"] == ing]["subject"])
+    for ing in excludes:
+        candidate_subjects -= set(ing_df[ing_df["object"] == ing]["subject"])
+    return candidate_subjects
+
+
+def test_filter_matches_baseline_sets(nutrition_kg, candidates):
+    rng = random.Random(0)
+    zh = list(nutrition_kg.advanced_search("食谱的食材构成")["object"].unique())
+    en = list(nutrition_kg.advanced_search("Ingredient")["object"].unique())
+    pool = zh + en[:200] + ["不存在的食材"]
+    for _ in range(300):
+        includes = rng.sample(pool, rng.randint(0, 2))
+        excludes = rng.sample(pool, rng.randint(0, 3))
+        result = nutrition_kg.filter_by_ingredients(candidates, includes, excludes)
+        assert set(result["subject"]) == baseline_filter(
+            nutrition_kg, candidates, includes, excludes
+        ), (includes, excludes)
+        # 只删行，不改变剩下行的内容与顺序
+        kept = candidates[candidates["subject"].isin(set(result["subject"]))]
+        assert result.equals(kept)
+
+
+def test_english_ingredient_names_do_not_match(nutrition_kg, candidates):
+    # 未能映射成中文的英文食材与原先一样不命中任何食谱
+    assert nutrition_kg.filter_by_ingredients(candidates, ["Olive Oil"], []).empty
+    assert nutrition_kg.filter_by_ingredients(candidates, [], ["Olive Oil"]).equals(
+        candidates
+    )
+
+
+def test_empty_and_unconstrained_inputs(nutrition_kg, candidates):
+    assert nutrition_kg.filter_by_ingredients(candidates, [], []).equals(candidates)
+    empty = candidates.iloc[:0]
+    assert nutrition_kg.filter_by_ingredients(empty, ["大蒜"], []).empty
@@ -0,0 +1,142 @@
+import csv
+
+import pytest
+
+from intent_classifier import IntentClassifier, question_features
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "给我一个recipe",
+        "番茄炒蛋的做法",
+        "失眠吃什么好",
+        "推荐几道养胃的汤",
+        "What ingredients help with sleep?",
+        "How to cook salmon",
+        "Can you make a soup for my cold?",
+        "Any dinner ideas for diabetics?",
+    ],
+)
+def test_rules_catch_explicit_recipe_requests(question):
+    decision = IntentClassifier().predict(question)
+    assert (decision.label, decision.source) == ("yes", "rules")
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "How do I make my sleep better?",
+        "How should I prepare for exams when stressed?",
+        "运动应该怎么做",
+        "失眠吃什么药",
+        "Is coffee bad for my stomach?",
+    ],
+)
+def test_rules_leave_general_health_questions_to_the_model(question):
+    decision = IntentClassifier().predict(question)
+    assert decision.source != "rules"
+
+
+# 原 clarify_query_intend 提示词里的 "no" 类：对已推荐菜的替换食材、原理、做法问题等追问
+FOLLOW_UPS = [
+    "第二个食谱能用鸡肉代替猪肉吗",
+    "这个做法适合孕妇吗",
+    "刚才那道汤的食材哪里买",
+    "为什么这个食谱要放姜",
+    "Can I swap the ingredients in the second recipe?",
+    "Why does this recipe use ginger?",
+    "Is that soup recipe okay for kids?",
+    "What can I use instead of honey in the recipe?",
+]
+
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_rules_leave_recipe_follow_ups_to_the_model(question):
+    decision = IntentClassifier().predict(question)
+    assert decision.source == "none" and decision.follow_up
+
+
+def trained_on_recipe_requests():
+    """yes 样本远多于 no，且都带"菜""食谱"等词：模型容易把追问也判成 yes。"""
+    classifier = IntentClassifier(min_samples=10)
+    for benefit in ("补血", "安神", "健脾", "养胃", "清热", "祛湿", "润肺", "补气"):
+        classifier.learn(f"推荐几个{benefit}的食谱", "yes")
+        classifier.learn(f"再来几道{benefit}的菜", "yes")
+    classifier.learn("谢谢你的建议", "no")
+    classifier.learn("好的我知道了", "no")
+    return classifier
+
+
+@pytest.mark.parametrize("question", ["为什么推荐几个健脾的食谱", "为什么推荐几个安神的食谱"])
+def test_model_yes_on_a_follow_up_goes_to_the_llm(question):
+    classifier = trained_on_recipe_requests()
+    decision = classifier.predict(question)
+    assert decision.label == "yes" and decision.follow_up
+    assert not classifier.is_confident(decision)
+
+
+def test_model_needs_known_features_to_decide():
+    classifier = trained_on_recipe_requests()
+    decision = classifier.predict("Hi")
+    assert decision.source == "model" and decision.confidence == 0.0
+    assert not classifier.is_confident(decision)
+    decision = classifier.predict("推荐几个补肾的食谱吧")
+    assert decision.source == "rules"
+    decision = classifier.predict("再来几道补肾的菜")
+    assert (decision.label, decision.source) == ("yes", "model")
+    assert classifier.is_confident(decision)
+
+
+def test_model_waits_for_enough_samples_of_both_labels():
+    classifier = IntentClassifier(min_samples=4)
+    for question in ("这个菜能给孕妇吃吗", "第二道菜热量高吗", "刚才那道适合老人吗"):
+        classifier.learn(question, "no")
+    assert classifier.predict("这个菜能给老人吃吗").label is None
+
+    classifier.learn("再来几道补血的菜", "yes")
+    decision = classifier.predict("这个菜能给老人吃吗")
+    assert (decision.label, decision.source) == ("no", "model")
+
+
+def test_learned_samples_survive_a_restart(tmp_path):
+    log_path = str(tmp_path / "intent_decisions.csv")
+    classifier = IntentClassifier(log_path=log_path, min_samples=2)
+    classifier.learn("这个菜能给孕妇吃吗", "no")
+    classifier.learn("再来几道补血的菜", "yes")
+
+    reloaded = IntentClassifier(log_path=log_path, min_samples=2)
+    assert reloaded.stats()["samples"] == {"yes": 1, "no": 1}
+
+
+def test_seeds_from_task_history_when_log_is_missing(tmp_path):
+    with open(tmp_path / "u1_task1.csv", "w", newline="", encoding="utf-8-sig") as f:
+        csv.writer(f).writerows(
+            [
+                ["round", "type", "content", "time"],
+                [1, "question", "我最近失眠怎么办", "t"],
+                [1, "keyword", "安神", "t"],
+                [2, "question", "第二道菜孕妇能吃吗", "t"],
+                [2, "answer", "可以", "t"],
+                [3, "question", "换一批助眠的菜", "t"],
+                [3, "keyword", "安神", "t"],
+                [4, "question", '{"include": ["鸡蛋"]}', "t"],
+            ]
+        )
+    pairs = IntentClassifier.pairs_from_task_history(str(tmp_path))
+    assert pairs == [("第二道菜孕妇能吃吗", "no"), ("换一批助眠的菜", "yes")]
+
+    classifier = IntentClassifier(log_path=str(tmp_path / "intent_decisions.csv"))
+    assert classifier.stats()["samples"] == {"yes": 1, "no": 1}
+
+
+def test_compare_tracks_agreement_per_source():
+    classifier = IntentClassifier()
+    rules = classifier.predict("给我一个recipe")
+    classifier.compare(rules, "yes")
+    classifier.compare(rules, "no")
+    assert classifier.stats()["confidentAgreementRate"] == 0.5
+
+
+def test_question_features_ignore_punctuation_and_case():
+    assert question_features("Hello, World") == question_features("hello world")
@@ -0,0 +1,37 @@
+from keyword_cache import KeywordCache
+from text_normalize import normalize_question, normalize_text
+
+
+def test_normalize_text_folds_width_script_and_punctuation():
+    assert normalize_text("ＡＢＣ，經常頭痛！") == normalize_text("abc 经常头痛")
+    assert normalize_text("  失眠?? ") == "失眠"
+
+
+def test_traditional_question_hits_simplified_entry():
+    cache = KeywordCache(path=None)
+    cache.add("最近总是失眠，应该吃什么？", ["失眠", "安神"])
+    assert cache.lookup("最近總是失眠，應該喫什麼？") == ["失眠", "安神"]
+    assert cache.hits == 1
+
+
+def test_near_duplicate_and_unrelated_questions():
+    cache = KeywordCache(path=None, threshold=0.8)
+    cache.add("脾胃虚弱吃什么好", ["脾胃虚弱"])
+    assert normalize_question("请问脾胃虚弱吃什么好呢") == normalize_question("脾胃虚弱吃什么好")
+    assert cache.lookup("请问脾胃虚弱吃什么好呢") == ["脾胃虚弱"]
+    assert cache.lookup("高血压饮食注意什么") is None
+    # 返回的是副本，调用方修改不影响缓存
+    cache.lookup("脾胃虚弱吃什么好").append("x")
+    assert cache.lookup("脾胃虚弱吃什么好") == ["脾胃虚弱"]
+
+
+def test_only_leading_and_trailing_filler_is_removed():
+    assert normalize_question("请问我最近失眠怎么办呢") == "失眠"
+    # 句中的"了"改变了意思，两个问句不能共用缓存
+    assert normalize_question("吃不了辣怎么办") != normalize_question("吃不辣怎么办")
+    assert normalize_question("喝了酒的第二天胃疼") == "喝了酒的第二天胃疼"
+
+    cache = KeywordCache(path=None, threshold=1.0)
+    cache.add("吃不了辣怎么办", ["脾胃虚弱"])
+    assert cache.lookup("吃不辣怎么办") is None
+    assert cache.lookup("请问吃不了辣怎么办呢") == ["脾胃虚弱"]
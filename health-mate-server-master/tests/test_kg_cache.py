@@ -0,0 +1,98 @@
+import pandas as pd
+
+from kg_cache import LRUCache, copy_result, result_size, versioned_query
+
+
+def test_lru_evicts_least_recently_used_by_count():
+    cache = LRUCache(max_entries=2, max_bytes=1 << 20)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert "b" not in cache
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_respects_byte_limit_and_skips_oversized_values():
+    cache = LRUCache(max_entries=100, max_bytes=100, sizeof=len)
+    cache.put("big", "x" * 101)
+    assert "big" not in cache
+    for i in range(5):
+        cache.put(i, "y" * 30)
+    assert cache.bytes <= 100
+    assert len(cache) == 3
+
+
+def test_ttl_expires_entries(monkeypatch):
+    import kg_cache
+
+    now = [0.0]
+    monkeypatch.setattr(kg_cache.time, "monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.put("k", "v")
+    now[0] = 5
+    assert cache.get("k") == "v"
+    now[0] = 11
+    assert cache.get("k") is None
+
+
+def test_get_or_compute_and_discard_where():
+    cache = LRUCache()
+    calls = []
+    assert cache.get_or_compute(("v1", "a"), lambda: calls.append(1) or "A") == "A"
+    assert cache.get_or_compute(("v1", "a"), lambda: calls.append(1) or "B") == "A"
+    assert calls == [1]
+    cache.put(("v2", "a"), "C")
+    cache.discard_where(lambda key: key[0] == "v1")
+    assert ("v1", "a") not in cache and ("v2", "a") in cache
+
+
+def test_result_size_counts_frame_contents():
+    small = pd.DataFrame({"s": ["a"]})
+    large = pd.DataFrame({"s": ["a" * 1000] * 10})
+    assert result_size(large) > result_size(small)
+
+
+class FakeKG:
+    def __init__(self):
+        self.store = type("Store", (), {"version": "v1"})()
+        self.query_cache = LRUCache()
+        self.calls = 0
+
+    @versioned_query
+    def rows(self, keywords):
+        self.calls += 1
+        return pd.DataFrame({"object": list(keywords)})
+
+
+def test_versioned_query_caches_per_version_and_returns_copies():
+    kg = FakeKG()
+    first = kg.rows(["安神", "补血"])
+    first.loc[0, "object"] = "changed"
+    second = kg.rows(("安神", "补血"))
+    assert list(second["object"]) == ["安神", "补血"]
+    assert kg.calls == 1
+
+    kg.store = type("Store", (), {"version": "v2"})()
+    kg.rows(["安神", "补血"])
+    assert kg.calls == 2
+
+
+def test_copy_result_copies_frames_and_lists():
+    frame = pd.DataFrame({"a": [1]})
+    assert copy_result(frame) is not frame
+    items = ["x"]
+    assert copy_result(items) == items and copy_result(items) is not items
+
+
+def test_cached_search_many_results_cannot_be_corrupted(nutrition_kg):
+    result = nutrition_kg.search_many("食谱的功效", ["安神", "补血"])
+    assert not result.empty
+    assert all(isinstance(m, tuple) for m in result["matched_keywords"])
+
+    expected = result.copy()
+    result["object"] = "changed"
+    result.drop(index=result.index[:5], inplace=True)
+    again = nutrition_kg.search_many("食谱的功效", ["安神", "补血"])
+    pd.testing.assert_frame_equal(again, expected)
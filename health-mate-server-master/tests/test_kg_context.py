@@ -0,0 +1,112 @@
+import logging
+
+import networkx as nx
+
+import main_new
+from kg_context import (
+    BENEFIT_RELATION,
+    INGREDIENT_RELATION,
+    compact_blocks,
+    estimate_tokens,
+    line_format_tokens,
+)
+
+RECIPES = [
+    (
+        "番茄炒蛋",
+        (
+            (BENEFIT_RELATION, (("安神", "食谱的功效"), ("健脾", "食谱的功效"))),
+            (
+                INGREDIENT_RELATION,
+                (("番茄", "A1"), ("鸡蛋", "A2"), ("盐", "D"), ("葱", "C")),
+            ),
+        ),
+    ),
+    (
+        "红枣粥",
+        (
+            (BENEFIT_RELATION, (("补血", "食谱的功效"),)),
+            (INGREDIENT_RELATION, (("大米", "A1"), ("红枣", "B1"), ("冰糖", "D"))),
+        ),
+    ),
+]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("番茄炒蛋") == 4
+    assert estimate_tokens("tomato egg") == 2 + 1
+    assert estimate_tokens("12345, ok") == 2 + 1 + 1
+
+
+def test_unlimited_budget_keeps_everything():
+    blocks, truncated = compact_blocks(RECIPES, ["安神"], 0)
+    assert not truncated
+    assert blocks[0] == (
+        "【KG for 番茄炒蛋】\n"
+        "食谱的功效: 安神、健脾\n"
+        "食谱的食材构成: 番茄、鸡蛋、盐、葱"
+    )
+
+
+def test_tight_budget_keeps_headers_and_main_items_of_every_recipe():
+    blocks, truncated = compact_blocks(RECIPES, ["安神"], 60)
+    assert truncated
+    assert estimate_tokens("\n\n".join(blocks)) <= 60
+    assert blocks == [
+        "【KG for 番茄炒蛋】\n食谱的功效: 安神、健脾\n食谱的食材构成: 番茄、鸡蛋等",
+        "【KG for 红枣粥】\n食谱的食材构成: 大米、红枣等",
+    ]
+
+
+def test_seasonings_do_not_fill_space_left_by_skipped_main_items():
+    # 第二道菜的主料行放不下时，第一道菜也不再补进更低层的辅料和调味料
+    blocks, _ = compact_blocks(RECIPES, ["安神"], 50)
+    assert blocks[1] == "【KG for 红枣粥】"
+    assert "盐" not in blocks[0] and "葱" not in blocks[0]
+
+
+def baseline_edge_lines(baseline, subject):
+    """原先 do_new_round 中逐个食谱建 DiGraph，再按边拼出的三元组行。"""
+    g_sub = nx.DiGraph()
+    for _, row in baseline.get_all_triples_for_subject(subject).iterrows():
+        g_sub.add_node(row["subject"])
+        g_sub.add_node(row["object"])
+        g_sub.add_edge(row["subject"], row["object"], relation=row["relation"])
+    return "\n".join(
+        f"{u} -[{d.get('relation', '')}]-> {v}" for u, v, d in g_sub.edges(data=True)
+    )
+
+
+def test_line_format_tokens_matches_the_rendered_text(nutrition_kg, baseline_kg):
+    subjects = nutrition_kg.top_subjects(["安神", "补血"], 20)
+    assert subjects
+    for subject in subjects:
+        groups = nutrition_kg.relation_groups(subject)
+        objects = [obj for _, items in groups for obj, _ in items]
+        if len(objects) != len(set(objects)):
+            continue  # 对象跨关系重复时原格式取最后一个关系，只是估算
+        lines = baseline_edge_lines(baseline_kg, subject)
+        for is_english in (False, True):
+            name = nutrition_kg.display_name(subject, is_english)
+            assert line_format_tokens(subject, name, groups) == estimate_tokens(
+                f"【KG for {name}】\n" + lines
+            )
+
+
+def test_build_kg_context_reports_tokens_saved_per_call(nutrition_kg, caplog):
+    subjects = nutrition_kg.top_subjects(["安神"], 3)
+    names = [nutrition_kg.display_name(s) for s in subjects]
+    before = main_new.KG_CONTEXT_STATS.snapshot()
+
+    with caplog.at_level(logging.INFO, logger="main_new"):
+        blocks = main_new.build_kg_context(nutrition_kg, subjects, names, ["安神"])
+
+    assert [b.split("\n")[0] for b in blocks] == [f"【KG for {n}】" for n in names]
+    stats = main_new.KG_CONTEXT_STATS.snapshot()
+    assert stats["requests"] == before["requests"] + 1
+    saved = stats["tokensSaved"] - before["tokensSaved"]
+    assert saved > 0
+    [record] = [r for r in caplog.records if r.name == "main_new"]
+    assert record.args[3] == saved
+    assert f"{saved} saved" in record.getMessage()
@@ -0,0 +1,131 @@
+import os
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import REPO_DIR
+from kg_graph import CSRGraph
+from nutrition import NutritionKG
+
+TRIPLES_CSV = os.path.join(REPO_DIR, "test_rows_triples.csv")
+
+
+class BaselineGraph:
+    """原先 nutrition.NutritionKG 逐行 add_node / add_edge 构建图的实现，作为对照。"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.node_to_id = {}
+        self.id_counter = 1
+        self.graph = self.build(df)
+
+    def build(self, df: pd.DataFrame) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        for _, row in df.iterrows():
+            subj, rel, obj = row["subject"], row["relation"], row["object"]
+            for name in (subj, obj):
+                if name not in self.node_to_id:
+                    self.node_to_id[name] = self.id_counter
+                    self.id_counter += 1
+            graph.add_node(self.node_to_id[subj], name=subj)
+            graph.add_node(self.node_to_id[obj], name=obj)
+            graph.add_edge(self.node_to_id[subj], self.node_to_id[obj], relation=rel)
+        return graph
+
+
+def assert_same_graph(new: nx.DiGraph, old: nx.DiGraph):
+    assert list(new.nodes(data=True)) == list(old.nodes(data=True))
+    assert sorted(new.edges(data="relation")) == sorted(old.edges(data="relation"))
+
+
+@pytest.fixture(scope="module")
+def kg():
+    return NutritionKG(TRIPLES_CSV)
+
+
+@pytest.fixture(scope="module")
+def baseline(kg):
+    return BaselineGraph(kg.df)
+
+
+def test_graph_matches_row_by_row_construction(kg, baseline):
+    assert kg.node_to_id == baseline.node_to_id
+    assert kg.id_counter == baseline.id_counter
+    assert_same_graph(kg.graph, baseline.graph)
+
+
+def test_get_subgraph_from_df_assigns_ids_like_before(kg):
+    kg = NutritionKG(TRIPLES_CSV)
+    baseline = BaselineGraph(kg.df)
+    extra = pd.DataFrame(
+        {
+            "subject": ["新食谱", "新食谱", kg.df["subject"].iloc[0]],
+            "relation": ["含有", "含有", "含有"],
+            "object": ["新食材", kg.df["object"].iloc[0], "新食材"],
+        }
+    )
+    for sub_df in [
+        kg.search_by_subject(kg.df["subject"].iloc[0], exact=True),
+        kg.search_by_relation("含有"),
+        extra,
+        kg.df.iloc[:0],
+    ]:
+        assert_same_graph(kg.get_subgraph_from_df(sub_df), baseline.build(sub_df))
+        assert kg.node_to_id == baseline.node_to_id
+        assert kg.id_counter == baseline.id_counter
+
+
+def test_neighbors_and_predecessors_match_networkx(kg, baseline):
+    g = baseline.graph
+    id_to_name = {i: name for name, i in baseline.node_to_id.items()}
+    for name, node in list(baseline.node_to_id.items())[::7]:
+        assert sorted(kg.neighbors(name)) == sorted(
+            id_to_name[n] for n in g.successors(node)
+        )
+        assert sorted(kg.predecessors(name)) == sorted(
+            id_to_name[n] for n in g.predecessors(node)
+        )
+    assert kg.neighbors("不存在的节点") == []
+
+
+def test_relation_filtered_neighbors():
+    g = CSRGraph.from_triples(
+        ["a", "a", "a", "b", "a"],
+        ["r1", "r2", "r1", "r1", "r3"],
+        ["b", "c", "d", "c", "b"],
+    )
+
+    def names(ids):
+        return g.names[ids].tolist()
+
+    assert names(g.neighbors(g.node_id("a"))) == ["b", "c", "d"]
+    assert names(g.neighbors(g.node_id("a"), "r1")) == ["b", "d"]
+    assert names(g.neighbors(g.node_id("a"), ["r2", "r4"])) == ["c"]
+    assert names(g.neighbors(g.node_id("a"), ["r2", "r3"])) == ["b", "c"]
+    assert names(g.predecessors(g.node_id("c"))) == ["a", "b"]
+    assert g.n_edges == 5 and len(g) == 4
+    # 重复边在导出时以最后一条为准
+    exported = g.to_networkx()
+    assert exported.number_of_edges() == 4
+    assert exported.edges[g.node_id("a"), g.node_id("b")]["relation"] == "r3"
+
+
+def test_subgraph_keeps_edges_between_given_nodes(kg):
+    g = kg.kg_graph
+    names = list(
+        dict.fromkeys(
+            kg.df["subject"].iloc[:3].tolist() + kg.df["object"].iloc[:10].tolist()
+        )
+    )
+    sub = kg.subgraph(names)
+    inside = kg.df[kg.df["subject"].isin(names) & kg.df["object"].isin(names)]
+    got = sorted(
+        zip(
+            sub.names[sub.sources].tolist(),
+            np.asarray(sub.relation_names, dtype=object)[sub.relations].tolist(),
+            sub.names[sub.targets].tolist(),
+        )
+    )
+    assert got == sorted(inside.itertuples(index=False, name=None))
+    assert len(g) == len(kg.node_to_id)
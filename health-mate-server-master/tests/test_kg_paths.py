@@ -0,0 +1,183 @@
+import os
+import random
+
+import networkx as nx
+import pytest
+
+from conftest import REPO_DIR
+from kg_graph import CSRGraph
+from nutrition import NutritionKG
+
+RELATIONS = ["r1", "r2", "r3"]
+
+
+def random_triples(seed, n_nodes=30, n_edges=80):
+    rng = random.Random(seed)
+    return [
+        (
+            f"n{rng.randrange(n_nodes)}",
+            rng.choice(RELATIONS),
+            f"n{rng.randrange(n_nodes)}",
+        )
+        for _ in range(n_edges)
+    ]
+
+
+def reference_graph(triples, relations=None, direction="out") -> nx.DiGraph:
+    if isinstance(relations, str):
+        relations = [relations]
+    graph = nx.DiGraph()
+    graph.add_nodes_from(n for s, _, o in triples for n in (s, o))
+    graph.add_edges_from(
+        (s, o) for s, r, o in triples if relations is None or r in relations
+    )
+    if direction == "in":
+        return graph.reverse()
+    if direction == "both":
+        return graph.to_undirected()
+    return graph
+
+
+def reference_paths(triples, sources, relation_path, direction="out"):
+    """逐跳枚举全部简单路径（节点不重复），作为 typed_paths 的对照。"""
+    paths = [((s,), ()) for s in dict.fromkeys(sources)]
+    for hop in relation_path:
+        wanted = [hop] if isinstance(hop, str) else hop
+        extended = []
+        for nodes, rels in paths:
+            for s, r, o in triples:
+                if wanted is not None and r not in wanted:
+                    continue
+                if direction == "out" and s == nodes[-1]:
+                    nxt = o
+                elif direction == "in" and o == nodes[-1]:
+                    nxt = s
+                else:
+                    continue
+                if nxt not in nodes:
+                    extended.append((nodes + (nxt,), rels + (r,)))
+        paths = extended
+    return paths
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("direction", ["out", "in", "both"])
+@pytest.mark.parametrize("relations", [None, "r1", ["r2", "r3"]])
+def test_k_hop_matches_bfs(seed, direction, relations):
+    triples = random_triples(seed)
+    g = CSRGraph.from_triples(*zip(*triples))
+    ref = reference_graph(triples, relations, direction)
+    seeds = ["n0", "n1", "n0"]
+    for k in range(4):
+        nodes, hops = g.k_hop(g.node_ids(seeds), k, relations, direction)
+        got = dict(zip(g.names[nodes].tolist(), hops.tolist()))
+        expected = {}
+        for seed_name in set(seeds):
+            for node, dist in nx.single_source_shortest_path_length(
+                ref, seed_name, cutoff=k
+            ).items():
+                expected[node] = min(dist, expected.get(node, dist))
+        assert got == expected
+        # BFS 顺序：跳数不减
+        assert list(hops) == sorted(hops)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("direction", ["out", "in"])
+def test_typed_paths_match_enumeration(seed, direction):
+    triples = random_triples(seed, n_nodes=15, n_edges=40)
+    g = CSRGraph.from_triples(*zip(*triples))
+    for relation_path in (["r1"], ["r1", None], [["r1", "r2"], "r3", None]):
+        nodes, rels, _ = g.typed_paths(
+            g.node_ids(["n0", "n3"]), relation_path, direction, limit=100000
+        )
+        got = sorted(
+            (tuple(g.names[row].tolist()), tuple(g.relation_names[r] for r in rel_row))
+            for row, rel_row in zip(nodes, rels)
+        )
+        expected = reference_paths(triples, ["n0", "n3"], relation_path, direction)
+        assert got == sorted(expected)
+        assert nodes.shape[1] == len(relation_path) + 1
+
+
+def test_typed_paths_limit_and_no_match():
+    triples = random_triples(0)
+    g = CSRGraph.from_triples(*zip(*triples))
+    nodes, rels, edges = g.typed_paths(g.node_ids(["n0"]), [None, None], limit=3)
+    assert len(nodes) <= 3 and rels.shape == edges.shape == (len(nodes), 2)
+    nodes, rels, edges = g.typed_paths(g.node_ids(["n0"]), ["不存在", None])
+    assert nodes.shape == (0, 3) and rels.shape == (0, 2)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("relations", [None, ["r1", "r2"]])
+def test_shortest_path_matches_networkx(seed, relations):
+    triples = random_triples(seed)
+    g = CSRGraph.from_triples(*zip(*triples))
+    ref = reference_graph(triples, relations)
+    edge_set = set(triples)
+    for source in ["n0", "n1", "n2"]:
+        for target in ["n3", "n4", "n5", "n0"]:
+            path = g.shortest_path(g.node_id(source), g.node_id(target), 3, relations)
+            try:
+                length = nx.shortest_path_length(ref, source, target)
+            except nx.NetworkXNoPath:
+                length = None
+            if length is None or length > 3:
+                assert path is None
+                continue
+            assert len(path) == length
+            hops = [
+                (
+                    g.names[g.sources[e]],
+                    g.relation_names[g.relations[e]],
+                    g.names[g.targets[e]],
+                )
+                for e in path
+            ]
+            assert all(hop in edge_set for hop in hops)
+            if hops:
+                assert hops[0][0] == source and hops[-1][2] == target
+                assert all(a[2] == b[0] for a, b in zip(hops, hops[1:]))
+
+
+def test_nutrition_multi_hop_queries():
+    kg = NutritionKG(os.path.join(REPO_DIR, "test_rows_triples.csv"))
+    triples = list(kg.df.itertuples(index=False, name=None))
+    start = kg.df.loc[kg.df["relation"] == "含有", "subject"].iloc[0]
+
+    table = kg.k_hop(start, k=2)
+    assert table.iloc[0].tolist() == [start, 0]
+    expected = nx.single_source_shortest_path_length(reference_graph(triples), start, 2)
+    assert dict(zip(table["name"], table["hops"])) == expected
+
+    one_hop = nx.single_source_shortest_path_length(reference_graph(triples), start, 1)
+    inner = kg.k_hop_triples(start, k=1)
+    assert set(inner.itertuples(index=False, name=None)) == {
+        t for t in triples if t[0] in one_hop and t[2] in one_hop
+    }
+
+    paths = kg.find_paths(start, ["含有", "具有"])
+    assert list(paths.columns) == ["node_0", "relation_1", "node_1", "relation_2", "node_2"]
+    assert sorted(paths.itertuples(index=False, name=None)) == sorted(
+        (n[0], r[0], n[1], r[1], n[2])
+        for n, r in reference_paths(triples, [start], ["含有", "具有"])
+    )
+
+    for t in [t for t in triples if t[0] == start][:3]:
+        path = kg.shortest_path(start, t[2])
+        assert len(path) == 1 and path[0][::2] == t[::2] and path[0] in triples
+    assert kg.shortest_path(start, "不存在的节点") is None
+
+
+def test_typed_paths_limit_only_applies_to_complete_paths():
+    # 第一跳的分支数超过 limit，只有排在最后的分支能走完第二跳
+    g = CSRGraph.from_triples(
+        ["r", "r", "r", "c"], ["has", "has", "has", "y"], ["a", "b", "c", "n3"]
+    )
+    for limit in (1, 2, 10):
+        nodes, rels, _ = g.typed_paths(g.node_ids(["r"]), ["has", "y"], limit=limit)
+        assert g.names[nodes].tolist() == [["r", "c", "n3"]]
+        assert [[g.relation_names[r] for r in row] for row in rels] == [["has", "y"]]
+    nodes, _, _ = g.typed_paths(g.node_ids(["r"]), ["has"], limit=2)
+    assert len(nodes) == 2
@@ -0,0 +1,70 @@
+import pytest
+
+import kg_store
+from conftest import assert_same_rows
+from main_new import NutritionKG
+
+
+def append_row(path, row):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(row + "\n")
+
+
+def test_reload_only_when_the_source_changes(small_csv):
+    kg = NutritionKG(small_csv)
+    events = []
+    kg.add_reload_listener(lambda old, new: events.append((old, new)))
+    version = kg.version
+
+    assert not kg.reload()
+    assert kg.reload(force=True)
+    assert kg.version == version and events == []
+
+    append_row(small_csv, "新菜,食谱的功效,补血,食谱的功效")
+    assert kg.reload()
+    assert events == [(version, kg.version)] and kg.version != version
+    assert "新菜" in set(kg.advanced_search("食谱的功效", "补血")["subject"])
+
+
+def test_reload_matches_a_fresh_load(small_csv):
+    kg = NutritionKG(small_csv)
+    kg.advanced_search("食谱的功效", "补")
+    append_row(small_csv, "新菜,食谱的功效,补气,食谱的功效")
+    kg.reload()
+    fresh = NutritionKG(small_csv)
+    assert kg.version == fresh.version
+    assert_same_rows(
+        kg.advanced_search("食谱的功效", "补"), fresh.advanced_search("食谱的功效", "补")
+    )
+    assert kg.top_subjects(["补"], 10) == fresh.top_subjects(["补"], 10)
+
+
+def test_pinned_view_keeps_its_version(small_csv):
+    kg = NutritionKG(small_csv)
+    view = kg.pinned()
+    before = view.advanced_search("食谱的功效")
+    append_row(small_csv, "新菜,食谱的功效,补血,食谱的功效")
+    kg.reload()
+    assert view.version != kg.version
+    assert_same_rows(view.advanced_search("食谱的功效"), before)
+    assert len(kg.advanced_search("食谱的功效")) == len(before) + 1
+
+
+def test_failed_reload_keeps_the_old_store(small_csv, monkeypatch):
+    kg = NutritionKG(small_csv)
+    store = kg.store
+    append_row(small_csv, "新菜,食谱的功效,补血,食谱的功效")
+
+    def broken(csv_path):
+        raise ValueError("bad csv")
+
+    monkeypatch.setattr(kg_store.TripleStore, "from_csv", broken)
+    with pytest.raises(ValueError):
+        kg.reload()
+    assert kg.store is store
+    kg._reload_quietly()
+    assert kg.store is store
+
+    monkeypatch.undo()
+    assert kg.reload()
+    assert kg.store is not store
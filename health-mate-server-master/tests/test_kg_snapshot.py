@@ -0,0 +1,99 @@
+import shutil
+
+import numpy as np
+import pytest
+
+import kg_store
+from conftest import RECIPES_CSV, assert_same_rows
+from kg_store import TripleStore, build_snapshot, load_store, snapshot_is_fresh
+from main_new import NutritionKG
+from test_kg_store import KEYWORD_SETS, SEARCHES
+
+
+@pytest.fixture(scope="module")
+def recipes_copy(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("kg") / "recipes.csv")
+    shutil.copyfile(RECIPES_CSV, path)
+    build_snapshot(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def snapshot_kg(recipes_copy):
+    return NutritionKG(recipes_copy)
+
+
+def test_load_store_opens_fresh_snapshot(recipes_copy, monkeypatch):
+    def no_parse(csv_path):
+        raise AssertionError("CSV should not be parsed when the snapshot is fresh")
+
+    with open(recipes_copy, "rb") as f:
+        version = kg_store.content_version(f.read())
+    monkeypatch.setattr(TripleStore, "from_csv", no_parse)
+    store = load_store(recipes_copy)
+    assert store.version == version
+    # 数组直接映射快照文件，只读
+    assert isinstance(store.codes["subject"].base, np.memmap)
+    assert not store.codes["subject"].flags.writeable
+
+
+def test_stale_snapshot_falls_back_to_csv(recipes_copy, tmp_path):
+    csv_path = str(tmp_path / "recipes.csv")
+    shutil.copyfile(recipes_copy, csv_path)
+    build_snapshot(csv_path)
+    assert snapshot_is_fresh(kg_store.snapshot_path_for(csv_path), csv_path)
+    with open(csv_path, "a", encoding="utf-8") as f:
+        f.write("新菜,食谱的功效,补血,食谱的功效\n")
+    assert not snapshot_is_fresh(kg_store.snapshot_path_for(csv_path), csv_path)
+    store = load_store(csv_path)
+    assert len(store) == len(TripleStore.open(kg_store.snapshot_path_for(csv_path))) + 1
+
+
+def test_snapshot_arrays_match_compiled_store(snapshot_kg, nutrition_kg):
+    opened, compiled = snapshot_kg.store, nutrition_kg.store
+    assert opened.version == compiled.version
+    assert opened.columns == compiled.columns
+    assert opened.strings.to_list() == compiled.strings.to_list()
+    np.testing.assert_array_equal(opened.complete, compiled.complete)
+    for col in compiled.columns:
+        np.testing.assert_array_equal(opened.codes[col], compiled.codes[col])
+
+
+@pytest.mark.parametrize("relation,obj,exact", SEARCHES)
+def test_snapshot_advanced_search(snapshot_kg, nutrition_kg, relation, obj, exact):
+    assert_same_rows(
+        snapshot_kg.advanced_search(relation, object_filter=obj, exact_relation=exact),
+        nutrition_kg.advanced_search(relation, object_filter=obj, exact_relation=exact),
+    )
+
+
+@pytest.mark.parametrize("keywords", KEYWORD_SETS)
+def test_snapshot_search_many_and_ranking(snapshot_kg, nutrition_kg, keywords):
+    opened = snapshot_kg.search_many("食谱的功效", keywords)
+    compiled = nutrition_kg.search_many("食谱的功效", keywords)
+    assert_same_rows(opened, compiled)
+    assert snapshot_kg.top_subjects(keywords, 50) == nutrition_kg.top_subjects(keywords, 50)
+
+
+def test_snapshot_per_recipe_queries(snapshot_kg, nutrition_kg):
+    subjects = nutrition_kg.top_subjects(["补血", "安神", "Nourish Blood"], 20)
+    ingredients = nutrition_kg.advanced_search("食谱的食材构成")["object"].unique()[:5]
+    candidates = nutrition_kg.search_many("食谱的功效", ["补血", "健脾"])
+    for subject in subjects:
+        assert_same_rows(
+            snapshot_kg.get_full_data_for_subject(subject),
+            nutrition_kg.get_full_data_for_subject(subject),
+        )
+        assert snapshot_kg.relation_groups(subject) == nutrition_kg.relation_groups(subject)
+        assert snapshot_kg.display_name(subject, True) == nutrition_kg.display_name(
+            subject, True
+        )
+    for ing in ingredients:
+        assert_same_rows(
+            snapshot_kg.filter_by_ingredients(candidates, [ing], []),
+            nutrition_kg.filter_by_ingredients(candidates, [ing], []),
+        )
+        assert_same_rows(
+            snapshot_kg.filter_by_ingredients(candidates, [], [ing]),
+            nutrition_kg.filter_by_ingredients(candidates, [], [ing]),
+        )
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import BaselineKG, assert_same_rows
+from kg_store import TripleStore
+from main_new import NutritionKG
+
+SEARCHES = [
+    ("食谱的功效", "补血", True),
+    ("食谱的功效", None, True),
+    ("食谱的食材构成", "鸡", True),
+    ("Health Benefit", "Blood", True),
+    ("Ingredient", "cheese", True),
+    (" Cheese", None, True),
+    ("功效", "脾", False),
+    ("Ingredient|食材", "Rice", False),
+    # 旧实现用 str.contains，关键词按正则解释
+    ("食谱的功效", "补.|安神", True),
+    ("食谱的功效", "^养", True),
+    ("食谱的功效", "不存在的功效", True),
+    ("不存在的关系", None, True),
+]
+
+
+@pytest.mark.parametrize("relation,obj,exact", SEARCHES)
+def test_advanced_search_matches_baseline(nutrition_kg, baseline_kg, relation, obj, exact):
+    assert_same_rows(
+        nutrition_kg.advanced_search(relation, object_filter=obj, exact_relation=exact),
+        baseline_kg.advanced_search(relation, object_filter=obj, exact_relation=exact),
+    )
+
+
+def test_subject_queries_match_baseline(nutrition_kg, baseline_kg):
+    subjects = pd.read_csv(baseline_kg.csv_path, dtype=str, nrows=2000)["subject"]
+    for subject in list(subjects.unique()[:: 97]) + ["不存在的食谱"]:
+        assert_same_rows(
+            nutrition_kg.get_all_triples_for_subject(subject),
+            baseline_kg.get_all_triples_for_subject(subject),
+        )
+        assert_same_rows(
+            nutrition_kg.get_full_data_for_subject(subject),
+            baseline_kg.get_full_data_for_subject(subject),
+        )
+
+
+@pytest.fixture
+def sparse_csv(tmp_path):
+    """带缺失值、正则特殊字符与重复行的小数据集。"""
+    path = tmp_path / "sparse.csv"
+    path.write_text(
+        "subject,relation,object,cat\n"
+        "红枣粥,食谱的功效,补血,食谱的功效\n"
+        "红枣粥,食谱的功效,,食谱的功效\n"
+        ",食谱的功效,补血,食谱的功效\n"
+        "红枣粥,食谱的食材构成,红枣(干),主料\n"
+        "红枣粥,食谱的食材构成,粳米,\n"
+        "红枣粥,食谱的功效,补血,食谱的功效\n"
+        "山药汤,,补气,食谱的功效\n"
+        "山药汤,食谱的功效,补气养血,食谱的功效\n",
+        encoding="utf-8-sig",
+    )
+    return str(path)
+
+
+@pytest.mark.filterwarnings("ignore:This pattern is interpreted as a regular expression")
+def test_missing_values_and_duplicates_match_baseline(sparse_csv):
+    kg, baseline = NutritionKG(sparse_csv), BaselineKG(sparse_csv)
+    for relation, obj, exact in [
+        ("食谱的功效", None, True),
+        ("食谱的功效", "补", True),
+        ("食谱的食材构成", "(干)", True),
+        ("食谱的食材构成", r"\(干\)", True),
+        ("食谱", "血", False),
+    ]:
+        assert_same_rows(
+            kg.advanced_search(relation, object_filter=obj, exact_relation=exact),
+            baseline.advanced_search(relation, object_filter=obj, exact_relation=exact),
+        )
+    for subject in ["红枣粥", "山药汤", "不存在"]:
+        assert_same_rows(
+            kg.get_all_triples_for_subject(subject),
+            baseline.get_all_triples_for_subject(subject),
+        )
+        assert_same_rows(
+            kg.get_full_data_for_subject(subject),
+            baseline.get_full_data_for_subject(subject),
+        )
+
+
+def test_version_follows_csv_content(sparse_csv, tmp_path):
+    copy = tmp_path / "copy.csv"
+    copy.write_bytes(open(sparse_csv, "rb").read())
+    assert TripleStore.from_csv(sparse_csv).version == TripleStore.from_csv(str(copy)).version
+    with open(copy, "a", encoding="utf-8") as f:
+        f.write("山药汤,食谱的功效,健脾,食谱的功效\n")
+    assert TripleStore.from_csv(sparse_csv).version != TripleStore.from_csv(str(copy)).version
+
+
+def test_lookup_and_contains_return_sorted_row_ids(sparse_csv):
+    store = TripleStore.from_csv(sparse_csv)
+    assert store.lookup("subject", "红枣粥").tolist() == [0, 1, 3, 4, 5]
+    assert store.lookup("subject", "不存在").tolist() == []
+    rows = store.contains("object", "补")
+    assert rows.tolist() == [0, 2, 5, 6, 7]
+    assert np.all(np.diff(rows) > 0)
+
+
+KEYWORD_SETS = [
+    ["补血", "安神", "健脾", "补气", "养心"],
+    ["补血", "补血", "", "血"],
+    ["Nourish Blood", "Spleen", "不存在"],
+    ["不存在"],
+    [],
+]
+
+
+@pytest.mark.parametrize("keywords", KEYWORD_SETS)
+@pytest.mark.parametrize("relation,exact", [("食谱的功效", True), ("功效|Benefit", False)])
+def test_search_many_matches_concatenated_searches(
+    nutrition_kg, baseline_kg, keywords, relation, exact
+):
+    result = nutrition_kg.search_many(relation, keywords, exact_relation=exact)
+
+    # 旧实现：逐个关键词 advanced_search 后 concat 再去重。
+    # 空关键词在旧实现里等于不过滤，search_many 直接忽略（提取出的关键词不会为空）
+    frames = [
+        baseline_kg.advanced_search(relation, object_filter=kw, exact_relation=exact)
+        for kw in keywords
+        if kw
+    ]
+    frames = [df for df in frames if not df.empty]
+    if frames:
+        expected = pd.concat(frames, ignore_index=True).drop_duplicates()
+    else:
+        expected = pd.DataFrame(columns=["subject", "relation", "object", "csv_idx"])
+    assert_same_rows(result[["subject", "relation", "object", "csv_idx"]], expected)
+
+    unique_keywords = list(dict.fromkeys(kw for kw in keywords if kw))
+    for obj, matched, count in zip(
+        result["object"], result["matched_keywords"], result["match_count"]
+    ):
+        assert matched == tuple(kw for kw in unique_keywords if kw in obj)
+        assert count == len(matched)
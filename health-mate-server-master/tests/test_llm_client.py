@@ -0,0 +1,210 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import llm_client
+from llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMError
+
+
+def reply(content, finish_reason="stop"):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message, finish_reason=finish_reason)]
+    )
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    return LLMClient(
+        "http://llm.invalid/",
+        "key",
+        "gpt-4o",
+        "2024-05-01-preview",
+        max_retries=3,
+        backoff_base=0.0,
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60.0),
+    )
+
+
+def fake_create(monkeypatch, outcomes):
+    """依次返回或抛出 outcomes 中的结果，记录每次请求的参数。"""
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    return calls
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_timeout(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.snapshot()["state"] == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now[0] += 31
+    assert breaker.allow()  # 半开：只放行一个试探请求
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.snapshot()["state"] == CircuitBreaker.OPEN
+
+    now[0] += 31
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": "closed", "consecutiveFailures": 0}
+
+
+def test_release_frees_the_half_open_trial(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    breaker.record_failure()
+    now[0] += 11
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_open_breaker_stops_retrying(client, monkeypatch):
+    calls = fake_create(monkeypatch, [openai.error.ServiceUnavailableError("down")])
+    with pytest.raises(CircuitOpenError):
+        client.chat("intent", [], 0.0, 10)
+    assert len(calls) == client.breaker.failure_threshold
+
+
+def test_retryable_errors_are_retried(client, monkeypatch):
+    calls = fake_create(
+        monkeypatch, [openai.error.RateLimitError("slow down"), reply(" 你好 ")]
+    )
+    assert client.chat("intent", [], 0.0, 10) == "你好"
+    assert len(calls) == 2
+    assert client.stats()["stages"]["intent"]["retries"] == 1
+    assert client.breaker.snapshot()["state"] == "closed"
+
+
+def test_non_retryable_errors_fail_immediately(client, monkeypatch):
+    calls = fake_create(monkeypatch, [openai.error.InvalidRequestError("bad", None)])
+    with pytest.raises(LLMError):
+        client.chat("intent", [], 0.0, 10)
+    assert len(calls) == 1
+    assert client.breaker.snapshot()["consecutiveFailures"] == 0
+
+
+def test_gives_up_after_max_retries_and_opens_breaker(client, monkeypatch):
+    client.breaker = CircuitBreaker(failure_threshold=client.max_retries + 1)
+    calls = fake_create(monkeypatch, [openai.error.Timeout("slow")])
+    with pytest.raises(LLMError):
+        client.chat("intent", [], 0.0, 10)
+    assert len(calls) == client.max_retries + 1
+    with pytest.raises(CircuitOpenError):
+        client.chat("intent", [], 0.0, 10)
+    assert len(calls) == client.max_retries + 1
+
+
+def test_missing_content_is_an_llm_error(client, monkeypatch):
+    fake_create(monkeypatch, [reply(None, "content_filter")])
+    with pytest.raises(LLMError, match="content_filter"):
+        client.chat("intent", [], 0.0, 10)
+    assert client.stats()["stages"]["intent"]["errors"] == 1
+
+
+def test_malformed_response_is_an_llm_error(client, monkeypatch):
+    fake_create(monkeypatch, [SimpleNamespace(choices=[])])
+    with pytest.raises(LLMError):
+        client.chat("intent", [], 0.0, 10)
+
+
+def test_no_request_is_sent_after_the_deadline(client, monkeypatch):
+    monkeypatch.setenv("LLM_TIMEOUT_INTENT", "0")
+    calls = fake_create(monkeypatch, [reply("yes")])
+    with pytest.raises(LLMError, match="ran out of time"):
+        client.chat("intent", [], 0.0, 10)
+    assert calls == []
+
+
+def test_request_timeout_is_the_remaining_budget(client, monkeypatch):
+    monkeypatch.setenv("LLM_TIMEOUT_INTENT", "5")
+    calls = fake_create(monkeypatch, [reply("yes")])
+    client.chat("intent", [], 0.0, 10)
+    assert 0 < calls[0]["request_timeout"] <= 5
+
+
+def test_stream_reports_finish_reason(client, monkeypatch):
+    chunks = [
+        {"choices": []},
+        {"choices": [{"delta": {"content": "Hel"}, "finish_reason": None}]},
+        {"choices": [{"delta": {"content": "lo"}, "finish_reason": "length"}]},
+    ]
+    fake_create(monkeypatch, [iter(chunks)])
+    finish = []
+    assert list(client.stream("chase", [], 0.0, 10, on_finish=finish.append)) == [
+        "Hel",
+        "lo",
+    ]
+    assert finish == ["length"]
+
+
+def open_breaker_for_trial(client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: now[0])
+    for _ in range(client.breaker.failure_threshold):
+        client.breaker.record_failure()
+    now[0] += client.breaker.reset_timeout + 1
+    return now
+
+
+def test_non_retryable_stream_failure_releases_the_half_open_trial(client, monkeypatch):
+    open_breaker_for_trial(client, monkeypatch)
+    chunks = [
+        {"choices": [{"delta": {"content": "Hel"}, "finish_reason": None}]},
+        {"bad": "chunk"},
+    ]
+    fake_create(monkeypatch, [iter(chunks)])
+    with pytest.raises(LLMError, match="stream failed"):
+        list(client.stream("chase", [], 0.0, 10))
+    assert client.breaker.snapshot()["state"] == CircuitBreaker.HALF_OPEN
+    assert client.breaker.allow()
+
+
+def test_retryable_stream_failure_reopens_the_breaker(client, monkeypatch):
+    open_breaker_for_trial(client, monkeypatch)
+
+    def broken():
+        yield {"choices": [{"delta": {"content": "Hel"}, "finish_reason": None}]}
+        raise openai.error.APIConnectionError("reset")
+
+    fake_create(monkeypatch, [broken()])
+    with pytest.raises(LLMError):
+        list(client.stream("chase", [], 0.0, 10))
+    assert client.breaker.snapshot()["state"] == CircuitBreaker.OPEN
+
+
+def test_trickling_stream_stops_at_the_stage_deadline(client, monkeypatch):
+    monkeypatch.setenv("LLM_TIMEOUT_CHASE", "5")
+    now = [0.0]
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: now[0])
+
+    def trickle():
+        while True:
+            now[0] += 2
+            yield {"choices": [{"delta": {"content": "x"}, "finish_reason": None}]}
+
+    fake_create(monkeypatch, [trickle()])
+    received = []
+    with pytest.raises(LLMError, match="deadline"):
+        for text in client.stream("chase", [], 0.0, 10):
+            received.append(text)
+    assert received == ["x", "x"]
+    assert client.stats()["stages"]["chase"]["errors"] == 1
@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+import pytest
+
+from main_new import init_history_file, save_top_subject_csvs
+
+KG_COLUMNS = ["subject", "relation", "object", "cat"]
+
+
+def baseline_merged_kg(kg_dir, n):
+    """原先 do_new_round 把 KG1..n.csv 按 dtype=str 读回再合并的结果。"""
+    frames = []
+    for i in range(1, n + 1):
+        fname = os.path.join(kg_dir, f"KG{i}.csv")
+        if os.path.exists(fname):
+            frames.append(pd.read_csv(fname, dtype=str))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def kg_values(df):
+    # pandas_to_json 只用到这四列
+    return df[KG_COLUMNS].astype(object).where(df[KG_COLUMNS].notna(), None).values.tolist()
+
+
+@pytest.mark.parametrize("is_english", [False, True])
+def test_in_memory_kg_matches_the_written_files(nutrition_kg, tmp_path, is_english):
+    subjects = nutrition_kg.top_subjects(["补血", "安神"], 3)
+    assert len(subjects) == 3
+    kg_dir = str(tmp_path / "req")
+    merged = save_top_subject_csvs(nutrition_kg, subjects, is_english, kg_dir=kg_dir)
+    assert sorted(os.listdir(kg_dir)) == ["KG1.csv", "KG2.csv", "KG3.csv"]
+    assert kg_values(merged) == kg_values(baseline_merged_kg(kg_dir, 3))
+
+
+def test_stale_kg_files_are_removed(nutrition_kg, tmp_path):
+    kg_dir = str(tmp_path)
+    subjects = nutrition_kg.top_subjects(["健脾"], 3)
+    save_top_subject_csvs(nutrition_kg, subjects, kg_dir=kg_dir)
+    merged = save_top_subject_csvs(nutrition_kg, subjects[:1], kg_dir=kg_dir)
+    assert sorted(os.listdir(kg_dir)) == ["KG1.csv"]
+    assert set(merged["subject"]) == {subjects[0]}
+
+
+def test_without_kg_dir_nothing_is_written(nutrition_kg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    context = init_history_file(str(tmp_path / "user.csv"))
+    assert context.kg_dir is None
+    merged = save_top_subject_csvs(
+        nutrition_kg, nutrition_kg.top_subjects(["清热"], 2), kg_dir=context.kg_dir
+    )
+    assert not merged.empty
+    assert sorted(os.listdir(tmp_path)) == ["user.csv"]
+
+
+def test_no_subjects_gives_an_empty_frame(nutrition_kg, tmp_path):
+    assert save_top_subject_csvs(nutrition_kg, [], kg_dir=str(tmp_path)).empty
+    assert save_top_subject_csvs(nutrition_kg, ["不存在的食谱"]).empty
@@ -0,0 +1,207 @@
+import random
+import threading
+
+import pandas as pd
+import pytest
+
+from main_new import persist_history_rows
+from session_state import SessionCache
+
+
+def baseline_state(path):
+    """原先 main_new.py 每次请求用 pandas 读整个历史文件得到的状态，作为对照。"""
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    round_id = df["round"].max()
+
+    def rows(r, record_type):
+        return df[(df["round"] == r) & (df["type"] == record_type)]
+
+    answers = rows(round_id, "answer")
+    tmp_r = round_id
+    kw_df = rows(tmp_r, "keyword")
+    while tmp_r > 0 and kw_df.empty:
+        tmp_r -= 1
+        kw_df = rows(tmp_r, "keyword")
+    tmp_r = round_id
+    q_df = rows(tmp_r, "question")
+    while tmp_r > 0 and q_df.empty:
+        tmp_r -= 1
+        q_df = rows(tmp_r, "question")
+    return {
+        "round": int(round_id),
+        "last_answer": answers["content"].values[-1] if not answers.empty else None,
+        "candidates": list(rows(round_id, "candidate")["content"].values),
+        "keywords": list(kw_df["content"].values),
+        "question": q_df["content"].values[0] if not q_df.empty else None,
+    }
+
+
+def cached_state(cache, path):
+    state = cache.get(path)
+    return {
+        "round": state.round,
+        "last_answer": state.last_answer,
+        "candidates": state.candidates,
+        "keywords": state.keywords,
+        "question": state.question,
+    }
+
+
+def random_round(rng, round_id):
+    records = []
+    if rng.random() < 0.8:
+        records.append(("question", f"q{round_id}"))
+    records += [("keyword", f"k{round_id}-{i}") for i in range(rng.randint(0, 3))]
+    records += [("candidate", f"c{round_id}-{i}") for i in range(rng.randint(0, 4))]
+    if rng.random() < 0.7:
+        records.append(("answer", f"a{round_id}"))
+    return records or [("question", f"q{round_id}")]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_baseline_scan(tmp_path, seed):
+    rng = random.Random(seed)
+    path = str(tmp_path / "hist.csv")
+    cache = SessionCache(persist_history_rows, flush_interval=0)
+    for round_id in range(1, 15):
+        cache.commit(path, round_id, random_round(rng, round_id), "t")
+        assert cached_state(cache, path) == baseline_state(path)
+        # 新建的缓存从文件读出的状态也一致
+        assert cached_state(SessionCache(persist_history_rows), path) == baseline_state(path)
+
+
+def test_write_behind_flushes_pending_rows(tmp_path):
+    path = str(tmp_path / "hist.csv")
+    cache = SessionCache(persist_history_rows, flush_interval=60)
+    cache.commit(path, 1, [("question", "q1"), ("answer", "a1")], "t")
+    assert cache.get(path).last_answer == "a1"
+    assert not (tmp_path / "hist.csv").exists()
+    cache.flush()
+    assert baseline_state(path)["last_answer"] == "a1"
+    assert cache.stats()["reloads"] == 0
+
+
+def test_reloads_rows_written_by_another_process(tmp_path):
+    path = str(tmp_path / "hist.csv")
+    worker_a = SessionCache(persist_history_rows, flush_interval=0)
+    worker_b = SessionCache(persist_history_rows, flush_interval=0)
+    worker_a.commit(path, 1, [("question", "q1"), ("answer", "a1")], "t")
+    assert worker_b.get(path).round == 1
+    worker_b.commit(path, 2, [("question", "q2"), ("answer", "a2")], "t")
+    assert cached_state(worker_a, path) == baseline_state(path)
+    assert worker_a.get(path).last_answer == "a2"
+    assert worker_a.stats()["reloads"] == 1
+
+
+def test_failed_flush_is_retried_and_capped(tmp_path):
+    path = str(tmp_path / "hist.csv")
+    written = []
+    failing = [True]
+
+    def persist(p, records):
+        if failing[0]:
+            raise OSError("disk full")
+        written.extend(records)
+
+    cache = SessionCache(persist, flush_interval=60, max_pending=3)
+    cache.commit(path, 1, [("question", "q1"), ("answer", "a1")], "t")
+    cache.flush()
+    cache.commit(path, 2, [("question", "q2"), ("answer", "a2")], "t")
+    cache.flush()
+    stats = cache.stats()
+    assert stats["flushFailures"] == 2
+    assert stats["droppedRecords"] == 1
+    assert "disk full" in stats["lastFlushError"]
+    # 内存状态不受落盘失败影响
+    assert cache.get(path).last_answer == "a2"
+
+    failing[0] = False
+    cache.flush()
+    assert [r[:3] for r in written] == [(1, "answer", "a1"), (2, "question", "q2"), (2, "answer", "a2")]
+    cache.flush()
+    assert len(written) == 3
+
+
+def baseline_append(path, round_id, record_type, content, now_str):
+    """原先 main_new.append_history：每条记录一次 DataFrame.to_csv 追加。"""
+    pd.DataFrame(
+        [{"round": round_id, "type": record_type, "content": content, "time": now_str}]
+    ).to_csv(path, mode="a", header=False, index=False, encoding="utf-8-sig")
+
+
+def test_persisted_rows_are_byte_identical_to_to_csv(tmp_path):
+    from main_new import init_history_file
+
+    rounds = [
+        (1, [("question", "我最近失眠，怎么办?"), ("keyword", "安神"), ("keyword", "疏肝")]),
+        (1, [("candidate", '红枣"桂圆"粥'), ("answer", "第一段\n\n第二段, 还有逗号")]),
+        (2, [("question", ""), ("answer", "  空白 ")]),
+    ]
+    old_path = str(tmp_path / "old.csv")
+    new_path = init_history_file(str(tmp_path / "new.csv")).history_csv
+    init_history_file(old_path)
+    for round_id, records in rounds:
+        for record_type, content in records:
+            baseline_append(old_path, round_id, record_type, content, "2025-01-01 08:00:00")
+        persist_history_rows(
+            new_path, [(round_id, t, c, "2025-01-01 08:00:00") for t, c in records]
+        )
+    with open(old_path, "rb") as old, open(new_path, "rb") as new:
+        assert new.read() == old.read()
+
+
+def test_persist_creates_the_header_for_a_missing_file(tmp_path):
+    path = str(tmp_path / "missing.csv")
+    persist_history_rows(path, [(1, "question", "q", "t")])
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    assert list(df.columns) == ["round", "type", "content", "time"]
+    assert df.values.tolist() == [[1, "question", "q", "t"]]
+
+
+def test_get_during_a_slow_flush_keeps_the_in_flight_round(tmp_path):
+    path = str(tmp_path / "hist.csv")
+    cache = SessionCache(persist_history_rows, flush_interval=60)
+    cache.commit(path, 1, [("question", "q1"), ("answer", "a1")], "t")
+    cache.flush()
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow_persist(p, records):
+        # 先写一半就停住，模拟写入进行中文件已经变了
+        written = persist_history_rows(p, records[:1])
+        started.set()
+        release.wait(5)
+        return written + persist_history_rows(p, records[1:])
+
+    cache.persist = slow_persist
+    cache.commit(path, 2, [("question", "q2"), ("candidate", "c2"), ("answer", "a2")], "t")
+    flusher = threading.Thread(target=cache.flush)
+    flusher.start()
+    assert started.wait(5)
+    state = cached_state(cache, path)
+    assert state["round"] == 2 and state["last_answer"] == "a2"
+    assert state["candidates"] == ["c2"]
+    release.set()
+    flusher.join(5)
+
+    assert cached_state(cache, path) == baseline_state(path)
+    assert cache.stats()["reloads"] == 0 and cache.stats()["pending"] == 0
+
+
+def test_write_by_another_worker_during_a_flush_is_picked_up(tmp_path):
+    path = str(tmp_path / "hist.csv")
+    cache = SessionCache(persist_history_rows, flush_interval=60)
+    cache.commit(path, 1, [("question", "q1"), ("answer", "a1")], "t")
+    cache.flush()
+
+    def persist_then_other_worker(p, records):
+        written = persist_history_rows(p, records)
+        persist_history_rows(p, [(3, "question", "q3", "t"), (3, "answer", "a3", "t")])
+        return written
+
+    cache.persist = persist_then_other_worker
+    cache.commit(path, 2, [("question", "q2"), ("answer", "a2")], "t")
+    cache.flush()
+    assert cached_state(cache, path) == baseline_state(path)
+    assert cache.get(path).last_answer == "a3"
+    assert cache.stats()["reloads"] == 1
@@ -0,0 +1,140 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+import main_new
+from main_new import RequestContext
+from single_flight import Broadcast, SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "answer"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", compute)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("k", compute)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [("answer", False), ("answer", True)]
+    assert flight.stats() == {"inFlight": 0, "leaders": 1, "shared": 1}
+
+
+def test_leader_exception_is_shared_and_entry_forgotten():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    try:
+        flight.do("k", fail)
+    except ValueError:
+        pass
+    assert flight.stats()["inFlight"] == 0
+    assert flight.do("k", lambda: 1) == (1, False)
+
+
+def test_entry_kept_until_stream_finishes():
+    flight = SingleFlight()
+    stream = Broadcast(iter(["a", "b"]))
+    flight.do("k", lambda: stream, until=lambda s: s)
+    assert flight.do("k", lambda: None) == (stream, True)
+
+    assert list(stream.subscribe()) == ["a", "b"]
+    assert flight.stats()["inFlight"] == 0
+
+
+def test_broadcast_replays_to_every_subscriber():
+    pulled = []
+
+    def source():
+        for chunk in ("x", "y", "z"):
+            pulled.append(chunk)
+            yield chunk
+
+    stream = Broadcast(source())
+    first = stream.subscribe()
+    assert next(first) == "x"
+    assert list(stream.subscribe()) == ["x", "y", "z"]
+    assert list(first) == ["y", "z"]
+    assert pulled == ["x", "y", "z"]
+
+
+def run_concurrent_rounds(monkeypatch, tmp_path, questions):
+    """两个请求同时进入 do_new_round，返回各自拿到的回答和 plan_new_round 的调用次数。"""
+    plans = []
+    arrived = threading.Barrier(len(questions))
+    release = threading.Event()
+
+    def fake_plan(user_text, nutrition_kg, keywords=None, stream=False):
+        plans.append(user_text)
+        # 计算期间另一个请求到达，能合并的就会合并
+        release.wait(5)
+        answer = main_new.submit_llm(lambda: f"answer to {user_text}")
+        return {
+            "keywords": ["安神"],
+            "candidates": ["菜"],
+            "top_3": ["菜"],
+            "is_eng": False,
+            "answer": answer,
+        }
+
+    def fake_save(*args, **kwargs):
+        return pd.DataFrame()
+
+    monkeypatch.setattr(main_new, "plan_new_round", fake_plan)
+    monkeypatch.setattr(main_new, "save_top_subject_csvs", fake_save)
+    monkeypatch.setattr(main_new, "ROUND_FLIGHTS", SingleFlight())
+    kg = SimpleNamespace(version=1)
+
+    answers = {}
+
+    def ask(i, question):
+        context = RequestContext(str(tmp_path / f"u{i}_task1.csv"))
+        arrived.wait(5)
+        answers[i] = main_new.do_new_round(context, question, kg)[1]
+
+    threads = [
+        threading.Thread(target=ask, args=(i, q)) for i, q in enumerate(questions)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    release.set()
+    for t in threads:
+        t.join()
+    return answers, plans
+
+
+def test_differently_worded_questions_do_not_share_an_answer(monkeypatch, tmp_path):
+    # 两句话去掉套话后相同（normalize_question 都是“失眠”），但问的不是一回事
+    questions = ["我最近失眠怎么办", "失眠应该怎么调理"]
+    answers, plans = run_concurrent_rounds(monkeypatch, tmp_path, questions)
+
+    assert sorted(plans) == sorted(questions)
+    assert answers == {i: f"answer to {q}" for i, q in enumerate(questions)}
+
+
+def test_questions_differing_in_spacing_and_punctuation_share(monkeypatch, tmp_path):
+    questions = ["我最近失眠怎么办？", "我最近 失眠 怎么办"]
+    answers, plans = run_concurrent_rounds(monkeypatch, tmp_path, questions)
+
+    assert len(plans) == 1
+    assert answers[0] == answers[1] == f"answer to {plans[0]}"
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+import main_new
+from main_new import SPECULATION_STATS, Speculation, resolve, speculate_keywords
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    """把关键词提取的 LLM 调用换成本地记录，返回调用列表。"""
+    calls = []
+
+    def chat(stage, messages, temperature, max_tokens):
+        calls.append(stage)
+        return "(安神)(补血)"
+
+    monkeypatch.setattr(main_new.llm, "chat", chat)
+    return calls
+
+
+def delta(before):
+    after = SPECULATION_STATS.snapshot()
+    return {k: after[k] - before[k] for k in after}
+
+
+def test_used_speculation_returns_the_keywords(llm_calls):
+    before = SPECULATION_STATS.snapshot()
+    keywords = speculate_keywords("最近睡不好")
+    assert resolve(keywords) == ["安神", "补血"]
+    assert llm_calls == ["keywords"]
+    assert delta(before) == {"started": 1, "used": 1, "avoided": 0, "wasted": 0}
+
+
+def test_cancel_before_the_request_sends_nothing(llm_calls, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+    lookup = main_new.KEYWORD_CACHE.lookup
+
+    def slow_lookup(question):
+        # 任务已在线程池中运行，但还没到发请求那一步
+        entered.set()
+        release.wait(5)
+        return lookup(question)
+
+    monkeypatch.setattr(main_new.KEYWORD_CACHE, "lookup", slow_lookup)
+    before = SPECULATION_STATS.snapshot()
+    keywords = speculate_keywords("最近睡不好")
+    assert entered.wait(5)
+    keywords.cancel()
+    release.set()
+    assert keywords.future.result(5) == []
+    assert llm_calls == []
+    assert delta(before) == {"started": 1, "used": 0, "avoided": 1, "wasted": 0}
+
+
+def test_cancel_after_the_request_is_counted_as_wasted():
+    sent = threading.Event()
+
+    def fn(before_request):
+        assert before_request()
+        sent.set()
+        return ["安神"]
+
+    before = SPECULATION_STATS.snapshot()
+    speculation = Speculation(fn)
+    assert sent.wait(5)
+    speculation.future.result(5)
+    speculation.cancel()
+    speculation.cancel()
+    assert delta(before) == {"started": 1, "used": 0, "avoided": 0, "wasted": 1}
+
+
+def test_queued_speculation_is_cancelled_outright():
+    ran = []
+    blockers = [threading.Event() for _ in range(main_new.LLM_POOL._max_workers)]
+    busy = [main_new.submit_llm(e.wait, 5) for e in blockers]
+    try:
+        before = SPECULATION_STATS.snapshot()
+        speculation = Speculation(lambda before_request: ran.append(1))
+        speculation.cancel()
+        assert speculation.future.cancelled()
+    finally:
+        for e in blockers:
+            e.set()
+        for f in busy:
+            f.result(5)
+    assert ran == []
+    assert delta(before) == {"started": 1, "used": 0, "avoided": 1, "wasted": 0}
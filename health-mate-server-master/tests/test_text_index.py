@@ -0,0 +1,66 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from text_index import NgramIndex, StringTable, is_literal
+
+
+def random_strings(rng, count, alphabet="补血气虚脾胃安神ab"):
+    return [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+        for _ in range(count)
+    ]
+
+
+def test_string_table_codes_and_decoding():
+    table = StringTable.build(["补血", "安神", "补血", "b", "a"])
+    assert table.to_list() == sorted({"补血", "安神", "b", "a"})
+    for code, value in enumerate(table.to_list()):
+        assert table.code_of(value) == code
+    assert table.code_of("健脾") == -1
+    assert table.code_of(float("nan")) == -1
+    decoded = table.decode_many(np.array([1, -1, 1, 0]))
+    assert decoded[0] == decoded[2] == table[1]
+    assert pd.isna(decoded[1])
+    assert decoded[3] == table[0]
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_search_matches_substring_scan(n):
+    rng = random.Random(n)
+    table = StringTable.build(random_strings(rng, 300))
+    values = table.to_list()
+    index = NgramIndex.build(table, n=n)
+    patterns = {p for p in random_strings(rng, 200) if p} | {"补血气虚", "x"}
+    for pattern in patterns:
+        expected = [i for i, v in enumerate(values) if pattern in v]
+        assert index.search(pattern).tolist() == expected, pattern
+
+
+def test_search_only_covers_indexed_ids():
+    values = ["补血", "养血", "补气", "血虚"]
+    index = NgramIndex.build(values, value_ids=[0, 2, 3])
+    assert index.search("血").tolist() == [0, 3]
+    assert index.search("").tolist() == [0, 2, 3]
+    assert index.search("养血").tolist() == []
+
+
+def test_is_literal():
+    assert is_literal("补血")
+    assert is_literal("Nourish Blood")
+    for pattern in ["补.", "^养", "a|b", "(干)", "a+", "[ab]"]:
+        assert not is_literal(pattern)
+
+
+def test_object_contains_matches_str_contains(nutrition_kg):
+    store = nutrition_kg.store
+    objects = pd.Series(
+        store.strings.decode_many(store.indexes["object"].present_codes()), dtype=object
+    )
+    for keyword in ["补血", "脾", "Blood", "nourish", "养心安神", "鸡蛋", "补.", "不存在"]:
+        expected = set(objects[objects.str.contains(keyword, na=False)])
+        rows = store.contains("object", keyword)
+        found = set(store.strings.decode_many(store.codes["object"][rows]))
+        assert found == expected, keyword
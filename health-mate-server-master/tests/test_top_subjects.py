@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from test_kg_store import KEYWORD_SETS
+
+
+def get_top50_subjects(df: pd.DataFrame) -> list:
+    """
+    原先 main_new.get_top50_subjects，对 concat 后的检索结果按 subject 计数。
+    value_counts 的排序不稳定，同分食谱的先后没有定义。
+    """
+    if df.empty:
+        return []
+    counts_series = df["subject"].value_counts()
+    subject_counts = list(counts_series.items())
+    subject_counts.sort(key=lambda x: x[1], reverse=True)
+    return [item[0] for item in subject_counts[:50]]
+
+
+@pytest.mark.parametrize(
+    "keywords",
+    KEYWORD_SETS
+    + [
+        ["疏肝", "理气", "健脾", "补肾", "滋阴", "清热", "活血", "解郁", "安神", "化痰"],
+        ["Blood", "Yin"],
+    ],
+)
+def test_top_subjects_match_baseline_ranking(nutrition_kg, baseline_kg, keywords):
+    frames = [
+        baseline_kg.advanced_search("食谱的功效", object_filter=kw, exact_relation=True)
+        for kw in keywords
+        if kw
+    ]
+    frames = [df for df in frames if not df.empty]
+    final_df = (
+        pd.concat(frames, ignore_index=True).drop_duplicates()
+        if frames
+        else pd.DataFrame(columns=["subject", "relation", "object", "csv_idx"])
+    )
+    top = nutrition_kg.top_subjects(keywords, 50)
+    expected = get_top50_subjects(final_df)
+    counts = final_df["subject"].value_counts()
+    # 得分序列相同，高于第 50 名得分的食谱完全相同；同分的只比较得分
+    assert [counts[s] for s in top] == [counts[s] for s in expected]
+    if expected:
+        cutoff = counts[expected[-1]]
+        assert {s for s in top if counts[s] > cutoff} == {
+            s for s in expected if counts[s] > cutoff
+        }
+    # 同分按食谱在 CSV 中首次出现的先后
+    first_row = {s: nutrition_kg.get_full_data_for_subject(s)["csv_idx"].min() for s in top}
+    ranked = [(-counts[s], first_row[s]) for s in top]
+    assert ranked == sorted(ranked)
+
+
+def test_top_subjects_k(nutrition_kg):
+    keywords = ["补血", "安神"]
+    top = nutrition_kg.top_subjects(keywords, 50)
+    assert nutrition_kg.top_subjects(keywords, 3) == top[:3]
+    assert nutrition_kg.top_subjects(keywords, 0) == []
@@ -0,0 +1,94 @@
+import main_new
+from translation_memory import (
+    TranslationMemory,
+    batch_prompt,
+    parse_batch,
+    segment_key,
+    split_segments,
+)
+
+ANSWER = "### 推荐菜谱\n番茄炒蛋\n做法简单\n\n```\ncode\n```\nPlain English line"
+
+
+def test_split_segments_round_trips_the_text():
+    items = split_segments(ANSWER)
+    assert "\n".join(text for _, text in items) == ANSWER
+    assert items[0] == (True, "### 推荐菜谱")
+    assert items[1] == (True, "番茄炒蛋\n做法简单")
+    assert (False, "```") in items
+    assert items[-1] == (False, "Plain English line")
+
+
+def test_segment_key_ignores_width_and_spacing():
+    assert segment_key(" 番茄  炒蛋 ") == segment_key("番茄 炒蛋")
+    assert segment_key("ＡＢＣ") == segment_key("ABC")
+    assert segment_key("番茄") != segment_key("鸡蛋")
+
+
+def test_parse_batch_marks_only_the_tail_as_unclosed():
+    output = batch_prompt(["Tomato", "Egg"]) + "\n"
+    chunks = [output[i : i + 3] for i in range(0, len(output), 3)]
+    assert list(parse_batch(chunks)) == [(0, "Tomato", True), (1, "Egg", False)]
+
+
+def test_translation_memory_skips_empty_translations():
+    memory = TranslationMemory()
+    memory.put("番茄", "")
+    assert memory.get("番茄") is None
+    memory.put("番茄", "Tomato")
+    assert memory.get(" 番茄 ") == "Tomato"
+
+
+class FakeLLM:
+    """批量翻译按给定的结束原因收尾；单段翻译返回固定译文。"""
+
+    def __init__(self, batch_output: str, finish_reason: str):
+        self.batch_output = batch_output
+        self.finish_reason = finish_reason
+        self.max_tokens = []
+        self.single = []
+
+    def stream(self, stage, messages, temperature, max_tokens, on_finish=None):
+        self.max_tokens.append(max_tokens)
+        yield self.batch_output
+        if on_finish is not None:
+            on_finish(self.finish_reason)
+
+    def chat(self, stage, messages, temperature, max_tokens):
+        self.single.append(messages[-1]["content"])
+        return "single: " + messages[-1]["content"]
+
+
+def translate_with(monkeypatch, fake):
+    memory = TranslationMemory()
+    monkeypatch.setattr(main_new, "llm", fake)
+    monkeypatch.setattr(main_new, "TRANSLATION_MEMORY", memory)
+    return "".join(main_new.translation_chunks("番茄炒蛋\n\n鸡蛋汤")), memory
+
+
+def test_truncated_tail_is_retranslated_and_not_cached(monkeypatch):
+    fake = FakeLLM("<<<SEG 0>>>\nTomato and egg\n<<<SEG 1>>>\nEgg so", "length")
+    text, memory = translate_with(monkeypatch, fake)
+
+    assert text == "Tomato and egg\n\nsingle: 鸡蛋汤"
+    assert fake.single == ["鸡蛋汤"]
+    assert memory.get("番茄炒蛋") == "Tomato and egg"
+    assert memory.get("鸡蛋汤") == "single: 鸡蛋汤"
+
+
+def test_tail_is_kept_when_the_stream_stops_normally(monkeypatch):
+    fake = FakeLLM("<<<SEG 0>>>\nTomato and egg\n<<<SEG 1>>>\nEgg soup", "stop")
+    text, memory = translate_with(monkeypatch, fake)
+
+    assert text == "Tomato and egg\n\nEgg soup"
+    assert fake.single == []
+    assert memory.get("鸡蛋汤") == "Egg soup"
+
+
+def test_batch_max_tokens_grows_with_the_batch():
+    short = main_new.translation_max_tokens(["番茄"])
+    long = main_new.translation_max_tokens(["番茄炒蛋" * 500, "鸡蛋汤" * 500])
+    assert short < 1500 < long
+    assert main_new.translation_max_tokens(["汤" * 100000]) == (
+        main_new.TRANSLATION_MAX_OUTPUT_TOKENS
+    )
@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+
+# 出现这些字符时按正则处理，否则子串匹配与 re.search 等价
+REGEX_METACHARS = set(".^$*+?{}[]\\|()")
+
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+
+def is_literal(pattern: str) -> bool:
+    return not any(ch in REGEX_METACHARS for ch in pattern)
+
+
+def char_ngrams(text: str, n: int) -> set:
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def csr_offsets(lengths) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+class StringTable:
+    """
+    去重并按码点排序的字符串表：UTF-8 字节与偏移量分两个数组存放，
+    可以直接从 mmap 打开。编号即排序后的位置，查找用二分。
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+        self._buf = memoryview(self.data)
+        # 进程内的解码缓存，按需填充；末位对应编号 -1，固定为 NaN
+        self._decoded = np.empty(len(self) + 1, dtype=object)
+        self._decoded[-1] = np.nan
+        self._known = np.zeros(len(self) + 1, dtype=bool)
+        self._known[-1] = True
+
+    @classmethod
+    def build(cls, strings) -> "StringTable":
+        encoded = [s.encode("utf-8") for s in sorted(set(strings))]
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, csr_offsets([len(b) for b in encoded]))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code: int) -> str:
+        return str(self._buf[self.offsets[code] : self.offsets[code + 1]], "utf-8")
+
+    def code_of(self, value) -> int:
+        """返回字符串的编号，不在表中时返回 -1。"""
+        if not isinstance(value, str):
+            return -1
+        code = bisect_left(self, value)
+        if code < len(self) and self[code] == value:
+            return code
+        return -1
+
+    def decode_many(self, codes: np.ndarray) -> np.ndarray:
+        """批量解码为 object 数组，-1 解码为 NaN；每个编号在进程内只解码一次。"""
+        codes = np.asarray(codes)
+        for code in np.unique(codes[~self._known[codes]]):
+            self._decoded[code] = self[code]
+            self._known[code] = True
+        return self._decoded[codes]
+
+    def to_list(self) -> list:
+        return [self[i] for i in range(len(self))]
+
+
+class NgramIndex:
+    """
+    字符 n-gram 倒排索引：gram -> 含有该 gram 的取值编号（升序）。
+    长度 1..n 的子串全部入索引，因此不超过 n 个字符的查询可直接命中；
+    更长的查询先对各 n-gram 的倒排表求交得到候选，再逐个校验子串。
+    倒排表以 CSR 数组保存，可与 StringTable 一起落盘后 mmap 打开。
+    """
+
+    def __init__(
+        self,
+        values,
+        value_ids: np.ndarray,
+        grams: StringTable,
+        offsets: np.ndarray,
+        postings: np.ndarray,
+        n: int = 2,
+    ):
+        self.values = values
+        self.value_ids = value_ids
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.n = n
+
+    @classmethod
+    def build(cls, values, value_ids=None, n: int = 2) -> "NgramIndex":
+        """values 支持按编号取值；value_ids 为需要入索引的编号，默认全部。"""
+        if value_ids is None:
+            value_ids = np.arange(len(values), dtype=np.int64)
+        value_ids = np.asarray(value_ids, dtype=np.int64)
+
+        grouped = defaultdict(list)
+        for value_id in value_ids:
+            value = values[value_id]
+            if not isinstance(value, str):
+                continue
+            for k in range(1, n + 1):
+                for gram in char_ngrams(value, k):
+                    grouped[gram].append(value_id)
+
+        grams = StringTable.build(grouped)
+        lists = [grouped[g] for g in grams.to_list()]
+        postings = (
+            np.concatenate([np.asarray(ids, dtype=np.int64) for ids in lists])
+            if lists
+            else _EMPTY_IDS
+        )
+        offsets = csr_offsets([len(ids) for ids in lists])
+        return cls(values, value_ids, grams, offsets, postings, n=n)
+
+    def postings_for(self, gram: str) -> np.ndarray:
+        code = self.grams.code_of(gram)
+        if code < 0:
+            return _EMPTY_IDS
+        return self.postings[self.offsets[code] : self.offsets[code + 1]]
+
+    def search(self, pattern: str) -> np.ndarray:
+        """返回 pattern 为其子串的取值编号，结果与逐个 `pattern in value` 一致。"""
+        if not pattern:
+            return np.asarray(self.value_ids)
+        if len(pattern) <= self.n:
+            return self.postings_for(pattern)
+
+        gram_postings = sorted(
+            (self.postings_for(g) for g in char_ngrams(pattern, self.n)), key=len
+        )
+        candidates = gram_postings[0]
+        for ids in gram_postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        return np.asarray(
+            [i for i in candidates if pattern in self.values[i]], dtype=np.int64
+        )
@@ -0,0 +1,74 @@
+import re
+import unicodedata
+
+try:
+    from opencc import OpenCC
+
+    _T2S = OpenCC("t2s")
+except ImportError:  # opencc 见 requirements.txt；没有安装时退回下面的常用字对照表
+    _T2S = None
+
+# 繁 -> 简 常用字对照（覆盖问诊与饮食场景中的高频字），仅在未安装 opencc 时使用；
+# 表外的繁体字保持原样，相应问句可能无法与简体问句共用关键词缓存
+_TRADITIONAL = (
+    "麼嗎辦這個們為與從過時間長樣點說覺幾後來沒關係會還應該總讓對發給幫問題調"
+    "體頭經氣補腎熱濕虛潤養勞鬱壓營藥醫質環據療強風傷腦記憶齡歲婦兒嬰產貧膽脹"
+    "祕瀉嘔嚨頻夢淺難餓飽運動飲減東緒慮膚適痠請喫穩順腫癢癥纔衛盡斷續乾涼溫節"
+    "歡憂悶緊張聽謝謂將實際鐘懷變錯處麵麪雞鴨魚蝦蠔豬蘿蔔薑蔥"
+)
+_SIMPLIFIED = (
+    "么吗办这个们为与从过时间长样点说觉几后来没关系会还应该总让对发给帮问题调"
+    "体头经气补肾热湿虚润养劳郁压营药医质环据疗强风伤脑记忆龄岁妇儿婴产贫胆胀"
+    "秘泻呕咙频梦浅难饿饱运动饮减东绪虑肤适酸请吃稳顺肿痒症才卫尽断续干凉温节"
+    "欢忧闷紧张听谢谓将实际钟怀变错处面面鸡鸭鱼虾蚝猪萝卜姜葱"
+)
+_T2S_TABLE = str.maketrans(_TRADITIONAL, _SIMPLIFIED)
+
+# 问句首尾的套话，去掉后相似度只由症状、食材等实词决定。
+# 只去首尾：句中的"了""吗""的"等可能改变意思（"吃不了辣" 与 "吃不辣"），不能删
+FILLER_PHRASES = (
+    "怎么办",
+    "怎么样",
+    "怎么",
+    "如何",
+    "请问",
+    "应该",
+    "可以",
+    "有什么",
+    "什么",
+    "哪些",
+    "一下",
+    "调理",
+    "改善",
+    "最近",
+    "总是",
+    "老是",
+    "经常",
+    "感觉",
+    "我",
+    "吗",
+    "呢",
+    "吧",
+    "啊",
+    "了",
+    "的",
+)
+_FILLERS = "|".join(re.escape(p) for p in FILLER_PHRASES)
+_FILLER_RE = re.compile(f"^(?:{_FILLERS})+|(?:{_FILLERS})+$")
+
+
+def to_simplified(text: str) -> str:
+    if _T2S is not None:
+        return _T2S.convert(text)
+    return text.translate(_T2S_TABLE)
+
+
+def normalize_text(text: str) -> str:
+    """全角转半角（NFKC）、繁转简、转小写，去掉标点、符号与空白。"""
+    text = to_simplified(unicodedata.normalize("NFKC", text)).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] in "LN")
+
+
+def normalize_question(text: str) -> str:
+    """normalize_text 之后再去掉首尾的套话，用于近似问句匹配。"""
+    return _FILLER_RE.sub("", normalize_text(text))
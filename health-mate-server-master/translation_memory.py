@@ -0,0 +1,91 @@
+import hashlib
+import re
+import unicodedata
+
+from kg_cache import LRUCache
+
+_CJK = re.compile(r"[一-鿿]")
+_HEADING = re.compile(r"^\s*#{1,6}\s")
+_FENCE = re.compile(r"^\s*```")
+_SPACES = re.compile(r"\s+")
+MARKER = "<<<SEG {}>>>"
+_MARKER_RE = re.compile(r"<<<SEG (\d+)>>>[ \t]*\n?")
+
+
+def split_segments(text: str) -> list:
+    """
+    把 Markdown 回答按行切成块：标题单独成块，连续的非空行合成一个段落，
+    空行与 ``` 围栏行原样保留。返回 [(需要翻译, 文本)]，各块以换行拼回原文。
+    不含中文的块不需要翻译。
+    """
+    items = []
+    paragraph = []
+
+    def close_paragraph():
+        if paragraph:
+            block = "\n".join(paragraph)
+            items.append((bool(_CJK.search(block)), block))
+            paragraph.clear()
+
+    for line in text.split("\n"):
+        if not line.strip() or _FENCE.match(line):
+            close_paragraph()
+            items.append((False, line))
+        elif _HEADING.match(line):
+            close_paragraph()
+            items.append((bool(_CJK.search(line)), line))
+        else:
+            paragraph.append(line)
+    close_paragraph()
+    return items
+
+
+def segment_key(text: str) -> str:
+    """归一化（NFKC、首尾空白、连续空白合一）后的哈希，原文完全相同时自然也相同。"""
+    normalized = _SPACES.sub(" ", unicodedata.normalize("NFKC", text).strip())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def batch_prompt(segments: list) -> str:
+    return "\n".join(f"{MARKER.format(i)}\n{seg}" for i, seg in enumerate(segments))
+
+
+def parse_batch(chunks):
+    """
+    逐块读取批量翻译的输出，每当一个片段结束（遇到下一个标记或输出结束）时
+    产出 (片段序号, 译文, 是否由下一个标记结束)。最后一个片段只靠输出结束来收尾，
+    输出被截断时它可能不完整，由调用方根据结束原因决定是否采用。标记前的多余内容被忽略。
+    """
+    buffer = ""
+    current = None
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            match = _MARKER_RE.search(buffer)
+            if match is None:
+                break
+            if current is not None:
+                yield current, buffer[: match.start()].strip(), True
+            current = int(match.group(1))
+            buffer = buffer[match.end() :]
+    if current is not None:
+        yield current, buffer.strip(), False
+
+
+class TranslationMemory:
+    """
+    片段级翻译记忆：归一化哈希 -> 英文译文，按总字节数与条目数做 LRU 淘汰。
+    """
+
+    def __init__(self, max_entries: int = 20000, max_bytes: int = 32 << 20):
+        self.cache = LRUCache(max_entries, max_bytes)
+
+    def get(self, segment: str):
+        return self.cache.get(segment_key(segment))
+
+    def put(self, segment: str, translation: str):
+        if translation:
+            self.cache.put(segment_key(segment), translation)
+
+    def stats(self) -> dict:
+        return self.cache.stats()